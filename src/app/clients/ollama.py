@@ -1,9 +1,14 @@
 from __future__ import annotations
 
-from typing import List, Dict, Any, AsyncGenerator, Optional, Union
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, AsyncGenerator, AsyncIterator, Iterable, Optional, Set, Tuple, Union
 import httpx
 
 from src.app.config import settings
+from src.app.core import generation_stats
+from src.app.core.metrics import OLLAMA_BACKEND_INFLIGHT, OLLAMA_BACKEND_EJECTIONS_TOTAL
 
 # Reusable async clients to reduce connection overhead
 _client: Optional[httpx.AsyncClient] = None
@@ -28,8 +33,125 @@ def _get_stream_client() -> httpx.AsyncClient:
         _stream_client = httpx.AsyncClient(timeout=None)
     return _stream_client
 
+
+# -------- Backend pool (multi-host routing) --------
+
+def _normalize_base_url(raw: str) -> str:
+    raw = raw.strip().rstrip("/")
+    if not raw.startswith(("http://", "https://")):
+        raw = f"http://{raw}"
+    return raw
+
+
+def _configured_backends() -> List[str]:
+    raw = getattr(settings, "OLLAMA_BACKENDS", None) or ""
+    urls = [_normalize_base_url(u) for u in raw.split(",") if u.strip()]
+    return urls or [f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}"]
+
+
+class Backend:
+    """One Ollama node with its in-flight count and passive health state."""
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+        self.inflight = 0
+        self.fails = 0
+        self.ejected_until = 0.0
+
+    def is_healthy(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.monotonic()) >= self.ejected_until
+
+
+class BackendPool:
+    """Least-outstanding-requests routing over a set of Ollama nodes.
+
+    - Model-aware: nodes with the model loaded (``/api/ps``) are preferred, then nodes that
+      have it locally (``/api/tags``), as known to the model registry; otherwise any node.
+    - Passive health: ``fail_threshold`` consecutive transport errors / 5xx eject a node for
+      ``eject_seconds``. If every node is ejected, routing fails open over all of them.
+    """
+
+    def __init__(self, urls: Iterable[str], *, fail_threshold: int = 3, eject_seconds: float = 30.0) -> None:
+        self.backends: List[Backend] = [Backend(u) for u in urls]
+        self._rr = 0
+        self.fail_threshold = max(1, int(fail_threshold))
+        self.eject_seconds = max(0.0, float(eject_seconds))
+
+    @property
+    def urls(self) -> List[str]:
+        return [b.base_url for b in self.backends]
+
+    def pick(self, model: Optional[str] = None, *, exclude: Iterable[str] = ()) -> Backend:
+        excluded = set(exclude or ())
+        candidates = [b for b in self.backends if b.base_url not in excluded] or list(self.backends)
+        now = time.monotonic()
+        healthy = [b for b in candidates if b.is_healthy(now)]
+        if healthy:
+            candidates = healthy
+        if model:
+            loaded, available = registry.backends_for(model)
+            for preferred in (loaded, available):
+                narrowed = [b for b in candidates if b.base_url in preferred]
+                if narrowed:
+                    candidates = narrowed
+                    break
+        least = min(b.inflight for b in candidates)
+        tied = [b for b in candidates if b.inflight == least]
+        # 并列时轮询，避免空闲时所有请求都落到第一个节点
+        self._rr += 1
+        return tied[self._rr % len(tied)]
+
+    def mark_success(self, backend: Backend) -> None:
+        backend.fails = 0
+        backend.ejected_until = 0.0
+
+    def mark_failure(self, backend: Backend) -> None:
+        backend.fails += 1
+        if backend.fails >= self.fail_threshold:
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            OLLAMA_BACKEND_EJECTIONS_TOTAL.labels(backend=backend.base_url).inc()
+
+    @asynccontextmanager
+    async def lease(self, model: Optional[str] = None, *, exclude: Iterable[str] = ()) -> AsyncIterator[Backend]:
+        backend = self.pick(model, exclude=exclude)
+        backend.inflight += 1
+        OLLAMA_BACKEND_INFLIGHT.labels(backend=backend.base_url).set(backend.inflight)
+        try:
+            yield backend
+        except httpx.TransportError:
+            self.mark_failure(backend)
+            raise
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code >= 500:
+                self.mark_failure(backend)
+            raise
+        else:
+            self.mark_success(backend)
+        finally:
+            backend.inflight -= 1
+            OLLAMA_BACKEND_INFLIGHT.labels(backend=backend.base_url).set(backend.inflight)
+
+
+pool = BackendPool(
+    _configured_backends(),
+    fail_threshold=settings.OLLAMA_BACKEND_FAIL_THRESHOLD,
+    eject_seconds=settings.OLLAMA_BACKEND_EJECT_SECONDS,
+)
+
+
+def configure_backends(urls: Iterable[str]) -> BackendPool:
+    """Replace the backend pool (e.g. in tests or after a config reload)."""
+    global pool
+    pool = BackendPool(
+        [_normalize_base_url(u) for u in urls],
+        fail_threshold=settings.OLLAMA_BACKEND_FAIL_THRESHOLD,
+        eject_seconds=settings.OLLAMA_BACKEND_EJECT_SECONDS,
+    )
+    registry.invalidate()
+    return pool
+
+
 async def generate(prompt: str, model: Optional[str] = None, *, timeout: Optional[float] = None, keep_alive: Optional[Union[str, int]] = None, **kwargs) -> Dict[str, Any]:
-    url = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}/api/generate"
     keep_alive = keep_alive if keep_alive is not None else settings.OLLAMA_KEEP_ALIVE
     payload = {
         "model": model or getattr(settings, "OLLAMA_MODEL", "llama3"),
@@ -46,14 +168,74 @@ async def generate(prompt: str, model: Optional[str] = None, *, timeout: Optiona
         write=10.0,
         pool=10.0,
     )
-    resp = await client.post(url, json=payload, timeout=req_timeout)
-    resp.raise_for_status()
+    async with pool.lease(payload["model"]) as backend:
+        resp = await client.post(f"{backend.base_url}/api/generate", json=payload, timeout=req_timeout)
+        _check_response(resp, payload["model"], backend.base_url)
     return resp.json()
 
 
-async def embeddings(texts: List[str], model: Optional[str] = None, *, timeout: Optional[float] = None) -> List[List[float]]:
-    url = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}/api/embeddings"
+def _is_model_not_found(resp: httpx.Response) -> bool:
+    """Ollama answers 404 with a JSON error mentioning the model when it is not pulled.
+
+    A bare 404 (e.g. "404 page not found") instead means the endpoint itself is missing.
+    """
+    if resp.status_code != 404:
+        return False
+    try:
+        err = str((resp.json() or {}).get("error", ""))
+    except Exception:
+        return False
+    return "model" in err.lower() and "not found" in err.lower()
+
+
+# 各 Ollama 地址是否支持多输入 /api/embed（地址不在字典中表示尚未探测）
+_EMBED_API_SUPPORT: Dict[str, bool] = {}
+
+
+async def _embed_chunk(client: httpx.AsyncClient, texts: List[str], model: str, req_timeout: httpx.Timeout) -> List[List[float]]:
+    """Embed one sub-batch on one backend: /api/embed when supported, else one /api/embeddings call per text."""
+    async with pool.lease(model) as backend:
+        return await _embed_on(client, backend.base_url, texts, model, req_timeout)
+
+
+async def _embed_on(client: httpx.AsyncClient, base_url: str, texts: List[str], model: str, req_timeout: httpx.Timeout) -> List[List[float]]:
+    if _EMBED_API_SUPPORT.get(base_url, True):
+        resp = await client.post(f"{base_url}/api/embed", json={"model": model, "input": texts}, timeout=req_timeout)
+        if resp.status_code == 404 and not _is_model_not_found(resp):
+            # 旧版 Ollama 无 /api/embed：记住结果，后续直接走逐条接口
+            _EMBED_API_SUPPORT[base_url] = False
+        else:
+            _check_response(resp, model, base_url)
+            _EMBED_API_SUPPORT[base_url] = True
+            vectors = (resp.json() or {}).get("embeddings") or []
+            if len(vectors) != len(texts):
+                raise ValueError(f"/api/embed returned {len(vectors)} vectors for {len(texts)} inputs")
+            return vectors
+
     vectors: List[List[float]] = []
+    for text in texts:
+        resp = await client.post(f"{base_url}/api/embeddings", json={"model": model, "prompt": text}, timeout=req_timeout)
+        _check_response(resp, model, base_url)
+        vectors.append(resp.json().get("embedding", []))
+    return vectors
+
+
+async def embeddings(
+    texts: List[str],
+    model: Optional[str] = None,
+    *,
+    timeout: Optional[float] = None,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> List[List[float]]:
+    """Embed texts, preserving input order.
+
+    Inputs are split into sub-batches of ``batch_size`` (default ``OLLAMA_EMBED_BATCH_SIZE``)
+    that are sent concurrently, at most ``concurrency`` at a time
+    (default ``OLLAMA_EMBED_CONCURRENCY``).
+    """
+    if not texts:
+        return []
     client = _get_client(timeout or settings.EMBED_TIMEOUT)
     req_timeout = httpx.Timeout(
         connect=10.0,
@@ -63,23 +245,119 @@ async def embeddings(texts: List[str], model: Optional[str] = None, *, timeout:
     )
     # Prefer a dedicated embedding model if configured
     chosen_model = model or getattr(settings, "OLLAMA_EMBED_MODEL", None) or getattr(settings, "OLLAMA_MODEL", "llama3")
-    for text in texts:
-        payload = {
-            "model": chosen_model,
-            "prompt": text,
-        }
-        resp = await client.post(url, json=payload, timeout=req_timeout)
-        resp.raise_for_status()
-        data = resp.json()
-        vectors.append(data.get("embedding", []))
+    bs = max(1, int(batch_size or settings.OLLAMA_EMBED_BATCH_SIZE))
+    chunks = [texts[i:i + bs] for i in range(0, len(texts), bs)]
+    if len(chunks) == 1:
+        return await _embed_chunk(client, chunks[0], chosen_model, req_timeout)
+
+    sem = asyncio.Semaphore(max(1, int(concurrency or settings.OLLAMA_EMBED_CONCURRENCY)))
+
+    async def _run(chunk: List[str]) -> List[List[float]]:
+        async with sem:
+            return await _embed_chunk(client, chunk, chosen_model, req_timeout)
+
+    results = await asyncio.gather(*[_run(c) for c in chunks])
+    vectors: List[List[float]] = []
+    for part in results:
+        vectors.extend(part)
     return vectors
 
 
-async def ensure_model(model: str, *, timeout: Optional[float] = None) -> bool:
-    """Ensure the given model is available by calling Ollama /api/pull (non-stream).
-    Returns True if pull succeeded (200), False otherwise.
+def _canonical_model(name: str) -> str:
+    """Ollama lists untagged models as ``name:latest``."""
+    name = (name or "").strip()
+    return name if ":" in name else f"{name}:latest"
+
+
+class ModelRegistry:
+    """Cache of per-backend model availability, so hot paths skip ``/api/pull``.
+
+    Availability is resolved from each backend's ``/api/tags`` (local models) and
+    ``/api/ps`` (loaded models); a pull is issued only when no backend lists the model.
+    Concurrent callers for the same model share one in-flight resolution. Positive results
+    are cached for ``ttl`` seconds and dropped early via :meth:`invalidate` when a backend
+    reports the model as not found. The pool uses the same data for model-aware routing.
     """
-    url = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}/api/pull"
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        # (base_url, model) -> expires_at (monotonic)
+        self._available: Dict[Tuple[str, str], float] = {}
+        self._loaded: Dict[Tuple[str, str], float] = {}
+        self._inflight: Dict[str, "asyncio.Future[bool]"] = {}
+
+    def _live(self, table: Dict[Tuple[str, str], float], model: str) -> Set[str]:
+        now = time.monotonic()
+        key = _canonical_model(model)
+        return {url for (url, m), exp in table.items() if m == key and now < exp}
+
+    def backends_for(self, model: str) -> Tuple[Set[str], Set[str]]:
+        """Return (backends with the model loaded, backends with it available)."""
+        return self._live(self._loaded, model), self._live(self._available, model)
+
+    def is_cached(self, model: str, base_url: Optional[str] = None) -> bool:
+        urls = self._live(self._available, model)
+        return bool(urls) if base_url is None else base_url in urls
+
+    def mark_available(self, model: str, base_url: Optional[str] = None, *, loaded: bool = False) -> None:
+        exp = time.monotonic() + max(0.0, self.ttl)
+        for url in ([base_url] if base_url else pool.urls):
+            self._available[(url, _canonical_model(model))] = exp
+            if loaded:
+                self._loaded[(url, _canonical_model(model))] = exp
+
+    def invalidate(self, model: Optional[str] = None, base_url: Optional[str] = None) -> None:
+        key = _canonical_model(model) if model is not None else None
+        for table in (self._available, self._loaded):
+            for k in [k for k in table if (key is None or k[1] == key) and (base_url is None or k[0] == base_url)]:
+                table.pop(k, None)
+
+    async def ensure(self, model: str, *, timeout: Optional[float] = None) -> bool:
+        if self.is_cached(model):
+            return True
+        key = _canonical_model(model)
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._resolve(model, timeout))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _f, k=key: self._inflight.pop(k, None))
+        # shield: 单个等待方取消不应中断其他等待方共享的拉取
+        return await asyncio.shield(fut)
+
+    async def _list_models(self, base_url: str, path: str) -> List[str]:
+        client = _get_client()
+        try:
+            resp = await client.get(f"{base_url}{path}", timeout=httpx.Timeout(5.0))
+            resp.raise_for_status()
+            models = (resp.json() or {}).get("models") or []
+        except Exception:
+            return []
+        return [_canonical_model(str(m.get("name") or m.get("model") or "")) for m in models if isinstance(m, dict)]
+
+    async def _refresh_backend(self, base_url: str, model: str) -> bool:
+        tags, loaded = await asyncio.gather(self._list_models(base_url, "/api/tags"), self._list_models(base_url, "/api/ps"))
+        key = _canonical_model(model)
+        if key in loaded:
+            self.mark_available(model, base_url, loaded=True)
+            return True
+        if key in tags:
+            self.mark_available(model, base_url)
+            return True
+        return False
+
+    async def _resolve(self, model: str, timeout: Optional[float]) -> bool:
+        found = await asyncio.gather(*[self._refresh_backend(url, model) for url in pool.urls])
+        if any(found):
+            return True
+        target = pool.pick().base_url
+        ok = await _pull_model(target, model, timeout=timeout)
+        if ok:
+            self.mark_available(model, target)
+        return ok
+
+
+async def _pull_model(base_url: str, model: str, *, timeout: Optional[float] = None) -> bool:
+    url = f"{base_url}/api/pull"
     payload = {"model": model, "stream": False}
     client = _get_client(timeout or 60.0)
     req_timeout = httpx.Timeout(
@@ -95,9 +373,42 @@ async def ensure_model(model: str, *, timeout: Optional[float] = None) -> bool:
     except Exception:
         return False
 
-async def generate_stream(prompt: str, model: Optional[str] = None, *, keep_alive: Optional[Union[str, int]] = None, **kwargs) -> AsyncGenerator[str, None]:
-    """Stream tokens from Ollama /api/generate (stream=true) and yield plain text chunks."""
-    url = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}/api/generate"
+
+registry = ModelRegistry(ttl=settings.OLLAMA_MODEL_CACHE_TTL)
+
+
+async def ensure_model(model: str, *, timeout: Optional[float] = None) -> bool:
+    """Ensure the given model is available, pulling it only when Ollama does not list it.
+
+    Returns True if the model is (or became) available, False otherwise.
+    """
+    return await registry.ensure(model, timeout=timeout)
+
+
+def _check_response(resp: httpx.Response, model: str, base_url: Optional[str] = None) -> None:
+    """raise_for_status, dropping the registry entry when Ollama reports the model missing."""
+    if _is_model_not_found(resp):
+        registry.invalidate(model, base_url)
+    resp.raise_for_status()
+
+
+async def generate_stream(
+    prompt: str,
+    model: Optional[str] = None,
+    *,
+    keep_alive: Optional[Union[str, int]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    exclude_backends: Iterable[str] = (),
+    **kwargs,
+) -> AsyncGenerator[str, None]:
+    """Stream tokens from Ollama /api/generate (stream=true) and yield plain text chunks.
+
+    When ``stats`` is given it is filled with token accounting from the final frame
+    (see :func:`generation_stats.parse`), with ``ttft_ms`` measured client-side, and
+    ``backend`` is set to the chosen node as soon as it is leased. ``exclude_backends``
+    steers the request away from those nodes when another one is available.
+    """
+    t0 = time.monotonic()
     keep_alive = keep_alive if keep_alive is not None else settings.OLLAMA_KEEP_ALIVE
     payload = {
         "model": model or getattr(settings, "OLLAMA_MODEL", "llama3"),
@@ -107,26 +418,48 @@ async def generate_stream(prompt: str, model: Optional[str] = None, *, keep_aliv
     }
     payload.update(kwargs or {})
     client = _get_stream_client()
-    async with client.stream("POST", url, json=payload) as r:
-        r.raise_for_status()
-        async for line in r.aiter_lines():
-            if not line:
-                continue
-            # Each line is a JSON object like {"response": "...", "done": false}
-            try:
-                import json
-                obj = json.loads(line)
-                chunk = obj.get("response", "")
+    async with pool.lease(payload["model"], exclude=exclude_backends) as backend:
+        if stats is not None:
+            stats["backend"] = backend.base_url
+        async with client.stream("POST", f"{backend.base_url}/api/generate", json=payload) as r:
+            if r.status_code == 404:
+                await r.aread()
+            _check_response(r, payload["model"], backend.base_url)
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                # Each line is a JSON object like {"response": "...", "done": false}
+                try:
+                    import json
+                    obj = json.loads(line)
+                    chunk = obj.get("response", "")
+                except Exception:
+                    # Fallback: yield raw line
+                    yield line
+                    continue
+                if stats is not None:
+                    if chunk and "ttft_ms" not in stats:
+                        stats["ttft_ms"] = round((time.monotonic() - t0) * 1000.0, 2)
+                    if obj.get("done"):
+                        _merge_final_stats(stats, obj)
                 if chunk:
                     yield chunk
-            except Exception:
-                # Fallback: yield raw line
-                yield line
 
 
-async def generate_stream_raw(prompt: str, model: Optional[str] = None, *, keep_alive: Optional[Union[str, int]] = None, **kwargs) -> AsyncGenerator[str, None]:
-    """Pass-through streaming: yield raw JSON-lines from Ollama as-is."""
-    url = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}/api/generate"
+def _merge_final_stats(stats: Dict[str, Any], obj: Dict[str, Any]) -> None:
+    # 客户端实测的首 token 延迟优先于服务端 load + prompt_eval 估计
+    ttft = stats.get("ttft_ms")
+    stats.update(generation_stats.parse(obj))
+    if ttft is not None:
+        stats["ttft_ms"] = ttft
+    if isinstance(obj.get("context"), list):
+        # 会话续聊所需的 KV context
+        stats["context"] = obj["context"]
+
+
+async def generate_stream_raw(prompt: str, model: Optional[str] = None, *, keep_alive: Optional[Union[str, int]] = None, stats: Optional[Dict[str, Any]] = None, **kwargs) -> AsyncGenerator[str, None]:
+    """Pass-through streaming: yield raw JSON-lines from Ollama as-is (``stats`` as in :func:`generate_stream`)."""
+    t0 = time.monotonic()
     keep_alive = keep_alive if keep_alive is not None else settings.OLLAMA_KEEP_ALIVE
     payload = {
         "model": model or getattr(settings, "OLLAMA_MODEL", "llama3"),
@@ -136,8 +469,21 @@ async def generate_stream_raw(prompt: str, model: Optional[str] = None, *, keep_
     }
     payload.update(kwargs or {})
     client = _get_stream_client()
-    async with client.stream("POST", url, json=payload) as r:
-        r.raise_for_status()
-        async for line in r.aiter_lines():
-            if line:
+    async with pool.lease(payload["model"]) as backend:
+        async with client.stream("POST", f"{backend.base_url}/api/generate", json=payload) as r:
+            if r.status_code == 404:
+                await r.aread()
+            _check_response(r, payload["model"], backend.base_url)
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                if stats is not None:
+                    if "ttft_ms" not in stats:
+                        stats["ttft_ms"] = round((time.monotonic() - t0) * 1000.0, 2)
+                    if '"done":true' in line.replace(" ", ""):
+                        try:
+                            import json
+                            _merge_final_stats(stats, json.loads(line))
+                        except Exception:
+                            pass
                 yield line + "\n"
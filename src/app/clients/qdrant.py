@@ -1,97 +1,289 @@
 from __future__ import annotations
 
-from typing import List, Optional, Any, Dict, Union
+import asyncio
+import json
+import time
+from typing import List, Optional, Any, Dict, Tuple, Union
 from uuid import uuid4
-from qdrant_client import QdrantClient
+import httpx
+from pydantic import BaseModel, Field
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http import models as qmodels
+from qdrant_client.http.exceptions import UnexpectedResponse
 
 from src.app.config import settings
 
+# 进程级单例：复用连接池（keep-alive），避免每次调用新建客户端
+_client: Optional[QdrantClient] = None
+_async_client: Optional[AsyncQdrantClient] = None
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    return {
+        "host": settings.QDRANT_HOST,
+        "port": settings.QDRANT_PORT,
+        "grpc_port": settings.QDRANT_GRPC_PORT,
+        "prefer_grpc": settings.QDRANT_PREFER_GRPC,
+        "timeout": settings.QDRANT_TIMEOUT,
+        # qdrant-client 默认关闭 keep-alive（max_keepalive_connections=0），此处显式开启
+        "limits": httpx.Limits(
+            max_connections=settings.QDRANT_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.QDRANT_MAX_CONNECTIONS,
+            keepalive_expiry=settings.QDRANT_KEEPALIVE_EXPIRY,
+        ),
+    }
+
 
 def get_client() -> QdrantClient:
-    return QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+    """Shared sync client, for code that iterates in worker threads (e.g. streaming downloads)."""
+    global _client
+    if _client is None:
+        _client = QdrantClient(**_client_kwargs())
+    return _client
+
+
+def get_async_client() -> AsyncQdrantClient:
+    """Shared async client used by the coroutine helpers below."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncQdrantClient(**_client_kwargs())
+    return _async_client
+
+
+async def close() -> None:
+    """Close the shared clients (called from the FastAPI lifespan)."""
+    global _client, _async_client
+    if _async_client is not None:
+        try:
+            await _async_client.close()
+        except Exception:
+            pass
+        _async_client = None
+    if _client is not None:
+        try:
+            _client.close()
+        except Exception:
+            pass
+        _client = None
+
+
+def _vector_params(info: Any) -> Tuple[Optional[int], Optional[str]]:
+    """Best-effort (size, distance) of a collection's vectors.
+
+    Supports both single-vector and named-vector configurations (first entry wins),
+    falling back to the dumped dict for other SDK shapes.
+    """
+    # qdrant >=1.6: info.config.params.vectors
+    vectors_cfg = getattr(getattr(getattr(info, "config", None), "params", None), "vectors", None)
+    if vectors_cfg is None:
+        # Fallback older or different SDK shapes
+        vectors_cfg = getattr(info, "vectors", None)
+    if isinstance(vectors_cfg, dict) and vectors_cfg:
+        # Named vectors mapping: pick the first entry
+        vectors_cfg = next(iter(vectors_cfg.values()))
+    size = getattr(vectors_cfg, "size", None)
+    distance = getattr(vectors_cfg, "distance", None)
+    if size is None:
+        try:
+            as_dict = info.model_dump() if hasattr(info, "model_dump") else info.dict()  # type: ignore[union-attr]
+            params = as_dict.get("config", {}).get("params", {})
+            vecs = params.get("vectors") or as_dict.get("vectors")
+            if isinstance(vecs, dict) and "size" not in vecs and vecs:
+                vecs = next(iter(vecs.values()))
+            if isinstance(vecs, dict):
+                size = vecs.get("size")
+                distance = distance or vecs.get("distance")
+        except Exception:
+            size = None
+    dist_name = getattr(distance, "value", distance)
+    return (int(size) if size is not None else None), (str(dist_name) if dist_name is not None else None)
+
+
+class CollectionMeta(BaseModel):
+    name: str
+    exists: bool
+    vector_size: int = 0
+    distance: Optional[str] = None
+    # 字段名 -> 索引类型（keyword/integer/...）
+    payload_indexes: Dict[str, str] = Field(default_factory=dict)
+    points_count: Optional[int] = None
+
+
+# 分数为相似度（越大越相似）的度量；Euclid/Manhattan 的分数是距离（越小越相似）
+SIMILARITY_DISTANCES = frozenset({"Cosine", "Dot"})
+
+
+def is_similarity(distance: Optional[str]) -> bool:
+    """Whether search scores under ``distance`` grow with relevance (unknown counts as yes)."""
+    return distance is None or distance in SIMILARITY_DISTANCES
+
+
+class ExtractivePolicy(BaseModel):
+    # top-1 分数不低于该值才直接返回 payload 答案（仅 Cosine/Dot 相似度集合生效；Euclid/Manhattan 集合不走抽取式路径）
+    min_score: float
+    answer_field: str
+
+
+def _extractive_overrides(raw: Optional[str]) -> Dict[str, ExtractivePolicy]:
+    """Parse ``EXTRACTIVE_COLLECTIONS``: ``{"faq": 0.85}`` or ``{"faq": {"min_score": 0.85, "answer_field": "a"}}``."""
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return {}
+    out: Dict[str, ExtractivePolicy] = {}
+    for name, cfg in (data.items() if isinstance(data, dict) else []):
+        if isinstance(cfg, (int, float)):
+            cfg = {"min_score": cfg}
+        if not isinstance(cfg, dict):
+            continue
+        out[str(name)] = ExtractivePolicy(
+            min_score=float(cfg.get("min_score", settings.EXTRACTIVE_MIN_SCORE)),
+            answer_field=str(cfg.get("answer_field") or settings.EXTRACTIVE_ANSWER_FIELD),
+        )
+    return out
 
 
-def ensure_collection(collection_name: str, vector_size: int, distance: qmodels.Distance = qmodels.Distance.COSINE) -> None:
+class CollectionCatalog:
+    """Short-TTL, in-process cache of collection metadata for the retrieval hot paths.
+
+    Holds existence, vector size, distance and payload indexes so a request does not
+    need a ``get_collection`` round trip per check. Schema changes made through this
+    module (``ensure_collection``/``delete_collection``) invalidate the entry; point
+    writes only bump the collection's data version, which downstream caches compare.
+    Per-collection extractive answer policies are configuration rather than cached
+    metadata, so they survive invalidation.
+    """
+
+    def __init__(self, ttl: float, extractive: Optional[Dict[str, ExtractivePolicy]] = None) -> None:
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, CollectionMeta]] = {}
+        self._versions: Dict[str, int] = {}
+        self._inflight: Dict[str, "asyncio.Future[CollectionMeta]"] = {}
+        self._extractive: Dict[str, ExtractivePolicy] = dict(extractive or {})
+
+    async def get(self, name: str) -> CollectionMeta:
+        entry = self._entries.get(name)
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+        fut = self._inflight.get(name)
+        if fut is None:
+            fut = asyncio.ensure_future(self._fetch(name))
+            self._inflight[name] = fut
+            fut.add_done_callback(lambda _f, n=name: self._inflight.pop(n, None))
+        return await asyncio.shield(fut)
+
+    async def _fetch(self, name: str) -> CollectionMeta:
+        try:
+            info = await get_async_client().get_collection(collection_name=name)
+        except UnexpectedResponse as e:
+            meta = CollectionMeta(name=name, exists=False)
+            if e.status_code == 404:
+                self._store(meta)
+            return meta
+        except Exception:
+            # 连接错误等不缓存，下次请求重试
+            return CollectionMeta(name=name, exists=False)
+        size, distance = _vector_params(info)
+        indexes: Dict[str, str] = {}
+        for field_name, idx in (getattr(info, "payload_schema", None) or {}).items():
+            dtype = getattr(idx, "data_type", None)
+            indexes[str(field_name)] = str(getattr(dtype, "value", dtype) or "")
+        meta = CollectionMeta(
+            name=name,
+            exists=True,
+            vector_size=int(size or 0),
+            distance=distance,
+            payload_indexes=indexes,
+            points_count=getattr(info, "points_count", None),
+        )
+        self._store(meta)
+        return meta
+
+    def _store(self, meta: CollectionMeta) -> None:
+        self._entries[meta.name] = (time.monotonic() + max(0.0, self.ttl), meta)
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drop cached metadata (all collections when name is None) and bump data versions."""
+        names = list(self._entries) if name is None else [name]
+        for n in names:
+            self._entries.pop(n, None)
+            self.bump_version(n)
+
+    def bump_version(self, name: str) -> None:
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def version(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    def extractive_policy(self, name: str) -> ExtractivePolicy:
+        """The collection's extractive threshold/answer field, falling back to the global settings."""
+        policy = self._extractive.get(name)
+        if policy is not None:
+            return policy
+        return ExtractivePolicy(min_score=settings.EXTRACTIVE_MIN_SCORE, answer_field=settings.EXTRACTIVE_ANSWER_FIELD)
+
+    def set_extractive_policy(self, name: str, policy: Optional[ExtractivePolicy]) -> None:
+        """Override (or with ``None`` reset to the defaults) one collection's extractive policy."""
+        if policy is None:
+            self._extractive.pop(name, None)
+        else:
+            self._extractive[name] = policy
+
+
+catalog = CollectionCatalog(ttl=settings.QDRANT_CATALOG_TTL, extractive=_extractive_overrides(settings.EXTRACTIVE_COLLECTIONS))
+
+
+async def describe_collection(collection_name: str) -> CollectionMeta:
+    """Cached collection metadata (``exists=False`` when the collection is missing)."""
+    return await catalog.get(collection_name)
+
+
+async def ensure_collection(collection_name: str, vector_size: int, distance: qmodels.Distance = qmodels.Distance.COSINE) -> None:
     """Ensure a Qdrant collection exists with the desired vector size.
 
     If the collection exists but its vector size mismatches, drop and recreate to avoid
     runtime errors like "Vector dimension error: expected dim: X, got Y".
     Supports both single-vector and named-vector configurations.
     """
-    client = get_client()
-    if not collection_exists(collection_name):
-        client.create_collection(
-            collection_name=collection_name,
-            vectors_config=qmodels.VectorParams(size=vector_size, distance=distance),
-        )
+    client = get_async_client()
+    meta = await describe_collection(collection_name)
+    if meta.exists and meta.vector_size == int(vector_size):
         return
-
-    # Collection exists: check its current vector size
+    # 缓存可能已过期：丢弃后从服务端重新读取一次再决定
+    catalog.invalidate(collection_name)
+    meta = await describe_collection(collection_name)
     try:
-        info = client.get_collection(collection_name=collection_name)
-        existing_size = None
-        # Try to navigate common schema layouts
-        vectors_cfg = None
-        # qdrant >=1.6: info.config.params.vectors
-        vectors_cfg = getattr(getattr(getattr(info, "config", None), "params", None), "vectors", None)
-        if vectors_cfg is None:
-            # Fallback older or different SDK shapes
-            vectors_cfg = getattr(info, "vectors", None)
-
-        if isinstance(vectors_cfg, qmodels.VectorParams):
-            existing_size = getattr(vectors_cfg, "size", None)
-        elif isinstance(vectors_cfg, dict):
-            # Named vectors mapping: pick the first entry's size
-            try:
-                first = next(iter(vectors_cfg.values()))
-                existing_size = getattr(first, "size", None)
-            except Exception:
-                existing_size = None
-        # If still unknown, try dict() conversion
-        if existing_size is None:
-            try:
-                as_dict = info.model_dump() if hasattr(info, "model_dump") else info.dict()  # type: ignore[assignment]
-                params = as_dict.get("config", {}).get("params", {})
-                vecs = params.get("vectors") or as_dict.get("vectors")
-                if isinstance(vecs, dict):
-                    first = next(iter(vecs.values()))
-                    existing_size = int(first.get("size")) if isinstance(first, dict) else None
-                elif isinstance(vecs, dict) is False and vecs is not None:
-                    existing_size = int(getattr(vecs, "size", None))
-            except Exception:
-                existing_size = None
-
-        if existing_size is not None and int(existing_size) != int(vector_size):
+        if not meta.exists:
+            await client.create_collection(
+                collection_name=collection_name,
+                vectors_config=qmodels.VectorParams(size=vector_size, distance=distance),
+            )
+        elif meta.vector_size and meta.vector_size != int(vector_size):
             # Recreate with the correct size
-            client.delete_collection(collection_name=collection_name)
-            client.create_collection(
+            await client.delete_collection(collection_name=collection_name)
+            await client.create_collection(
                 collection_name=collection_name,
                 vectors_config=qmodels.VectorParams(size=vector_size, distance=distance),
             )
-    except Exception:
-        # If we fail to introspect, attempt to use the collection as-is
-        # Better fail later with a clear server error than crash here.
-        pass
+    finally:
+        catalog.invalidate(collection_name)
 
 
-def collection_exists(collection_name: str) -> bool:
-    client = get_client()
-    try:
-        _ = client.get_collection(collection_name)
-        return True
-    except Exception:
-        return False
+async def collection_exists(collection_name: str) -> bool:
+    return (await describe_collection(collection_name)).exists
 
 
-def upsert_vectors(collection_name: str, vectors: List[List[float]], payloads: Optional[List[Dict[str, Any]]] = None, ids: Optional[List[Union[str, int]]] = None) -> None:
-    client = get_client()
+async def upsert_vectors(collection_name: str, vectors: List[List[float]], payloads: Optional[List[Dict[str, Any]]] = None, ids: Optional[List[Union[str, int]]] = None) -> None:
+    client = get_async_client()
     points = []
     for i, vec in enumerate(vectors):
         pid = ids[i] if ids and i < len(ids) else str(uuid4())
         pl = payloads[i] if payloads and i < len(payloads) else None
         points.append(qmodels.PointStruct(id=pid, vector=vec, payload=pl))
-    client.upsert(collection_name=collection_name, points=points, wait=True)
+    await client.upsert(collection_name=collection_name, points=points, wait=True)
+    catalog.bump_version(collection_name)
 
 
 def _build_filter(filters: Optional[Dict[str, Any]]) -> Optional[qmodels.Filter]:
@@ -103,35 +295,69 @@ def _build_filter(filters: Optional[Dict[str, Any]]) -> Optional[qmodels.Filter]
     return qmodels.Filter(must=must)
 
 
-def search_vectors(collection_name: str, query: List[float], top_k: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[qmodels.ScoredPoint]:
-    client = get_client()
+async def search_vectors(
+    collection_name: str,
+    query: List[float],
+    top_k: int = 5,
+    filters: Optional[Dict[str, Any]] = None,
+    *,
+    with_vectors: bool = False,
+) -> List[qmodels.ScoredPoint]:
+    client = get_async_client()
+    qf = _build_filter(filters)
+    return await client.search(
+        collection_name=collection_name,
+        query_vector=query,
+        limit=top_k,
+        query_filter=qf,
+        with_vectors=with_vectors,
+    )
+
+
+async def search_batch(
+    collection_name: str,
+    queries: List[List[float]],
+    top_k: int = 5,
+    filters: Optional[Dict[str, Any]] = None,
+    *,
+    with_vectors: bool = False,
+) -> List[List[qmodels.ScoredPoint]]:
+    """Many searches in one ``search_batch`` round trip; results are aligned with ``queries``."""
+    if not queries:
+        return []
+    client = get_async_client()
     qf = _build_filter(filters)
-    return client.search(collection_name=collection_name, query_vector=query, limit=top_k, query_filter=qf)
+    requests = [
+        qmodels.SearchRequest(vector=q, limit=top_k, filter=qf, with_payload=True, with_vector=with_vectors)
+        for q in queries
+    ]
+    return await client.search_batch(collection_name=collection_name, requests=requests)
 
 
 # -------- Collection & Points Management --------
 
-def list_collections() -> List[str]:
-    client = get_client()
-    cols = client.get_collections()
+async def list_collections() -> List[str]:
+    client = get_async_client()
+    cols = await client.get_collections()
     # cols.collections: List[CollectionDescription]
     return [c.name for c in getattr(cols, "collections", [])]
 
 
-def delete_collection(collection_name: str) -> None:
-    client = get_client()
-    client.delete_collection(collection_name=collection_name)
+async def delete_collection(collection_name: str) -> None:
+    client = get_async_client()
+    await client.delete_collection(collection_name=collection_name)
+    catalog.invalidate(collection_name)
 
 
-def clear_collection(collection_name: str) -> None:
+async def clear_collection(collection_name: str) -> None:
     """Delete all points in a collection (keep schema) by scrolling IDs in batches.
 
     This avoids relying on server/SDK support for AllSelector and works across versions.
     """
-    client = get_client()
+    client = get_async_client()
     next_page: Optional[qmodels.ScrollOffset] = None
     while True:
-        resp = client.scroll(
+        resp = await client.scroll(
             collection_name=collection_name,
             limit=1000,
             with_vectors=False,
@@ -143,37 +369,40 @@ def clear_collection(collection_name: str) -> None:
             break
         ids = [p.id for p in points]
         if ids:
-            client.delete(collection_name=collection_name, points_selector=qmodels.PointIdsList(points=ids), wait=True)
+            await client.delete(collection_name=collection_name, points_selector=qmodels.PointIdsList(points=ids), wait=True)
+    catalog.bump_version(collection_name)
 
 
-def delete_points_by_ids(collection_name: str, ids: List[Union[str, int]]) -> int:
-    client = get_client()
-    client.delete(collection_name=collection_name, points_selector=qmodels.PointIdsList(points=ids), wait=True)
+async def delete_points_by_ids(collection_name: str, ids: List[Union[str, int]]) -> int:
+    client = get_async_client()
+    await client.delete(collection_name=collection_name, points_selector=qmodels.PointIdsList(points=ids), wait=True)
+    catalog.bump_version(collection_name)
     return len(ids)
 
 
-def delete_points_by_filter(collection_name: str, filters: Dict[str, Any]) -> int:
+async def delete_points_by_filter(collection_name: str, filters: Dict[str, Any]) -> int:
     """Delete by filter and return affected count.
 
     Use Qdrant count API to get affected rows, then perform delete with FilterSelector.
     This avoids potential infinite loops or long scans with scroll.
     """
-    client = get_client()
+    client = get_async_client()
     flt = _build_filter(filters)
     # count via count API (exact)
     try:
-        cnt = client.count(collection_name=collection_name, count_filter=flt, exact=True)
+        cnt = await client.count(collection_name=collection_name, count_filter=flt, exact=True)
         total = int(getattr(cnt, "count", 0))
     except Exception:
         total = 0
     # perform delete
-    client.delete(collection_name=collection_name, points_selector=qmodels.FilterSelector(filter=flt), wait=True)
+    await client.delete(collection_name=collection_name, points_selector=qmodels.FilterSelector(filter=flt), wait=True)
+    catalog.bump_version(collection_name)
     return total
 
 
-def get_collection_info(collection_name: str) -> Dict[str, Any]:
-    client = get_client()
-    info = client.get_collection(collection_name=collection_name)
+async def get_collection_info(collection_name: str) -> Dict[str, Any]:
+    client = get_async_client()
+    info = await client.get_collection(collection_name=collection_name)
     # pydantic model -> dict
     try:
         return info.model_dump()  # type: ignore[attr-defined]
@@ -28,18 +28,108 @@ class Settings(BaseSettings):
     QDRANT_HOST: str = "qdrant"
     QDRANT_PORT: int = 6333
     QDRANT_COLLECTION: str = "default_collection"
+    # 进程级客户端：可选 gRPC 传输与 keep-alive 连接池
+    QDRANT_PREFER_GRPC: bool = False
+    QDRANT_GRPC_PORT: int = 6334
+    QDRANT_TIMEOUT: Optional[int] = None
+    QDRANT_MAX_CONNECTIONS: int = 32
+    QDRANT_KEEPALIVE_EXPIRY: float = 30.0
+    # 集合元数据缓存（存在性/维度/距离/payload 索引）TTL（秒）
+    QDRANT_CATALOG_TTL: float = 10.0
 
     # Ollama
     OLLAMA_HOST: str = "ollama"
     OLLAMA_PORT: int = 11434
     OLLAMA_MODEL: str = "phi3:mini"
     OLLAMA_KEEP_ALIVE: Union[str, int] = "30m"
+    # 多节点：逗号分隔的 host:port 或 http(s):// 地址；为空时使用 OLLAMA_HOST/OLLAMA_PORT
+    OLLAMA_BACKENDS: Optional[str] = None
+    # 被动健康检查：连续失败次数达到阈值后摘除节点的时长（秒）
+    OLLAMA_BACKEND_FAIL_THRESHOLD: int = 3
+    OLLAMA_BACKEND_EJECT_SECONDS: float = 30.0
     # Optional dedicated embedding model; default to a fast general embedder. Override via env if needed.
     OLLAMA_EMBED_MODEL: Optional[str] = "nomic-embed-text"
+    # 批量嵌入：每个子批次的文本数与并发子批次上限
+    OLLAMA_EMBED_BATCH_SIZE: int = 32
+    OLLAMA_EMBED_CONCURRENCY: int = 4
+    # 查询嵌入跨请求微批：最长等待窗口（毫秒）与单批条数上限
+    EMBED_MICROBATCH_ENABLED: bool = True
+    EMBED_MICROBATCH_WAIT_MS: float = 5.0
+    EMBED_MICROBATCH_MAX_ITEMS: int = 32
+    # 查询向量缓存：进程内 LRU 条数上限 + 可选 Redis 二级缓存（float32 字节存储）
+    EMBED_CACHE_ENABLED: bool = True
+    EMBED_CACHE_MAX_ENTRIES: int = 4096
+    EMBED_CACHE_REDIS_ENABLED: bool = False
+    EMBED_CACHE_REDIS_TTL: int = 604800
+    # 上下文打包：MMR 相关性权重（1 为纯相关性）与近重复判定的 shingle Jaccard 阈值
+    RAG_MMR_LAMBDA: float = 0.7
+    RAG_DEDUP_JACCARD: float = 0.8
+    # 语义答案缓存（/api/v1/ask）：余弦距离阈值内的相似问题直接复用已缓存答案
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_MAX_DISTANCE: float = 0.05
+    SEMANTIC_CACHE_TTL: float = 3600.0
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 2048
+    # 抽取式快速路径（请求 answer_mode=extractive 时生效）：top-1 分数不低于阈值且 payload 含答案字段时直接返回，不调用 LLM
+    EXTRACTIVE_MIN_SCORE: float = 0.9
+    EXTRACTIVE_ANSWER_FIELD: str = "answer"
+    # 按集合覆盖（JSON）：{"faq": 0.85} 或 {"faq": {"min_score": 0.85, "answer_field": "a"}}；运行时可经 /collections/{name}/extractive 调整
+    EXTRACTIVE_COLLECTIONS: Optional[str] = None
+    # /chat/rag_eval：每批查询数（一次嵌入 + 一次 search_batch）与同时进行的批次数
+    RAG_EVAL_BATCH_SIZE: int = 64
+    RAG_EVAL_CONCURRENCY: int = 4
+    # 评测运行（/api/v1/admin/evals/{id}/runs）：全局并发执行的评测项上限（工作池）与单次运行的默认并发
+    EVAL_RUNNER_WORKERS: int = 8
+    EVAL_RUN_CONCURRENCY: int = 4
+    # 评测集/评测项/运行记录存储：sqlite（WAL，默认）或 postgres（复用 POSTGRES_* 连接）
+    ADMIN_STORE_BACKEND: str = "sqlite"
+    ADMIN_STORE_PATH: str = "data/admin_evals.db"
+    # 评测运行心跳间隔（秒）：各 worker 定期刷新自己运行的心跳，连续 3 次未刷新的运行视为中断并标记 failed；0 关闭
+    ADMIN_RUN_HEARTBEAT_INTERVAL: float = 10.0
+    # 工具网关 http_get/http_post 连接池：按 (scheme, host, 超时档位) 复用客户端；单池连接上限、keep-alive 过期（秒）、
+    # 是否启用 HTTP/2（需安装 h2）、DNS 缓存 TTL（秒，0 关闭）与最多保留的客户端数（超出时淘汰最久未用）
+    TOOLS_HTTP_MAX_CONNECTIONS: int = 20
+    TOOLS_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    TOOLS_HTTP2: bool = False
+    TOOLS_HTTP_DNS_CACHE_TTL: float = 0.0
+    TOOLS_HTTP_MAX_POOLS: int = 64
+    # 工具执行器进程内状态表上限：缓存条目数、限流/熔断条目数（均按 LRU 淘汰）；熔断失败计数的空闲过期（秒）与过期清理间隔（秒）
+    TOOLS_CACHE_MAX_ENTRIES: int = 2048
+    TOOLS_STATE_MAX_ENTRIES: int = 10000
+    TOOLS_BREAKER_IDLE_TTL: float = 300.0
+    TOOLS_STATE_SWEEP_INTERVAL: float = 5.0
+    # 工具网关状态后端（限流/熔断/结果缓存）：memory（进程内，默认）或 redis（多 worker/Pod 共享）；可由策略 options.state_backend 覆盖
+    TOOLS_STATE_BACKEND: str = "memory"
+    TOOLS_REDIS_PREFIX: str = "tools:"
+    # 工具网关限流默认算法（token_bucket / sliding_window / fixed_window）与默认最长等待令牌时间（毫秒，0 表示直接 429，上限 5000）
+    TOOLS_RATE_LIMIT_ALGORITHM: str = "token_bucket"
+    TOOLS_RATE_LIMIT_MAX_WAIT_MS: int = 0
+    # 模型可用性缓存 TTL（秒）；命中时跳过 /api/pull
+    OLLAMA_MODEL_CACHE_TTL: float = 600.0
 
     # Timeouts (seconds)
     GENERATE_TIMEOUT: float = 300.0
     EMBED_TIMEOUT: float = 120.0
+    # /api/v1/ask 与 /api/v1/rag/preflight 的端到端预算（毫秒，0 表示不限）；可由请求头 X-Request-Deadline-Ms 覆盖
+    REQUEST_DEADLINE_MS: int = 120000
+    # SSE 流式引擎：生产者与套接字之间的有界队列长度（满时暂停读取上游，形成背压）
+    SSE_QUEUE_SIZE: int = 64
+    # SSE 小分片合并窗口（毫秒，0 表示不合并）与单帧合并字节上限
+    SSE_FLUSH_MS: float = 5.0
+    SSE_FLUSH_BYTES: int = 512
+    # /ask/stream 对冲生成：主请求在 TTFT 的 p 分位延迟内无首包才启动对冲；对冲占比上限与首包总超时
+    HEDGE_ENABLED: bool = True
+    HEDGE_QUANTILE: float = 0.95
+    HEDGE_MIN_SAMPLES: int = 20
+    HEDGE_DEFAULT_DELAY_MS: float = 1500.0
+    HEDGE_MIN_DELAY_MS: float = 200.0
+    HEDGE_MAX_RATIO: float = 0.1
+    HEDGE_PREFER_OTHER_BACKEND: bool = True
+    HEDGE_FIRST_TOKEN_TIMEOUT_MS: float = 8000.0
+    # 会话：复用 Ollama 返回的 context；空闲过期（秒）、每租户会话上限、单会话 context token 上限、是否同步到 Redis
+    CHAT_SESSION_TTL: float = 1800.0
+    CHAT_SESSION_MAX_PER_TENANT: int = 100
+    CHAT_SESSION_MAX_CONTEXT_TOKENS: int = 8192
+    CHAT_SESSION_REDIS_ENABLED: bool = False
 
     # Defaults for search/generation
     DEFAULT_TOP_K: int = 1
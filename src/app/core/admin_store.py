@@ -0,0 +1,375 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from src.app.config import settings
+
+logger = logging.getLogger("admin_store")
+
+# (sql, 参数行列表)：同一事务内按顺序 executemany
+_Op = Tuple[str, Sequence[Sequence[Any]]]
+
+# 本进程的标识：写入运行记录的 owner，用于区分其他 worker 仍在执行的运行与已失联的运行
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 时间戳以 ISO 字符串、指标/评测项以 JSON 文本存储，SQLite 与 Postgres 共用同一套 SQL
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS admin_evals (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        items_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS admin_eval_items (
+        eval_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (eval_id, seq)
+    )""",
+    """CREATE TABLE IF NOT EXISTS admin_eval_runs (
+        id TEXT PRIMARY KEY,
+        eval_id TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        status TEXT NOT NULL,
+        metrics TEXT NOT NULL,
+        owner TEXT,
+        heartbeat_at DOUBLE PRECISION
+    )""",
+    "CREATE INDEX IF NOT EXISTS admin_eval_runs_created ON admin_eval_runs (created_at)",
+    "CREATE INDEX IF NOT EXISTS admin_eval_runs_eval ON admin_eval_runs (eval_id)",
+)
+
+# 旧库升级时补齐的运行表列（owner / 心跳时间，epoch 秒）
+_RUN_COLUMNS_ADDED = (("owner", "TEXT"), ("heartbeat_at", "DOUBLE PRECISION"))
+
+_EVAL_COLS = "id, name, description, created_at, updated_at, items_count"
+_RUN_COLS = "id, eval_id, created_at, status, metrics"
+
+
+def _run_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(row)
+    out["metrics"] = json.loads(out.get("metrics") or "{}")
+    return out
+
+
+class AdminStore(ABC):
+    """Row-level storage for admin evals, eval items and eval runs.
+
+    Every mutation touches only the affected rows (items are appended, a run's progress
+    update rewrites that run only), and list endpoints page with ``LIMIT``/``OFFSET``.
+    Subclasses provide two primitives: :meth:`_query` and :meth:`_write` (one transaction).
+    Records are plain dicts with ISO-8601 timestamps, ready for the pydantic models.
+
+    Each run row records the worker that owns it and a heartbeat; :meth:`mark_interrupted`
+    only fails queued/running runs whose owner stopped heartbeating.
+    """
+
+    placeholder = "?"
+
+    @abstractmethod
+    async def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        """Rows of one statement as dicts."""
+
+    @abstractmethod
+    async def _write(self, ops: List[_Op]) -> None:
+        """Run ``ops`` in order inside one transaction."""
+
+    def _sql(self, sql: str) -> str:
+        return sql if self.placeholder == "?" else sql.replace("?", self.placeholder)
+
+    def _limit(self, limit: Optional[int]) -> Optional[int]:
+        # 不分页：SQLite 用 LIMIT -1，Postgres 用 LIMIT NULL
+        if limit is not None:
+            return max(0, int(limit))
+        return -1 if self.placeholder == "?" else None
+
+    async def close(self) -> None:
+        return None
+
+    # --- evals ---
+    async def list_evals(self, *, limit: Optional[int] = None, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        rows = await self._query(
+            f"SELECT {_EVAL_COLS} FROM admin_evals ORDER BY created_at, id LIMIT ? OFFSET ?",
+            (self._limit(limit), max(0, offset)),
+        )
+        total = (await self._query("SELECT COUNT(*) AS n FROM admin_evals"))[0]["n"]
+        return rows, int(total)
+
+    async def get_eval(self, eval_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._query(f"SELECT {_EVAL_COLS} FROM admin_evals WHERE id = ?", (eval_id,))
+        return rows[0] if rows else None
+
+    async def put_eval(self, rec: Dict[str, Any]) -> None:
+        await self._write([(
+            f"INSERT INTO admin_evals ({_EVAL_COLS}) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET name = excluded.name, description = excluded.description, "
+            "updated_at = excluded.updated_at, items_count = excluded.items_count",
+            [(rec["id"], rec["name"], rec.get("description"), rec["created_at"], rec["updated_at"], int(rec.get("items_count", 0)))],
+        )])
+
+    async def delete_eval(self, eval_id: str) -> None:
+        """Delete the eval together with its items and runs."""
+        await self._write([
+            ("DELETE FROM admin_eval_items WHERE eval_id = ?", [(eval_id,)]),
+            ("DELETE FROM admin_eval_runs WHERE eval_id = ?", [(eval_id,)]),
+            ("DELETE FROM admin_evals WHERE id = ?", [(eval_id,)]),
+        ])
+
+    # --- items（只追加） ---
+    async def add_items(self, eval_id: str, items: Sequence[Dict[str, Any]], *, updated_at: str) -> None:
+        if not items:
+            return
+        await self._write([
+            # 先更新评测行：在 Postgres 上持有该行锁直至提交，使同一评测的并发导入串行分配 seq
+            (
+                "UPDATE admin_evals SET items_count = items_count + ?, updated_at = ? WHERE id = ?",
+                [(len(items), updated_at, eval_id)],
+            ),
+            (
+                "INSERT INTO admin_eval_items (eval_id, seq, data) VALUES "
+                "(?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM admin_eval_items WHERE eval_id = ?), ?)",
+                [(eval_id, eval_id, json.dumps(it, ensure_ascii=False)) for it in items],
+            ),
+        ])
+
+    async def list_items(self, eval_id: str) -> List[Dict[str, Any]]:
+        rows = await self._query("SELECT data FROM admin_eval_items WHERE eval_id = ? ORDER BY seq", (eval_id,))
+        return [json.loads(r["data"]) for r in rows]
+
+    # --- runs ---
+    async def put_run(self, run: Dict[str, Any], *, owner: str = WORKER_ID) -> None:
+        """Insert or update a run, recording ``owner`` and refreshing its heartbeat."""
+        await self._write([(
+            f"INSERT INTO admin_eval_runs ({_RUN_COLS}, owner, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET status = excluded.status, metrics = excluded.metrics, "
+            "owner = excluded.owner, heartbeat_at = excluded.heartbeat_at",
+            [(
+                run["id"], run["eval_id"], run["created_at"], run["status"],
+                json.dumps(run.get("metrics") or {}, ensure_ascii=False), owner, time.time(),
+            )],
+        )])
+
+    async def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._query(f"SELECT {_RUN_COLS} FROM admin_eval_runs WHERE id = ?", (run_id,))
+        return _run_row(rows[0]) if rows else None
+
+    async def list_runs(
+        self, *, eval_id: Optional[str] = None, limit: Optional[int] = None, offset: int = 0,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Runs newest first, optionally only those of one eval."""
+        where, params = ("WHERE eval_id = ?", (eval_id,)) if eval_id else ("", ())
+        rows = await self._query(
+            f"SELECT {_RUN_COLS} FROM admin_eval_runs {where} ORDER BY created_at DESC, id LIMIT ? OFFSET ?",
+            params + (self._limit(limit), max(0, offset)),
+        )
+        total = (await self._query(f"SELECT COUNT(*) AS n FROM admin_eval_runs {where}", params))[0]["n"]
+        return [_run_row(r) for r in rows], int(total)
+
+    async def heartbeat(self, owner: str = WORKER_ID) -> None:
+        """Refresh the heartbeat of the queued/running runs owned by ``owner``."""
+        await self._write([(
+            "UPDATE admin_eval_runs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+            [(time.time(), owner)],
+        )])
+
+    async def mark_interrupted(self, *, stale_after: float, owner: str = WORKER_ID) -> int:
+        """Mark queued/running runs of other workers failed once their heartbeat is older
+        than ``stale_after`` seconds (their worker is gone and they can not resume).
+
+        Runs owned by ``owner`` are left alone; the update re-checks the heartbeat so a
+        run whose owner wrote progress in the meantime is not clobbered.
+        """
+        cutoff = time.time() - max(0.0, float(stale_after))
+        stale = "status IN ('queued', 'running') AND (owner IS NULL OR owner <> ?) AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+        rows = await self._query(f"SELECT {_RUN_COLS} FROM admin_eval_runs WHERE {stale}", (owner, cutoff))
+        if not rows:
+            return 0
+        await self._write([(
+            f"UPDATE admin_eval_runs SET status = 'failed', metrics = ? WHERE id = ? AND {stale}",
+            [
+                (json.dumps({**_run_row(r)["metrics"], "error": "interrupted"}, ensure_ascii=False), r["id"], owner, cutoff)
+                for r in rows
+            ],
+        )])
+        return len(rows)
+
+
+class SQLiteAdminStore(AdminStore):
+    """SQLite in WAL mode; statements run in a worker thread so the event loop never blocks.
+
+    Opened lazily on first use. The legacy JSON file given as ``legacy_json`` (``get_store``
+    passes ``data/admin_evals.json``) is imported once into an empty database and renamed
+    to ``*.migrated``.
+    """
+
+    def __init__(self, path: str, legacy_json: Optional[str] = None) -> None:
+        self.path = path
+        self.legacy_json = legacy_json
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                for stmt in _SCHEMA:
+                    conn.execute(stmt)
+                cols = {r["name"] for r in conn.execute("PRAGMA table_info(admin_eval_runs)")}
+                for name, kind in _RUN_COLUMNS_ADDED:
+                    if name not in cols:
+                        conn.execute(f"ALTER TABLE admin_eval_runs ADD COLUMN {name} {kind}")
+            self._conn = conn
+            self._migrate_legacy(conn)
+        return self._conn
+
+    def _migrate_legacy(self, conn: sqlite3.Connection) -> None:
+        src = Path(self.legacy_json) if self.legacy_json else None
+        if src is None or not src.exists():
+            return
+        if conn.execute("SELECT COUNT(*) FROM admin_evals").fetchone()[0]:
+            return
+        try:
+            data = json.loads(src.read_text())
+            with conn:
+                for v in (data.get("evals") or {}).values():
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO admin_evals ({_EVAL_COLS}) VALUES (?, ?, ?, ?, ?, ?)",
+                        (v["id"], v["name"], v.get("description"), v["created_at"], v["updated_at"], int(v.get("items_count", 0))),
+                    )
+                for eid, items in (data.get("eval_items") or {}).items():
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO admin_eval_items (eval_id, seq, data) VALUES (?, ?, ?)",
+                        [(eid, i + 1, json.dumps(it, ensure_ascii=False)) for i, it in enumerate(items)],
+                    )
+                for v in (data.get("eval_runs") or {}).values():
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO admin_eval_runs ({_RUN_COLS}) VALUES (?, ?, ?, ?, ?)",
+                        (v["id"], v["eval_id"], v["created_at"], v.get("status", "completed"), json.dumps(v.get("metrics") or {}, ensure_ascii=False)),
+                    )
+            src.rename(src.with_name(src.name + ".migrated"))
+            logger.info("admin_store_migrated legacy=%s db=%s", src, self.path)
+        except Exception as e:
+            # 迁移失败不阻断启动，保留原文件以便排查
+            logger.warning("admin_store_migration_failed legacy=%s error=%s: %s", src, type(e).__name__, e)
+
+    def _run_sync(self, fn: Any) -> Any:
+        with self._lock:
+            return fn(self._connect())
+
+    async def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        def run(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            return [dict(r) for r in conn.execute(sql, tuple(params)).fetchall()]
+
+        return await asyncio.to_thread(self._run_sync, run)
+
+    async def _write(self, ops: List[_Op]) -> None:
+        def run(conn: sqlite3.Connection) -> None:
+            with conn:
+                for sql, rows in ops:
+                    conn.executemany(sql, [tuple(r) for r in rows])
+
+        await asyncio.to_thread(self._run_sync, run)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class PostgresAdminStore(AdminStore):
+    """Same tables in Postgres through the shared psycopg client (one connection per call)."""
+
+    placeholder = "%s"
+
+    def __init__(self) -> None:
+        self._schema_ready = False
+
+    async def _connection(self) -> Any:
+        from psycopg.rows import dict_row
+
+        from src.app.clients import postgres
+
+        conn = await postgres.get_connection()
+        conn.row_factory = dict_row
+        if not self._schema_ready:
+            async with conn.transaction():
+                for stmt in _SCHEMA:
+                    await conn.execute(stmt)
+                for name, kind in _RUN_COLUMNS_ADDED:
+                    await conn.execute(f"ALTER TABLE admin_eval_runs ADD COLUMN IF NOT EXISTS {name} {kind}")
+            self._schema_ready = True
+        return conn
+
+    async def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        conn = await self._connection()
+        async with conn:
+            cur = await conn.execute(self._sql(sql), tuple(params))
+            return [dict(r) for r in await cur.fetchall()]
+
+    async def _write(self, ops: List[_Op]) -> None:
+        conn = await self._connection()
+        async with conn:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    for sql, rows in ops:
+                        await cur.executemany(self._sql(sql), [tuple(r) for r in rows])
+
+
+_store: Optional[AdminStore] = None
+
+
+def get_store() -> AdminStore:
+    """Process-wide store selected by ``ADMIN_STORE_BACKEND`` (created on first use)."""
+    global _store
+    if _store is None:
+        if (settings.ADMIN_STORE_BACKEND or "sqlite").lower() == "postgres":
+            _store = PostgresAdminStore()
+        else:
+            _store = SQLiteAdminStore(settings.ADMIN_STORE_PATH, legacy_json=str(Path("data") / "admin_evals.json"))
+    return _store
+
+
+def set_store(store: Optional[AdminStore]) -> None:
+    """Swap the process-wide store (tests, or re-reading settings)."""
+    global _store
+    _store = store
+
+
+async def run_heartbeat(interval: float) -> None:
+    """Refresh this worker's run heartbeats every ``interval`` seconds and fail runs of
+    workers that missed three heartbeats (started from the FastAPI lifespan)."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            store = get_store()
+            await store.heartbeat()
+            await store.mark_interrupted(stale_after=3 * interval)
+        except Exception as e:
+            logger.warning("admin_store_heartbeat_failed error=%s: %s", type(e).__name__, e)
+
+
+async def close() -> None:
+    """Close the process-wide store if it was opened (called from the FastAPI lifespan)."""
+    if _store is not None:
+        await _store.close()
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import math
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from src.app.clients.qdrant import is_similarity
+from src.app.config import settings
+
+# 经验校准：CJK 字符约 1 token/字；其他字符（拉丁字母、数字、标点、空白）约 4 字符/token
+_CHARS_PER_TOKEN_OTHER = 4.0
+# 剩余预算不足该值时不再截断塞入新片段
+_MIN_PASSAGE_TOKENS = 24
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF
+        or 0x3400 <= code <= 0x4DBF
+        or 0x3000 <= code <= 0x30FF  # CJK 标点、日文假名
+        or 0xAC00 <= code <= 0xD7AF  # 韩文
+        or 0xFF00 <= code <= 0xFFEF  # 全角字符
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Calibrated token estimate for llama-family tokenizers without loading one."""
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    other = len(text) - cjk
+    return cjk + int(math.ceil(other / _CHARS_PER_TOKEN_OTHER))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of ``text`` whose estimated token count fits ``max_tokens``."""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = float(max_tokens)
+    for i, ch in enumerate(text):
+        budget -= 1.0 if _is_cjk(ch) else 1.0 / _CHARS_PER_TOKEN_OTHER
+        if budget < 0:
+            return text[:i]
+    return text
+
+
+def shingles(text: str, k: int = 3) -> Set[str]:
+    """Character k-shingles over normalized text (works for CJK without word segmentation)."""
+    norm = "".join(unicodedata.normalize("NFKC", text).lower().split())
+    if len(norm) <= k:
+        return {norm} if norm else set()
+    return {norm[i:i + k] for i in range(len(norm) - k + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / float(len(a | b))
+
+
+def _vector_of(point: Any) -> Optional[np.ndarray]:
+    vec = getattr(point, "vector", None)
+    if isinstance(vec, dict):
+        # 命名向量：取第一个
+        vec = next(iter(vec.values()), None)
+    if not isinstance(vec, (list, tuple)) or not vec:
+        return None
+    arr = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm else None
+
+
+def _relevance(scores: Sequence[float], distance: Optional[str]) -> List[float]:
+    # 距离度量（越小越相似）改用名次换算相关度：最近者 1.0，依次递减 1/n
+    if is_similarity(distance):
+        return list(scores)
+    n = len(scores)
+    order = sorted(range(n), key=lambda i: scores[i])
+    rel = [0.0] * n
+    for rank, i in enumerate(order):
+        rel[i] = 1.0 - rank / float(n)
+    return rel
+
+
+def pack_contexts(
+    scored: Sequence[Any],
+    *,
+    max_docs: int,
+    max_tokens: int,
+    per_doc_max_tokens: int,
+    mmr_lambda: Optional[float] = None,
+    dedup_threshold: Optional[float] = None,
+    distance: Optional[str] = None,
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Select and trim retrieved passages into a token budget.
+
+    Passages are chosen greedily by maximal marginal relevance: Qdrant's relevance score
+    minus ``1 - mmr_lambda`` times the highest similarity to an already chosen passage.
+    For distance metrics (``distance`` of ``Euclid``/``Manhattan``, lower is closer) the
+    relevance is the rank position ``1 - rank/n`` instead of the raw score.
+    Similarity uses the returned point vectors when present (``with_vectors=True``),
+    otherwise shingle overlap. Passages whose shingle Jaccard with a chosen one reaches
+    ``dedup_threshold`` are dropped as near-duplicates.
+
+    Returns (contexts: List[str], sources: List[dict])
+    """
+    lam = settings.RAG_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    dup = settings.RAG_DEDUP_JACCARD if dedup_threshold is None else dedup_threshold
+
+    candidates: List[Dict[str, Any]] = []
+    for s in scored:
+        pl = getattr(s, "payload", None) or {}
+        txt = pl.get("text") if isinstance(pl, dict) else None
+        if not txt:
+            continue
+        text = str(txt)
+        candidates.append({
+            "point": s,
+            "payload": pl,
+            "text": text,
+            "relevance": float(getattr(s, "score", 0.0) or 0.0),
+            "shingles": shingles(text),
+            "vector": _vector_of(s),
+        })
+
+    for cand, rel in zip(candidates, _relevance([c["relevance"] for c in candidates], distance)):
+        cand["relevance"] = rel
+
+    contexts: List[str] = []
+    sources: List[Dict[str, Any]] = []
+    chosen: List[Dict[str, Any]] = []
+    used_tokens = 0
+    while candidates and len(contexts) < max_docs:
+        best_idx, best_mmr = -1, -math.inf
+        for idx, cand in enumerate(candidates):
+            redundancy = 0.0
+            for sel in chosen:
+                if cand["vector"] is not None and sel["vector"] is not None and cand["vector"].shape == sel["vector"].shape:
+                    sim = float(cand["vector"] @ sel["vector"])
+                else:
+                    sim = jaccard(cand["shingles"], sel["shingles"])
+                redundancy = max(redundancy, sim)
+            mmr = lam * cand["relevance"] - (1.0 - lam) * redundancy
+            if mmr > best_mmr:
+                best_idx, best_mmr = idx, mmr
+        cand = candidates.pop(best_idx)
+        if any(jaccard(cand["shingles"], sel["shingles"]) >= dup for sel in chosen):
+            continue
+        remaining = max_tokens - used_tokens
+        snippet = truncate_to_tokens(cand["text"], min(per_doc_max_tokens, remaining))
+        if not snippet or (snippet != cand["text"] and estimate_tokens(snippet) < min(_MIN_PASSAGE_TOKENS, per_doc_max_tokens)):
+            break
+        chosen.append(cand)
+        contexts.append(snippet)
+        used_tokens += estimate_tokens(snippet)
+        point = cand["point"]
+        sources.append({"id": point.id, "score": point.score, "payload": cand["payload"]})
+        if used_tokens >= max_tokens:
+            break
+    return contexts, sources
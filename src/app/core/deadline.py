@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import time
+from typing import Any, Awaitable, Dict, Optional, TypeVar
+
+from src.app.config import settings
+from src.app.core.metrics import DEADLINE_EXCEEDED_TOTAL
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's end-to-end budget runs out during ``stage``."""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Per-request time budget shared by every stage of a pipeline.
+
+    Stage timeouts and retry backoffs are clipped to the remaining budget; once it is
+    gone, :meth:`run` raises :class:`DeadlineExceeded` instead of starting more work.
+    ``budget`` of ``None`` means unbounded.
+    """
+
+    def __init__(self, budget: Optional[float], *, endpoint: str = "") -> None:
+        self.budget = budget if budget and budget > 0 else None
+        self.endpoint = endpoint
+        self._start = time.monotonic()
+        self.exceeded_stage: Optional[str] = None
+
+    @classmethod
+    def from_request(cls, request: Any, *, endpoint: str) -> "Deadline":
+        """Budget from the ``X-Request-Deadline-Ms`` header, else ``REQUEST_DEADLINE_MS`` (0 = unbounded)."""
+        raw = None
+        try:
+            raw = request.headers.get(DEADLINE_HEADER)
+        except Exception:
+            raw = None
+        try:
+            ms = float(raw) if raw not in (None, "") else float(settings.REQUEST_DEADLINE_MS)
+        except (TypeError, ValueError):
+            ms = float(settings.REQUEST_DEADLINE_MS)
+        return cls(ms / 1000.0 if ms > 0 else None, endpoint=endpoint)
+
+    def remaining(self) -> Optional[float]:
+        if self.budget is None:
+            return None
+        return max(0.0, self.budget - (time.monotonic() - self._start))
+
+    def expired(self) -> bool:
+        rem = self.remaining()
+        return rem is not None and rem <= 0.0
+
+    def clip(self, timeout: Optional[float]) -> Optional[float]:
+        """Smaller of ``timeout`` and the remaining budget (``None`` when both are unbounded)."""
+        rem = self.remaining()
+        if rem is None:
+            return timeout
+        return rem if timeout is None else min(timeout, rem)
+
+    def exhaust(self, stage: str) -> DeadlineExceeded:
+        if self.exceeded_stage is None:
+            self.exceeded_stage = stage
+            DEADLINE_EXCEEDED_TOTAL.labels(endpoint=self.endpoint, stage=stage).inc()
+        return DeadlineExceeded(stage)
+
+    async def run(self, aw: Awaitable[T], stage: str, *, timeout: Optional[float] = None) -> T:
+        """Await ``aw`` within ``min(timeout, remaining budget)``."""
+        if self.expired():
+            if inspect.iscoroutine(aw):
+                aw.close()
+            raise self.exhaust(stage)
+        limit = self.clip(timeout)
+        if limit is None:
+            return await aw
+        try:
+            return await asyncio.wait_for(aw, timeout=limit)
+        except asyncio.TimeoutError:
+            if self.expired():
+                raise self.exhaust(stage)
+            raise
+
+    async def backoff(self, delay: float, stage: str) -> bool:
+        """Sleep before a retry; returns False (and records exhaustion) if the budget cannot cover it."""
+        rem = self.remaining()
+        if rem is not None and rem <= delay:
+            self.exhaust(stage)
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    def meta(self) -> Dict[str, Any]:
+        rem = self.remaining()
+        return {
+            "budget_ms": int(self.budget * 1000) if self.budget is not None else None,
+            "remaining_ms": int(rem * 1000) if rem is not None else None,
+            "exceeded_stage": self.exceeded_stage,
+        }
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.app.clients import ollama
+from src.app.config import settings
+from src.app.core.metrics import EMBED_MICROBATCH_SIZE, EMBED_MICROBATCH_WAIT_SECONDS
+
+_Item = Tuple[str, "asyncio.Future[List[float]]", float]  # (text, future, enqueued_at)
+
+
+class EmbedBatcher:
+    """Cross-request micro-batcher in front of :func:`ollama.embeddings`.
+
+    Texts submitted concurrently for the same model are held for at most ``max_wait_ms``
+    (or until ``max_items`` accumulate) and sent as one batched embed call; each caller
+    gets its own vectors back in order.
+    """
+
+    def __init__(self, *, max_wait_ms: float, max_items: int) -> None:
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_items = max(1, int(max_items))
+        self._pending: Dict[str, List[_Item]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    async def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        futures: List["asyncio.Future[List[float]]"] = []
+        queue = self._pending.setdefault(model, [])
+        for text in texts:
+            fut: "asyncio.Future[List[float]]" = loop.create_future()
+            queue.append((text, fut, now))
+            futures.append(fut)
+        if len(queue) >= self.max_items:
+            self._flush(model)
+        elif model not in self._timers:
+            self._timers[model] = loop.call_later(self.max_wait, self._flush, model)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, model: str) -> None:
+        timer = self._timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+        # 调用方已取消的条目不再发送
+        items = [it for it in self._pending.pop(model, []) if not it[1].done()]
+        if not items:
+            return
+        task = asyncio.ensure_future(self._run(model, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, model: str, items: List[_Item]) -> None:
+        started = time.monotonic()
+        EMBED_MICROBATCH_SIZE.labels(model=model).observe(len(items))
+        for _, _, enqueued_at in items:
+            EMBED_MICROBATCH_WAIT_SECONDS.labels(model=model).observe(max(started - enqueued_at, 0.0))
+        try:
+            vectors = await ollama.embeddings([text for text, _, _ in items], model=model)
+            if len(vectors) != len(items):
+                raise RuntimeError(f"embedding count mismatch: expected {len(items)}, got {len(vectors)}")
+        except Exception as e:
+            for _, fut, _ in items:
+                if not fut.done():
+                    fut.set_exception(e)
+                    # 同一调用方的多个 future 只会读取首个异常，其余标记为已读取
+                    fut.exception()
+            return
+        for (_, fut, _), vec in zip(items, vectors):
+            if not fut.done():
+                fut.set_result(vec)
+
+
+batcher = EmbedBatcher(
+    max_wait_ms=settings.EMBED_MICROBATCH_WAIT_MS,
+    max_items=settings.EMBED_MICROBATCH_MAX_ITEMS,
+)
+
+
+async def embeddings(texts: List[str], model: Optional[str] = None, **kwargs: Any) -> List[List[float]]:
+    """Micro-batched embeddings; calls with per-call overrides or large inputs go straight through."""
+    chosen_model = model or getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL
+    if not settings.EMBED_MICROBATCH_ENABLED or kwargs or len(texts) >= batcher.max_items:
+        return await ollama.embeddings(texts, model=chosen_model, **kwargs)
+    return await batcher.embed(texts, chosen_model)
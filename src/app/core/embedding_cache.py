@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.app.config import settings
+from src.app.core import embed_batcher
+from src.app.core.metrics import (
+    EMBED_CACHE_EVICTIONS_TOTAL,
+    EMBED_CACHE_HITS_TOTAL,
+    EMBED_CACHE_MISSES_TOTAL,
+)
+
+_Key = Tuple[str, str]  # (model, text digest)
+
+
+def normalize_text(text: str) -> str:
+    """Normalization applied before hashing: NFC, trimmed, internal whitespace collapsed.
+
+    Case is preserved on purpose — embedding models are case-sensitive.
+    """
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def encode_vector(vec: List[float]) -> bytes:
+    """float32 打包（4 字节/维），比 JSON 列表紧凑约 4~5 倍。"""
+    return array("f", vec).tobytes()
+
+
+def decode_vector(raw: bytes) -> List[float]:
+    arr = array("f")
+    arr.frombytes(raw)
+    return arr.tolist()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: bounded in-process LRU + optional Redis tier.
+
+    Keys are ``(model, sha256(normalized text))``; vectors are stored as float32 bytes.
+    Concurrent lookups of the same key share one upstream embedding call.
+    """
+
+    def __init__(self, max_entries: int, *, redis_enabled: bool = False, redis_ttl: int = 0) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.redis_enabled = redis_enabled
+        self.redis_ttl = int(redis_ttl)
+        self._lru: "OrderedDict[_Key, bytes]" = OrderedDict()
+        self._inflight: Dict[_Key, "asyncio.Future[bytes]"] = {}
+        self._redis: Any = None
+
+    # --- in-process tier ---
+    def _lru_get(self, key: _Key) -> Optional[bytes]:
+        raw = self._lru.get(key)
+        if raw is not None:
+            self._lru.move_to_end(key)
+        return raw
+
+    def _lru_put(self, key: _Key, raw: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        self._lru[key] = raw
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            EMBED_CACHE_EVICTIONS_TOTAL.inc()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    # --- Redis tier（可选，失败时静默降级为仅内存） ---
+    def _get_redis(self) -> Any:
+        if not self.redis_enabled:
+            return None
+        if self._redis is None:
+            try:
+                from src.app.clients.redis import get_client
+
+                self._redis = get_client()
+            except Exception:
+                return None
+        return self._redis
+
+    @staticmethod
+    def _model_prefix(model: str) -> str:
+        # 模型名中可能含 ':' 等字符，取哈希前缀以便按模型安全地 SCAN 匹配
+        return "emb:" + hashlib.sha1(model.encode("utf-8")).hexdigest()[:12]
+
+    def _redis_key(self, key: _Key) -> str:
+        return f"{self._model_prefix(key[0])}:{key[1]}"
+
+    async def _redis_mget(self, keys: List[_Key]) -> List[Optional[bytes]]:
+        r = self._get_redis()
+        if r is None or not keys:
+            return [None] * len(keys)
+        try:
+            return list(await r.mget([self._redis_key(k) for k in keys]))
+        except Exception:
+            return [None] * len(keys)
+
+    async def _redis_set_many(self, items: List[Tuple[_Key, bytes]]) -> None:
+        r = self._get_redis()
+        if r is None or not items:
+            return
+        try:
+            pipe = r.pipeline(transaction=False)
+            for key, raw in items:
+                if self.redis_ttl > 0:
+                    pipe.set(self._redis_key(key), raw, ex=self.redis_ttl)
+                else:
+                    pipe.set(self._redis_key(key), raw)
+            await pipe.execute()
+        except Exception:
+            pass
+
+    # --- public API ---
+    async def embed(self, texts: List[str], model: Optional[str] = None, **kwargs: Any) -> List[List[float]]:
+        """Drop-in replacement for :func:`ollama.embeddings` that serves repeats from cache."""
+        if not texts:
+            return []
+        chosen_model = model or getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL
+        keys: List[_Key] = [(chosen_model, _digest(t)) for t in texts]
+        found: Dict[_Key, bytes] = {}
+        waiting: Dict[_Key, "asyncio.Future[bytes]"] = {}
+        missing: List[_Key] = []
+        for key in dict.fromkeys(keys):
+            raw = self._lru_get(key)
+            if raw is not None:
+                found[key] = raw
+                EMBED_CACHE_HITS_TOTAL.labels(model=chosen_model, tier="memory").inc()
+            elif key in self._inflight:
+                waiting[key] = self._inflight[key]
+                EMBED_CACHE_HITS_TOTAL.labels(model=chosen_model, tier="inflight").inc()
+            else:
+                missing.append(key)
+
+        if missing:
+            for key, raw in zip(list(missing), await self._redis_mget(missing)):
+                if raw:
+                    found[key] = bytes(raw)
+                    self._lru_put(key, found[key])
+                    missing.remove(key)
+                    EMBED_CACHE_HITS_TOTAL.labels(model=chosen_model, tier="redis").inc()
+
+        if missing:
+            EMBED_CACHE_MISSES_TOTAL.labels(model=chosen_model).inc(len(missing))
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in missing}
+            self._inflight.update(futures)
+            text_by_key = {k: t for k, t in zip(keys, texts)}
+            try:
+                vectors = await embed_batcher.embeddings([text_by_key[k] for k in missing], model=chosen_model, **kwargs)
+                if len(vectors) != len(missing):
+                    raise RuntimeError(f"embedding count mismatch: expected {len(missing)}, got {len(vectors)}")
+                fresh: List[Tuple[_Key, bytes]] = []
+                for key, vec in zip(missing, vectors):
+                    raw = encode_vector(vec or [])
+                    found[key] = raw
+                    futures[key].set_result(raw)
+                    if vec:
+                        # 空向量不缓存，留给下一次请求重试
+                        self._lru_put(key, raw)
+                        fresh.append((key, raw))
+                await self._redis_set_many(fresh)
+            except BaseException as e:
+                # 发起方被取消（如请求预算耗尽）时，其余等待者收到普通异常而非 CancelledError
+                err = e if isinstance(e, Exception) else RuntimeError("embedding request cancelled")
+                for fut in futures.values():
+                    if not fut.done():
+                        fut.set_exception(err)
+                        # 标记异常已被读取，避免无等待者时输出 "exception was never retrieved"
+                        fut.exception()
+                raise
+            finally:
+                for key in missing:
+                    self._inflight.pop(key, None)
+
+        for key, fut in waiting.items():
+            found[key] = await asyncio.shield(fut)
+        return [decode_vector(found[k]) for k in keys]
+
+    async def invalidate(self, model: Optional[str] = None) -> int:
+        """Drop cached vectors for ``model`` (all models when None); returns entries removed."""
+        if model is None:
+            removed = len(self._lru)
+            self._lru.clear()
+        else:
+            stale = [k for k in self._lru if k[0] == model]
+            for k in stale:
+                del self._lru[k]
+            removed = len(stale)
+        r = self._get_redis()
+        if r is not None:
+            pattern = "emb:*" if model is None else f"{self._model_prefix(model)}:*"
+            try:
+                batch: List[Any] = []
+                async for k in r.scan_iter(match=pattern, count=500):
+                    batch.append(k)
+                    if len(batch) >= 500:
+                        removed += int(await r.delete(*batch))
+                        batch = []
+                if batch:
+                    removed += int(await r.delete(*batch))
+            except Exception:
+                pass
+        return removed
+
+
+cache = EmbeddingCache(
+    settings.EMBED_CACHE_MAX_ENTRIES,
+    redis_enabled=settings.EMBED_CACHE_REDIS_ENABLED,
+    redis_ttl=settings.EMBED_CACHE_REDIS_TTL,
+)
+
+
+async def embeddings(texts: List[str], model: Optional[str] = None, **kwargs: Any) -> List[List[float]]:
+    """Cached embeddings for query-side hot paths (bypassed when ``EMBED_CACHE_ENABLED`` is off)."""
+    if not settings.EMBED_CACHE_ENABLED:
+        return await embed_batcher.embeddings(texts, model=model, **kwargs)
+    return await cache.embed(texts, model=model, **kwargs)
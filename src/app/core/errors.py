@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 from fastapi import FastAPI, Request
-from typing import Optional
+from typing import Dict, Optional
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from starlette.responses import JSONResponse as StarletteJSONResponse
@@ -11,14 +11,14 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 logger = logging.getLogger(__name__)
 
 
-def _json_error(status_code: int, error: str, detail: object, request_id: Optional[str]) -> JSONResponse:
+def _json_error(status_code: int, error: str, detail: object, request_id: Optional[str], headers: Optional[Dict[str, str]] = None) -> JSONResponse:
     payload = {
         "error": error,
         "detail": detail,
     }
     if request_id:
         payload["request_id"] = request_id
-    return JSONResponse(status_code=status_code, content=payload)
+    return JSONResponse(status_code=status_code, content=payload, headers=headers)
 
 
 def register_exception_handlers(app: FastAPI) -> None:
@@ -45,7 +45,7 @@ def register_exception_handlers(app: FastAPI) -> None:
                 "body_preview": body_preview,
             },
         )
-        return _json_error(exc.status_code, "HTTPError", exc.detail, rid)
+        return _json_error(exc.status_code, "HTTPError", exc.detail, rid, getattr(exc, "headers", None))
 
     @app.exception_handler(RequestValidationError)
     async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.app.config import settings
+
+logger = logging.getLogger("eval_runner")
+
+# 执行一条评测项：返回（回答文本, 各阶段耗时毫秒，如 {"embed": .., "retrieve": .., "generate": ..}）
+ExecuteFn = Callable[[Any], Awaitable[Tuple[str, Dict[str, float]]]]
+# 进度回调：(status, metrics)，由调用方负责持久化
+ProgressFn = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+_STAGES = ("embed", "retrieve", "generate", "total")
+_MAX_FAILURE_SAMPLES = 20
+
+
+def check_answer(response: str, expected: Optional[str], check_type: Optional[str]) -> Optional[bool]:
+    """Score one answer; None when the item has no expectation (not counted in accuracy).
+
+    ``check_type``: ``contains`` (default, case-insensitive substring), ``exact`` or ``regex``.
+    """
+    if not expected:
+        return None
+    kind = (check_type or "contains").lower()
+    text = (response or "").strip()
+    if kind == "exact":
+        return text == expected.strip()
+    if kind == "regex":
+        try:
+            return re.search(expected, text) is not None
+        except re.error:
+            return False
+    return expected.strip().lower() in text.lower()
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    """Nearest-rank p50/p95/p99 (None for an empty sample)."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        idx = min(len(ordered) - 1, max(0, int(math.ceil(q * len(ordered))) - 1))
+        return round(ordered[idx], 2)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class RunStats:
+    """Accuracy, per-stage latency samples and throughput of one run."""
+
+    def __init__(self, total: int, base: Optional[Dict[str, Any]] = None) -> None:
+        self.total = total
+        self.base = dict(base or {})
+        self.completed = 0
+        self.passed = 0
+        self.failed = 0
+        self.errors = 0
+        self.latency: Dict[str, List[float]] = {s: [] for s in _STAGES}
+        self.failures: List[Dict[str, Any]] = []
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    def add(self, index: int, query: str, verdict: Optional[bool], timings: Dict[str, float], error: Optional[str] = None) -> None:
+        self.completed += 1
+        for stage in _STAGES:
+            if stage in timings:
+                self.latency[stage].append(float(timings[stage]))
+        if error is not None:
+            self.errors += 1
+        if verdict is True:
+            self.passed += 1
+        elif verdict is False or error is not None:
+            self.failed += 1
+            if len(self.failures) < _MAX_FAILURE_SAMPLES:
+                self.failures.append({"index": index, "query": query, "error": error})
+
+    def as_metrics(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        scored = self.passed + self.failed
+        out = dict(self.base)
+        out.update({
+            "total_items": self.total,
+            "completed": self.completed,
+            "passed": self.passed,
+            "failed": self.failed,
+            "errors": self.errors,
+            "accuracy": (self.passed / scored) if scored else None,
+            "latency_ms": {stage: percentiles(v) for stage, v in self.latency.items()},
+            "throughput_items_per_s": round(self.completed / elapsed, 3) if elapsed > 0 else None,
+            "duration_s": round(elapsed, 3),
+            "failures": list(self.failures),
+        })
+        return out
+
+
+class EvalRunner:
+    """Background executor for eval runs.
+
+    ``workers`` bounds the items in flight across all runs (the shared worker pool);
+    each run additionally uses at most ``per_run_concurrency`` of them. Progress is
+    reported through ``on_progress`` at most every ``progress_interval`` seconds and on
+    every status change (running → completed / failed / cancelled).
+    """
+
+    def __init__(self, *, workers: int, per_run_concurrency: int, progress_interval: float = 1.0) -> None:
+        self.workers = max(1, int(workers))
+        self.per_run_concurrency = max(1, int(per_run_concurrency))
+        self.progress_interval = max(0.0, float(progress_interval))
+        self._pool: Optional[asyncio.Semaphore] = None
+        self._pool_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: Dict[str, "asyncio.Task[None]"] = {}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # 工作池信号量绑定到当前事件循环（测试或重启时循环会变化）
+        loop = asyncio.get_running_loop()
+        if self._pool is None or self._pool_loop is not loop:
+            self._pool = asyncio.Semaphore(self.workers)
+            self._pool_loop = loop
+        return self._pool
+
+    def start(
+        self,
+        run_id: str,
+        items: Sequence[Any],
+        execute: ExecuteFn,
+        on_progress: ProgressFn,
+        *,
+        concurrency: Optional[int] = None,
+        base_metrics: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        limit = min(max(1, int(concurrency or self.per_run_concurrency)), self.workers)
+        task = asyncio.ensure_future(self._run(run_id, list(items), execute, on_progress, limit, base_metrics))
+        self._tasks[run_id] = task
+        task.add_done_callback(lambda _t, rid=run_id: self._tasks.pop(rid, None))
+
+    def is_running(self, run_id: str) -> bool:
+        return run_id in self._tasks
+
+    def cancel(self, run_id: str) -> bool:
+        task = self._tasks.get(run_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def wait(self, run_id: str) -> None:
+        task = self._tasks.get(run_id)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def shutdown(self) -> None:
+        """Cancel all runs (called from the FastAPI lifespan); they are recorded as cancelled."""
+        tasks = list(self._tasks.values())
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(
+        self,
+        run_id: str,
+        items: List[Any],
+        execute: ExecuteFn,
+        on_progress: ProgressFn,
+        limit: int,
+        base_metrics: Optional[Dict[str, Any]],
+    ) -> None:
+        stats = RunStats(len(items), base_metrics)
+        pool = self._semaphore()
+        next_index = iter(range(len(items)))
+        last_report = time.monotonic()
+        await on_progress("running", stats.as_metrics())
+
+        async def one(index: int) -> None:
+            item = items[index]
+            t0 = time.monotonic()
+            error: Optional[str] = None
+            response = ""
+            timings: Dict[str, float] = {}
+            try:
+                response, timings = await execute(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            timings = dict(timings)
+            timings["total"] = (time.monotonic() - t0) * 1000.0
+            verdict = None if error else check_answer(response, getattr(item, "expected_answer", None), getattr(item, "check_type", None))
+            stats.add(index, getattr(item, "query", ""), verdict, timings, error)
+
+        async def worker() -> None:
+            nonlocal last_report
+            for index in next_index:
+                async with pool:
+                    await one(index)
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    await on_progress("running", stats.as_metrics())
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(limit, len(items)) or 1)))
+        except asyncio.CancelledError:
+            stats.finished = time.monotonic()
+            await on_progress("cancelled", stats.as_metrics())
+            return
+        except Exception as e:
+            logger.warning("eval_run_failed run_id=%s error=%s: %s", run_id, type(e).__name__, e)
+            stats.finished = time.monotonic()
+            await on_progress("failed", {**stats.as_metrics(), "error": f"{type(e).__name__}: {e}"})
+            return
+        stats.finished = time.monotonic()
+        await on_progress("completed", stats.as_metrics())
+
+
+runner = EvalRunner(workers=settings.EVAL_RUNNER_WORKERS, per_run_concurrency=settings.EVAL_RUN_CONCURRENCY)
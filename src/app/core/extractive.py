@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from typing import Any, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from src.app.clients import qdrant as qcli
+from src.app.core.metrics import RAG_ANSWER_SECONDS, RAG_EXTRACTIVE_DECISIONS_TOTAL
+
+# 请求字段 answer_mode 的取值：仅 "extractive" 启用快速路径，其余均走 LLM 生成
+MODE = "extractive"
+
+
+class ExtractiveAnswer(BaseModel):
+    answer: str
+    score: float
+    field: str
+    min_score: float
+
+
+def supports_distance(distance: Optional[str]) -> bool:
+    """Whether the ``min_score`` threshold applies to the collection's ``distance``."""
+    return qcli.is_similarity(distance)
+
+
+def decide(
+    scored: Sequence[Any], policy: qcli.ExtractivePolicy, distance: Optional[str] = None,
+) -> Tuple[str, Optional[ExtractiveAnswer]]:
+    """``(decision, answer)`` for the top-1 hit under ``policy``.
+
+    Decisions: ``answered`` (score ≥ threshold and the payload has a non-empty answer
+    field), ``below_threshold``, ``no_field``, ``no_match`` (nothing retrieved) or
+    ``unsupported_distance`` (the collection scores by distance, so the threshold would
+    be inverted; those collections always fall back to generation).
+    """
+    if not supports_distance(distance):
+        return "unsupported_distance", None
+    if not scored:
+        return "no_match", None
+    top = scored[0]
+    score = float(getattr(top, "score", 0.0) or 0.0)
+    if score < policy.min_score:
+        return "below_threshold", None
+    payload = getattr(top, "payload", None) or {}
+    value = payload.get(policy.answer_field) if isinstance(payload, dict) else None
+    if not isinstance(value, str) or not value.strip():
+        return "no_field", None
+    return "answered", ExtractiveAnswer(answer=value.strip(), score=score, field=policy.answer_field, min_score=policy.min_score)
+
+
+def try_answer(scored: Sequence[Any], *, collection: str, endpoint: str, distance: Optional[str] = None) -> Optional[ExtractiveAnswer]:
+    """Apply the collection's catalog policy to the retrieved points and count the decision."""
+    decision, answer = decide(scored, qcli.catalog.extractive_policy(collection), distance)
+    RAG_EXTRACTIVE_DECISIONS_TOTAL.labels(endpoint=endpoint, collection=collection, decision=decision).inc()
+    return answer
+
+
+def observe_answer(endpoint: str, path: str, seconds: float) -> None:
+    """Latency of an ``answer_mode=extractive`` request by the path it took (``extractive`` / ``llm``)."""
+    RAG_ANSWER_SECONDS.labels(endpoint=endpoint, path=path).observe(max(seconds, 0.0))
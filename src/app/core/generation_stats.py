@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from src.app.core.metrics import (
+    LLM_COMPLETION_TOKENS,
+    LLM_PROMPT_TOKENS,
+    LLM_TOKENS_PER_SECOND,
+    LLM_TTFT_SECONDS,
+)
+
+_NS_PER_MS = 1_000_000.0
+
+
+def _ms(ns: Any) -> Optional[float]:
+    try:
+        return round(float(ns) / _NS_PER_MS, 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse(frame: Dict[str, Any]) -> Dict[str, Any]:
+    """Token accounting from Ollama's final ``/api/generate`` frame (durations are nanoseconds).
+
+    Returns prompt/completion token counts, load / prompt-eval / eval durations in ms,
+    decode ``tokens_per_second`` and a server-side ``ttft_ms`` (load + prompt eval).
+    Missing fields are omitted.
+    """
+    if not isinstance(frame, dict):
+        return {}
+    stats: Dict[str, Any] = {}
+    if frame.get("prompt_eval_count") is not None:
+        stats["prompt_tokens"] = int(frame["prompt_eval_count"])
+    if frame.get("eval_count") is not None:
+        stats["completion_tokens"] = int(frame["eval_count"])
+    for src, dst in (("load_duration", "load_ms"), ("prompt_eval_duration", "prompt_eval_ms"), ("eval_duration", "eval_ms"), ("total_duration", "total_ms")):
+        val = _ms(frame.get(src)) if frame.get(src) is not None else None
+        if val is not None:
+            stats[dst] = val
+    if stats.get("completion_tokens") and stats.get("eval_ms"):
+        stats["tokens_per_second"] = round(stats["completion_tokens"] / (stats["eval_ms"] / 1000.0), 2)
+    if "load_ms" in stats or "prompt_eval_ms" in stats:
+        stats["ttft_ms"] = round(stats.get("load_ms", 0.0) + stats.get("prompt_eval_ms", 0.0), 2)
+    return stats
+
+
+def observe(stats: Optional[Dict[str, Any]], *, model: str, endpoint: str) -> None:
+    """Feed TTFT / token histograms from a :func:`parse` result (no-op when empty)."""
+    if not stats:
+        return
+    if stats.get("ttft_ms") is not None:
+        LLM_TTFT_SECONDS.labels(model=model, endpoint=endpoint).observe(max(float(stats["ttft_ms"]) / 1000.0, 0.0))
+    if stats.get("prompt_tokens") is not None:
+        LLM_PROMPT_TOKENS.labels(model=model, endpoint=endpoint).observe(stats["prompt_tokens"])
+    if stats.get("completion_tokens") is not None:
+        LLM_COMPLETION_TOKENS.labels(model=model, endpoint=endpoint).observe(stats["completion_tokens"])
+    if stats.get("tokens_per_second") is not None:
+        LLM_TOKENS_PER_SECOND.labels(model=model, endpoint=endpoint).observe(stats["tokens_per_second"])
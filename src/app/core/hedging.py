@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, Optional, Tuple
+
+from src.app.config import settings
+from src.app.core.metrics import LLM_HEDGE_LOSERS_WITH_OUTPUT_TOTAL, LLM_HEDGE_TOTAL, LLM_HEDGE_WASTED_TOKENS_TOTAL
+from src.app.core.streaming import DisconnectWatcher, cancel_and_close
+
+_Gen = AsyncGenerator[Any, None]
+
+
+class HedgePolicy:
+    """Decides when (and whether) to start a hedge generation.
+
+    - The hedge delay is the ``quantile`` of recently observed TTFTs, clamped to
+      ``[min_delay_ms, first-token timeout]``; ``default_delay_ms`` applies until
+      ``min_samples`` TTFTs have been seen.
+    - At most ``max_ratio`` of the last ``window`` requests may be hedged, so the extra
+      compute stays bounded instead of doubling every request.
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = True,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        default_delay_ms: float = 1500.0,
+        min_delay_ms: float = 200.0,
+        max_ratio: float = 0.1,
+        prefer_other_backend: bool = True,
+        first_token_timeout_ms: float = 8000.0,
+        window: int = 200,
+    ) -> None:
+        self.enabled = enabled
+        self.quantile = min(max(float(quantile), 0.0), 1.0)
+        self.min_samples = max(1, int(min_samples))
+        self.default_delay = max(0.0, float(default_delay_ms)) / 1000.0
+        self.min_delay = max(0.0, float(min_delay_ms)) / 1000.0
+        self.max_ratio = min(max(float(max_ratio), 0.0), 1.0)
+        self.prefer_other_backend = prefer_other_backend
+        self.timeout = max(0.0, float(first_token_timeout_ms)) / 1000.0
+        self._ttft: Deque[float] = deque(maxlen=max(1, int(window)))
+        self._hedged: Deque[bool] = deque(maxlen=max(1, int(window)))
+
+    def observe_ttft(self, seconds: float) -> None:
+        self._ttft.append(max(0.0, float(seconds)))
+
+    def delay(self) -> float:
+        if len(self._ttft) < self.min_samples:
+            base = self.default_delay
+        else:
+            ordered = sorted(self._ttft)
+            idx = min(len(ordered) - 1, max(0, int(math.ceil(self.quantile * len(ordered))) - 1))
+            base = ordered[idx]
+        return min(max(base, self.min_delay), self.timeout)
+
+    def allow_hedge(self) -> bool:
+        if not self.enabled or self.max_ratio <= 0.0:
+            return False
+        if not self._hedged:
+            return True
+        return sum(self._hedged) / float(len(self._hedged)) < self.max_ratio
+
+    def record(self, hedged: bool) -> None:
+        self._hedged.append(bool(hedged))
+
+
+policy = HedgePolicy(
+    enabled=settings.HEDGE_ENABLED,
+    quantile=settings.HEDGE_QUANTILE,
+    min_samples=settings.HEDGE_MIN_SAMPLES,
+    default_delay_ms=settings.HEDGE_DEFAULT_DELAY_MS,
+    min_delay_ms=settings.HEDGE_MIN_DELAY_MS,
+    max_ratio=settings.HEDGE_MAX_RATIO,
+    prefer_other_backend=settings.HEDGE_PREFER_OTHER_BACKEND,
+    first_token_timeout_ms=settings.HEDGE_FIRST_TOKEN_TIMEOUT_MS,
+)
+
+
+def _first_ok(task: "asyncio.Future[Any]") -> bool:
+    """A first-chunk task counts as a win only if it produced a chunk."""
+    try:
+        task.result()
+        return True
+    except BaseException:
+        return False
+
+
+def _wasted_tokens(task: "asyncio.Future[Any]", stats: Dict[str, Any], prompt_estimate: int) -> int:
+    """Tokens a cancelled generation consumed: its prompt plus the chunks it streamed.
+
+    Final-frame counts (``prompt_tokens`` / ``completion_tokens``) win when present;
+    otherwise the prompt is ``prompt_estimate`` and each streamed chunk counts as one
+    token. A generation that failed before producing anything counts nothing.
+    """
+    output = _first_ok(task) if task.done() else False
+    failed = task.done() and not task.cancelled() and not output and not isinstance(task.exception(), StopAsyncIteration)
+    completion = stats.get("completion_tokens")
+    if completion is None:
+        completion = 1 if output else 0
+    prompt = stats.get("prompt_tokens")
+    if prompt is None:
+        prompt = 0 if failed else prompt_estimate
+    return max(0, int(prompt)) + max(0, int(completion))
+
+
+async def hedged_first_chunk(
+    primary: _Gen,
+    make_hedge: Callable[[], _Gen],
+    *,
+    endpoint: str,
+    watcher: Optional[DisconnectWatcher] = None,
+    hedge_policy: Optional[HedgePolicy] = None,
+    prompt_tokens: Optional[Dict[str, int]] = None,
+    stats: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Tuple[Optional[str], Optional[_Gen], Any]:
+    """Wait for the first chunk of ``primary``, starting ``make_hedge()`` only if it is slow.
+
+    The hedge starts after :meth:`HedgePolicy.delay` when the policy allows it; whichever
+    generation yields first wins. The loser is cancelled and closed (releasing its
+    upstream stream). Returns ``(winner, generator, first_chunk)`` with winner
+    ``"primary"`` / ``"hedge"``, or ``(None, None, None)`` when neither produced a chunk
+    within the first-token timeout (or the client disconnected); both are closed then.
+
+    ``prompt_tokens`` (estimated prompt length) and ``stats`` (the generation stats dicts)
+    are keyed by ``"primary"`` / ``"hedge"`` and feed ``llm_hedge_wasted_tokens_total``
+    with what each cancelled loser consumed.
+    """
+    pol = hedge_policy or policy
+    t0 = time.monotonic()
+    deadline = t0 + pol.timeout
+    tasks = {"primary": asyncio.ensure_future(primary.__anext__())}
+    gens = {"primary": primary}
+    disc: Optional["asyncio.Future[Any]"] = asyncio.ensure_future(watcher.disconnected.wait()) if watcher is not None else None
+    hedged = False
+    capped = False
+    winner: Optional[str] = None
+    try:
+        while winner is None:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if not hedged and not capped:
+                wait_for = min(t0 + pol.delay(), deadline) - now
+            else:
+                wait_for = deadline - now
+            pending = set(t for t in tasks.values() if not t.done())
+            if disc is not None:
+                pending.add(disc)
+            done, _ = await asyncio.wait(pending, timeout=max(wait_for, 0.0), return_when=asyncio.FIRST_COMPLETED)
+            if disc is not None and disc.done():
+                break
+            for name, task in tasks.items():
+                if task in done and _first_ok(task):
+                    winner = name
+                    break
+            if winner is not None:
+                break
+            live = [t for t in tasks.values() if not t.done()]
+            if not hedged and not capped and (not live or time.monotonic() >= t0 + pol.delay()):
+                # 主请求超过对冲延迟仍无首包（或已失败）：在比例上限内启动对冲
+                if pol.allow_hedge():
+                    hedged = True
+                    gens["hedge"] = make_hedge()
+                    tasks["hedge"] = asyncio.ensure_future(gens["hedge"].__anext__())
+                    continue
+                capped = True
+            if not live and (hedged or capped):
+                break
+    except BaseException:
+        for name in list(tasks):
+            await cancel_and_close(tasks[name], gens[name])
+        raise
+    finally:
+        if disc is not None:
+            disc.cancel()
+
+    pol.record(hedged)
+    for name in list(tasks):
+        if name == winner:
+            continue
+        task = tasks[name]
+        if task.done() and _first_ok(task):
+            LLM_HEDGE_LOSERS_WITH_OUTPUT_TOTAL.labels(endpoint=endpoint).inc()
+        wasted = _wasted_tokens(task, (stats or {}).get(name) or {}, int((prompt_tokens or {}).get(name, 0)))
+        if wasted:
+            LLM_HEDGE_WASTED_TOKENS_TOTAL.labels(endpoint=endpoint).inc(wasted)
+        await cancel_and_close(task, gens[name])
+
+    if winner is None:
+        LLM_HEDGE_TOTAL.labels(endpoint=endpoint, result="no_first_token").inc()
+        return None, None, None
+    pol.observe_ttft(time.monotonic() - t0)
+    if hedged:
+        result = "hedge_won" if winner == "hedge" else "primary_won"
+    else:
+        result = "capped" if capped and pol.enabled else "not_hedged"
+    LLM_HEDGE_TOTAL.labels(endpoint=endpoint, result=result).inc()
+    return winner, gens[winner], tasks[winner].result()
@@ -17,6 +17,13 @@ REQUEST_LATENCY = Histogram(
 
 # --- APP Specific Metrics ---
 
+# 请求端到端预算耗尽次数（按耗尽时所处阶段）
+DEADLINE_EXCEEDED_TOTAL = Counter(
+    "request_deadline_exceeded_total",
+    "Number of requests whose end-to-end deadline ran out, by stage",
+    labelnames=("endpoint", "stage"),
+)
+
 # Embedding 时间
 EMBED_SECONDS = Histogram(
     "embed_duration_seconds",
@@ -24,6 +31,56 @@ EMBED_SECONDS = Histogram(
     labelnames=("model",),
 )
 
+# 查询嵌入微批：每次上游调用合并的文本条数
+EMBED_MICROBATCH_SIZE = Histogram(
+    "embed_microbatch_size",
+    "Number of texts per micro-batched embedding call",
+    labelnames=("model",),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+# 查询嵌入微批：文本在队列中的等待时间
+EMBED_MICROBATCH_WAIT_SECONDS = Histogram(
+    "embed_microbatch_wait_seconds",
+    "Time a text waited in the micro-batch queue before being sent",
+    labelnames=("model",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+# Embedding 缓存命中（tier: memory/redis/inflight）
+EMBED_CACHE_HITS_TOTAL = Counter(
+    "embed_cache_hits_total",
+    "Number of embedding cache hits",
+    labelnames=("model", "tier"),
+)
+
+# Embedding 缓存未命中（需调用上游嵌入）
+EMBED_CACHE_MISSES_TOTAL = Counter(
+    "embed_cache_misses_total",
+    "Number of embedding cache misses",
+    labelnames=("model",),
+)
+
+# Embedding 缓存 LRU 淘汰次数
+EMBED_CACHE_EVICTIONS_TOTAL = Counter(
+    "embed_cache_evictions_total",
+    "Number of entries evicted from the in-process embedding cache",
+)
+
+# 语义答案缓存查询（result: hit/miss）
+SEMANTIC_CACHE_LOOKUPS_TOTAL = Counter(
+    "semantic_cache_lookups_total",
+    "Number of semantic answer cache lookups",
+    labelnames=("collection", "result"),
+)
+
+# 语义答案缓存命中节省的检索+生成耗时（秒，按写入时的实测耗时累计）
+SEMANTIC_CACHE_SAVED_SECONDS_TOTAL = Counter(
+    "semantic_cache_saved_seconds_total",
+    "Retrieval and generation seconds avoided by semantic cache hits",
+    labelnames=("collection",),
+)
+
 # RAG 检索（向量检索）时间
 RAG_RETRIEVAL_SECONDS = Histogram(
     "rag_retrieval_duration_seconds",
@@ -31,11 +88,114 @@ RAG_RETRIEVAL_SECONDS = Histogram(
     labelnames=("collection",),
 )
 
+# RAG 流水线各阶段耗时（embed / collection / retrieve / pack / prompt / generate）
+RAG_STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each RAG pipeline stage",
+    labelnames=("stage",),
+)
+
+# 抽取式快速路径决策（answered/below_threshold/no_field/no_match/unsupported_distance）
+RAG_EXTRACTIVE_DECISIONS_TOTAL = Counter(
+    "rag_extractive_decisions_total",
+    "Extractive fast-path decisions for answer_mode=extractive requests",
+    labelnames=("endpoint", "collection", "decision"),
+)
+
+# answer_mode=extractive 请求的端到端回答耗时，按实际路径（extractive / llm）区分
+RAG_ANSWER_SECONDS = Histogram(
+    "rag_answer_duration_seconds",
+    "Time to answer answer_mode=extractive requests by the path taken",
+    labelnames=("endpoint", "path"),
+)
+
 # 生成（LLM 推理）时间
 LLM_GENERATE_SECONDS = Histogram(
     "llm_generate_duration_seconds",
     "Time spent generating LLM responses",
-    labelnames=("model", "stream"),
+    # outcome: ok / error / aborted（客户端断开后中止上游生成）
+    labelnames=("model", "stream", "outcome"),
+)
+
+# 首 token 延迟（流式为客户端实测；非流式取 Ollama 的 load + prompt_eval 耗时）
+LLM_TTFT_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time to first generated token",
+    labelnames=("model", "endpoint"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0),
+)
+
+# 提示词 token 数（Ollama prompt_eval_count）
+LLM_PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Prompt tokens evaluated per generation",
+    labelnames=("model", "endpoint"),
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192),
+)
+
+# 生成 token 数（Ollama eval_count）
+LLM_COMPLETION_TOKENS = Histogram(
+    "llm_completion_tokens",
+    "Completion tokens generated per generation",
+    labelnames=("model", "endpoint"),
+    buckets=(1, 4, 16, 32, 64, 128, 256, 512, 1024, 2048),
+)
+
+# 解码吞吐（eval_count / eval_duration，tokens/s）
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_decode_tokens_per_second",
+    "Decode throughput in tokens per second",
+    labelnames=("model", "endpoint"),
+    buckets=(1, 2, 5, 10, 20, 40, 60, 80, 120, 200),
+)
+
+# 对冲生成：result = not_hedged / primary_won / hedge_won / capped（超出对冲比例上限）/ no_first_token
+LLM_HEDGE_TOTAL = Counter(
+    "llm_hedge_total",
+    "Hedged generation decisions and outcomes",
+    labelnames=("endpoint", "result"),
+)
+
+# 被取消前已产出首包的对冲败者数（败者只被推进到首包，无法统计其真实 token 数）
+LLM_HEDGE_LOSERS_WITH_OUTPUT_TOTAL = Counter(
+    "llm_hedge_losers_with_output_total",
+    "Hedge losers that had already produced a first chunk when cancelled",
+    labelnames=("endpoint",),
+)
+
+# 对冲败者被取消前消耗的 token：提示词（终帧 prompt_eval_count，否则按长度估算）+ 已流出的分片（约 1 token/片）
+LLM_HEDGE_WASTED_TOKENS_TOTAL = Counter(
+    "llm_hedge_wasted_tokens_total",
+    "Estimated prompt and completion tokens spent by cancelled hedge losers",
+    labelnames=("endpoint",),
+)
+
+# 会话（复用 Ollama KV context）：各租户当前会话数
+CHAT_SESSIONS_ACTIVE = Gauge(
+    "chat_sessions_active",
+    "Number of live chat sessions held in memory per tenant",
+    labelnames=("tenant",),
+)
+
+# 会话淘汰：reason = ttl / lru（超出租户上限）/ context_overflow（context 超长被丢弃）/ deleted
+CHAT_SESSION_EVICTIONS_TOTAL = Counter(
+    "chat_session_evictions_total",
+    "Chat sessions (or their context) evicted",
+    labelnames=("reason",),
+)
+
+# Ollama 多节点：各节点进行中的请求数（最少未完成请求路由依据）
+OLLAMA_BACKEND_INFLIGHT = Gauge(
+    "ollama_backend_inflight",
+    "Number of in-flight requests per Ollama backend",
+    labelnames=("backend",),
+)
+
+# Ollama 多节点：被动健康检查摘除次数
+OLLAMA_BACKEND_EJECTIONS_TOTAL = Counter(
+    "ollama_backend_ejections_total",
+    "Number of times an Ollama backend was ejected after consecutive failures",
+    labelnames=("backend",),
 )
 
 # RAG 命中计数（是否检索到至少一条）
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Union
+
+from src.app.clients import qdrant as qcli
+from src.app.core import embedding_cache, extractive
+from src.app.core.metrics import EMBED_SECONDS, RAG_RETRIEVAL_SECONDS
+
+PointId = Union[str, int]
+
+
+class EvalEmbeddingError(Exception):
+    """A batch of eval queries could not be embedded (message is the soft-fail reason)."""
+
+
+def score_row(
+    index: int,
+    query: str,
+    scored: Sequence[Any],
+    *,
+    expected: Optional[Sequence[PointId]] = None,
+    policy: Optional[qcli.ExtractivePolicy] = None,
+) -> Dict[str, Any]:
+    """One detail row; ``recall_at_k``/``reciprocal_rank`` are None when no expected ids were given."""
+    has = bool(scored)
+    row: Dict[str, Any] = {
+        "index": index,
+        "query": query,
+        "has_match": has,
+        "top1_score": float(scored[0].score) if has else 0.0,
+        "mean_score": float(sum(s.score for s in scored) / len(scored)) if has else 0.0,
+        "count": len(scored),
+        "extractive": bool(policy is not None and extractive.decide(scored, policy)[0] == "answered"),
+        "recall_at_k": None,
+        "reciprocal_rank": None,
+    }
+    if expected:
+        # ID 统一按字符串比较（整数 ID 与 UUID 均可）
+        want = {str(x) for x in expected}
+        got = [str(s.id) for s in scored]
+        row["recall_at_k"] = len(want.intersection(got)) / len(want)
+        row["reciprocal_rank"] = next((1.0 / (rank + 1) for rank, pid in enumerate(got) if pid in want), 0.0)
+    return row
+
+
+class EvalSummary:
+    """Running aggregate of detail rows (rows may arrive in any order)."""
+
+    def __init__(self, *, collection: str, total: int, top_k: int, policy: qcli.ExtractivePolicy) -> None:
+        self.collection = collection
+        self.total = total
+        self.top_k = top_k
+        self.policy = policy
+        self.done = 0
+        self._matches = 0
+        self._with_results = 0
+        self._sum_top1 = 0.0
+        self._sum_mean = 0.0
+        self._extractive = 0
+        self._labelled = 0
+        self._sum_recall = 0.0
+        self._sum_rr = 0.0
+        self.error: Optional[str] = None
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.done += 1
+        if row["has_match"]:
+            self._matches += 1
+            self._with_results += 1
+            self._sum_top1 += row["top1_score"]
+            self._sum_mean += row["mean_score"]
+        if row["extractive"]:
+            self._extractive += 1
+        if row["recall_at_k"] is not None:
+            self._labelled += 1
+            self._sum_recall += row["recall_at_k"]
+            self._sum_rr += row["reciprocal_rank"]
+
+    def as_dict(self) -> Dict[str, Any]:
+        total, n = self.total, self._with_results
+        out: Dict[str, Any] = {
+            "collection": self.collection,
+            "total": total,
+            "hit_ratio": (self._matches / total) if total else 0.0,
+            "avg_top1": (self._sum_top1 / n) if n else 0.0,
+            "avg_mean_score": (self._sum_mean / n) if n else 0.0,
+            "top_k": self.top_k,
+            "extractive_ratio": (self._extractive / total) if total else 0.0,
+            "extractive_min_score": self.policy.min_score,
+            "labelled": self._labelled,
+            "recall_at_k": (self._sum_recall / self._labelled) if self._labelled else None,
+            "mrr": (self._sum_rr / self._labelled) if self._labelled else None,
+        }
+        if self.error is not None:
+            out["error"] = self.error
+        return out
+
+
+async def _embed_batch(texts: List[str], model: str, max_attempts: int = 6) -> List[List[float]]:
+    # 指数退避重试；最终失败抛出 EvalEmbeddingError（由调用方软失败处理）
+    t_emb = time.monotonic()
+    err_detail = "empty_or_mismatched_vectors"
+    delay = 0.5
+    try:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                vecs = await embedding_cache.embeddings(texts, model=model)
+                if vecs and len(vecs) == len(texts) and all(isinstance(v, list) and len(v) > 0 for v in vecs):
+                    return vecs
+                err_detail = "empty_or_mismatched_vectors"
+            except Exception as e:
+                err_detail = f"embed_exception: {type(e).__name__}: {e}"
+            if attempt < max_attempts:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2.0, 8.0)
+    finally:
+        EMBED_SECONDS.labels(model=model).observe(max(time.monotonic() - t_emb, 0.0))
+    raise EvalEmbeddingError(err_detail)
+
+
+async def evaluate(
+    queries: List[str],
+    *,
+    collection: str,
+    top_k: int,
+    embed_model: str,
+    filters: Optional[Dict[str, Any]] = None,
+    expected_ids: Optional[List[Optional[List[PointId]]]] = None,
+    batch_size: int = 64,
+    concurrency: int = 4,
+    policy: Optional[qcli.ExtractivePolicy] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yield detail rows batch by batch, in completion order (each row carries its ``index``).
+
+    Queries are split into ``batch_size`` chunks; each chunk is embedded in one call and
+    searched with one ``search_batch`` round trip, with at most ``concurrency`` chunks in
+    flight, so run time grows with the number of batches rather than queries. The first
+    embedding failure raises :class:`EvalEmbeddingError` and cancels the other chunks.
+    """
+    size = max(1, int(batch_size))
+    sem = asyncio.Semaphore(max(1, int(concurrency)))
+
+    async def run_chunk(start: int) -> List[Dict[str, Any]]:
+        texts = queries[start:start + size]
+        async with sem:
+            vecs = await _embed_batch(texts, embed_model)
+            t_ret = time.monotonic()
+            results = await qcli.search_batch(collection, vecs, top_k=top_k, filters=filters)
+            RAG_RETRIEVAL_SECONDS.labels(collection=collection).observe(max(time.monotonic() - t_ret, 0.0))
+        return [
+            score_row(
+                start + i,
+                q,
+                results[i] if i < len(results) else [],
+                expected=(expected_ids[start + i] if expected_ids and start + i < len(expected_ids) else None),
+                policy=policy,
+            )
+            for i, q in enumerate(texts)
+        ]
+
+    tasks = [asyncio.ensure_future(run_chunk(start)) for start in range(0, len(queries), size)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        # 客户端断开或某批失败：取消其余批次
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from src.app.clients import ollama
+from src.app.clients import qdrant as qcli
+from src.app.config import settings
+from src.app.core import embedding_cache
+from src.app.core.context_packer import pack_contexts
+from src.app.core.deadline import Deadline, DeadlineExceeded
+from src.app.core.metrics import EMBED_SECONDS, RAG_RETRIEVAL_SECONDS, RAG_STAGE_SECONDS
+
+T = TypeVar("T")
+
+# (scored, distance=集合距离度量) -> (contexts, sources)
+PackFn = Callable[..., Tuple[List[str], List[Dict[str, Any]]]]
+PromptFn = Callable[[str, List[str]], str]
+EmbedFn = Callable[..., Awaitable[List[List[float]]]]
+SearchFn = Callable[..., Awaitable[List[Any]]]
+
+
+class EmbeddingError(Exception):
+    """The query embedding could not be obtained (message is the soft-fail reason)."""
+
+
+class DimensionMismatch(Exception):
+    def __init__(self, expected: int, got: int) -> None:
+        super().__init__(f"vector dimension mismatch: collection expects {expected}, query has {got}")
+        self.expected = expected
+        self.got = got
+
+
+def embed_model_name() -> str:
+    """Query embeddings always use the dedicated embed model so dimensions match the collection."""
+    return getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL
+
+
+def build_ask_prompt(query: str, contexts: List[str]) -> str:
+    """Prompt of ``/api/v1/ask``: answer in at most two sentences from the contexts only."""
+    if not contexts:
+        return f"问题：{query}\n请用不超过两句话作答。"
+    ctx = "\n\n".join(c for c in contexts)
+    return (
+        f"上下文：{ctx}\n"
+        f"问题：{query}\n"
+        "请仅依据上下文，用不超过两句话简洁作答。"
+    )
+
+
+def pack_ask_contexts(
+    scored: Sequence[Any], max_docs: int = 3, per_doc_max_tokens: int = 160, total_max_tokens: int = 240,
+    *, distance: Optional[str] = None,
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    # 小上下文窗口（num_ctx=320）下按 token 预算打包，MMR 选段并抑制近重复
+    return pack_contexts(
+        scored, max_docs=max_docs, max_tokens=total_max_tokens, per_doc_max_tokens=per_doc_max_tokens, distance=distance,
+    )
+
+
+class StageTimings:
+    """Wall time per pipeline stage, rendered as ``meta.timings`` and a ``Server-Timing`` header."""
+
+    def __init__(self) -> None:
+        self._ms: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self._ms[stage] = round(self._ms.get(stage, 0.0) + max(seconds, 0.0) * 1000.0, 2)
+        RAG_STAGE_SECONDS.labels(stage=stage).observe(max(seconds, 0.0))
+
+    async def timed(self, stage: str, aw: Awaitable[T]) -> T:
+        t0 = time.monotonic()
+        try:
+            return await aw
+        finally:
+            self.add(stage, time.monotonic() - t0)
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(self._ms)
+
+    def header(self) -> str:
+        return ", ".join(f"{stage};dur={ms}" for stage, ms in self._ms.items())
+
+
+class RagPipeline:
+    """embed → collection → retrieve → pack → prompt, shared by the ask and chat routers.
+
+    Each stage is a method that records its own timing, so callers can run the whole
+    chain (:meth:`run`) or interleave their own steps (semantic cache, heartbeats)
+    between stages. ``embed`` / ``search`` / ``pack`` / ``build_prompt`` can be swapped;
+    by default embeddings go through the embedding cache and collection metadata through
+    the catalog cache. All awaits are bounded by ``deadline`` when one is given.
+    """
+
+    def __init__(
+        self,
+        *,
+        collection: str,
+        top_k: int,
+        pack: PackFn,
+        build_prompt: PromptFn,
+        filters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[Deadline] = None,
+        embed_attempts: int = 1,
+        ensure_embed_model: bool = False,
+        with_vectors: bool = True,
+        embed: Optional[EmbedFn] = None,
+        search: Optional[SearchFn] = None,
+    ) -> None:
+        self.collection = collection
+        self.top_k = top_k
+        self.filters = filters
+        self.deadline = deadline or Deadline(None)
+        self.embed_attempts = max(1, int(embed_attempts))
+        self.ensure_embed_model = ensure_embed_model
+        self.with_vectors = with_vectors
+        self.embed_model = embed_model_name()
+        self._pack = pack
+        self._build_prompt = build_prompt
+        self._embed = embed or embedding_cache.embeddings
+        self._search = search or qcli.search_vectors
+        self.timings = StageTimings()
+        # 最近一次 describe 的集合元数据；pack 据其距离度量换算相关度
+        self.meta: Optional[qcli.CollectionMeta] = None
+
+    async def _embed_once(self, query: str) -> List[float]:
+        vecs = await self.deadline.run(self._embed([query], model=self.embed_model), "embed", timeout=settings.EMBED_TIMEOUT)
+        if not vecs or not vecs[0]:
+            raise EmbeddingError("empty_embedding")
+        return vecs[0]
+
+    async def _embed_with_retry(self, query: str) -> List[float]:
+        if self.ensure_embed_model:
+            await self.deadline.run(ollama.ensure_model(self.embed_model), "ensure_model")
+        delay = 0.5
+        error = "empty_embedding"
+        for attempt in range(1, self.embed_attempts + 1):
+            try:
+                return await self._embed_once(query)
+            except DeadlineExceeded:
+                raise
+            except EmbeddingError as e:
+                error = str(e)
+            except Exception as e:
+                error = f"embed_failed: {type(e).__name__}: {e}"
+            if attempt < self.embed_attempts:
+                if not await self.deadline.backoff(delay, "embed"):
+                    break
+                delay = min(delay * 2.0, 8.0)
+        raise EmbeddingError(error)
+
+    async def embed(self, query: str) -> List[float]:
+        t0 = time.monotonic()
+        try:
+            return await self.timings.timed("embed", self._embed_with_retry(query))
+        finally:
+            EMBED_SECONDS.labels(model=self.embed_model).observe(max(time.monotonic() - t0, 0.0))
+
+    async def describe(self) -> qcli.CollectionMeta:
+        self.meta = await self.timings.timed("collection", self.deadline.run(qcli.describe_collection(self.collection), "retrieve"))
+        return self.meta
+
+    async def embed_and_describe(self, query: str) -> Tuple[List[float], qcli.CollectionMeta]:
+        """Query embedding and the collection check run concurrently (they are independent)."""
+        meta_task = asyncio.ensure_future(self.describe())
+        try:
+            qvec = await self.embed(query)
+        except BaseException:
+            meta_task.cancel()
+            await asyncio.gather(meta_task, return_exceptions=True)
+            raise
+        return qvec, await meta_task
+
+    async def retrieve(self, qvec: List[float], meta: Optional[qcli.CollectionMeta] = None) -> List[Any]:
+        if meta is not None and meta.vector_size and meta.vector_size != len(qvec):
+            raise DimensionMismatch(meta.vector_size, len(qvec))
+        t0 = time.monotonic()
+        scored = await self.timings.timed(
+            "retrieve",
+            self.deadline.run(
+                self._search(self.collection, query=qvec, top_k=self.top_k, filters=self.filters, with_vectors=self.with_vectors),
+                "retrieve",
+            ),
+        )
+        RAG_RETRIEVAL_SECONDS.labels(collection=self.collection).observe(max(time.monotonic() - t0, 0.0))
+        return scored
+
+    def pack(self, scored: Sequence[Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        t0 = time.monotonic()
+        try:
+            return self._pack(scored, distance=self.meta.distance if self.meta is not None else None)
+        finally:
+            self.timings.add("pack", time.monotonic() - t0)
+
+    def prompt(self, query: str, contexts: List[str]) -> str:
+        t0 = time.monotonic()
+        try:
+            return self._build_prompt(query, contexts)
+        finally:
+            self.timings.add("prompt", time.monotonic() - t0)
+
+    async def run(self, query: str) -> "RagContext":
+        """Every stage up to the prompt; ``exists`` is False (and nothing retrieved) for a missing collection."""
+        qvec, meta = await self.embed_and_describe(query)
+        if not meta.exists:
+            return RagContext(query_vector=qvec, exists=False, meta=meta)
+        scored = await self.retrieve(qvec, meta)
+        contexts, sources = self.pack(scored)
+        return RagContext(
+            query_vector=qvec,
+            exists=True,
+            meta=meta,
+            scored=scored,
+            contexts=contexts,
+            sources=sources,
+            prompt=self.prompt(query, contexts),
+        )
+
+
+class RagContext:
+    """Output of :meth:`RagPipeline.run`."""
+
+    def __init__(
+        self,
+        *,
+        query_vector: List[float],
+        exists: bool,
+        meta: Optional[qcli.CollectionMeta] = None,
+        scored: Optional[List[Any]] = None,
+        contexts: Optional[List[str]] = None,
+        sources: Optional[List[Dict[str, Any]]] = None,
+        prompt: str = "",
+    ) -> None:
+        self.query_vector = query_vector
+        self.exists = exists
+        self.meta = meta
+        self.scored = scored or []
+        self.contexts = contexts or []
+        self.sources = sources or []
+        self.prompt = prompt
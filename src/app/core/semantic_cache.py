@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.app.clients import qdrant as qcli
+from src.app.config import settings
+from src.app.core.metrics import SEMANTIC_CACHE_LOOKUPS_TOTAL, SEMANTIC_CACHE_SAVED_SECONDS_TOTAL
+
+_BucketKey = Tuple[str, str, str, str]  # (collection, embed model, gen model, params hash)
+
+
+def params_hash(**params: Any) -> str:
+    """Stable hash of the request knobs that change the answer (options, filters, top_k...)."""
+    raw = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class _Bucket:
+    """Answers cached for one (collection, models, params) combination at one collection version."""
+
+    def __init__(self, version: int) -> None:
+        self.version = version
+        self.vectors: Optional[np.ndarray] = None  # (n, dim)，已归一化
+        self.expires: List[float] = []
+        self.answers: List[Dict[str, Any]] = []
+        self.costs: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def append(self, vec: np.ndarray, answer: Dict[str, Any], cost: float, expires: float) -> None:
+        row = vec.reshape(1, -1)
+        if self.vectors is None or self.vectors.shape[1] != row.shape[1]:
+            self.vectors, self.expires, self.answers, self.costs = row, [], [], []
+        else:
+            self.vectors = np.vstack([self.vectors, row])
+        self.expires.append(expires)
+        self.answers.append(answer)
+        self.costs.append(cost)
+
+    def drop(self, keep: np.ndarray) -> None:
+        idx = np.flatnonzero(keep)
+        self.vectors = self.vectors[idx] if self.vectors is not None and len(idx) else None
+        self.expires = [self.expires[i] for i in idx]
+        self.answers = [self.answers[i] for i in idx]
+        self.costs = [self.costs[i] for i in idx]
+
+
+class SemanticCache:
+    """In-process semantic answer cache for ``/api/v1/ask``.
+
+    A query whose embedding lies within ``max_distance`` (cosine) of a cached query with
+    the same collection, models and parameters reuses the cached answer. Entries expire
+    after ``ttl`` seconds, and a bucket is discarded as soon as the collection's data
+    version in :data:`qcli.catalog` moves (upserts, deletes, recreation).
+    """
+
+    def __init__(self, *, max_distance: float, ttl: float, max_entries: int) -> None:
+        self.max_distance = float(max_distance)
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._buckets: "OrderedDict[_BucketKey, _Bucket]" = OrderedDict()
+
+    @staticmethod
+    def _normalize(vec: List[float]) -> Optional[np.ndarray]:
+        arr = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(arr))
+        if arr.ndim != 1 or norm == 0.0:
+            return None
+        return arr / norm
+
+    def _bucket(self, key: _BucketKey, *, create: bool) -> Optional[_Bucket]:
+        version = qcli.catalog.version(key[0])
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket.version != version:
+            # 集合数据已变更：整桶失效
+            del self._buckets[key]
+            bucket = None
+        if bucket is None and create:
+            bucket = _Bucket(version)
+            self._buckets[key] = bucket
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def lookup(self, key: _BucketKey, vec: List[float]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return ``(answer, similarity)`` for the nearest live entry within the threshold."""
+        collection = key[0]
+        bucket = self._bucket(key, create=False)
+        q = self._normalize(vec)
+        if bucket is None or q is None or bucket.vectors is None or bucket.vectors.shape[1] != q.shape[0]:
+            SEMANTIC_CACHE_LOOKUPS_TOTAL.labels(collection=collection, result="miss").inc()
+            return None
+        now = time.monotonic()
+        alive = np.asarray(bucket.expires) > now
+        if not alive.all():
+            bucket.drop(alive)
+            if bucket.vectors is None:
+                SEMANTIC_CACHE_LOOKUPS_TOTAL.labels(collection=collection, result="miss").inc()
+                return None
+        sims = bucket.vectors @ q
+        best = int(np.argmax(sims))
+        similarity = float(sims[best])
+        if 1.0 - similarity > self.max_distance:
+            SEMANTIC_CACHE_LOOKUPS_TOTAL.labels(collection=collection, result="miss").inc()
+            return None
+        SEMANTIC_CACHE_LOOKUPS_TOTAL.labels(collection=collection, result="hit").inc()
+        SEMANTIC_CACHE_SAVED_SECONDS_TOTAL.labels(collection=collection).inc(bucket.costs[best])
+        return bucket.answers[best], similarity
+
+    def store(self, key: _BucketKey, vec: List[float], answer: Dict[str, Any], *, cost: float = 0.0) -> None:
+        """Cache ``answer``; ``cost`` is the retrieval+generation latency a future hit saves."""
+        q = self._normalize(vec)
+        if q is None:
+            return
+        bucket = self._bucket(key, create=True)
+        bucket.append(q, answer, max(0.0, cost), time.monotonic() + self.ttl)
+        self._evict()
+
+    def _evict(self) -> None:
+        total = sum(len(b) for b in self._buckets.values())
+        while total > self.max_entries and self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if len(bucket) <= 1:
+                del self._buckets[key]
+                total -= len(bucket)
+                continue
+            # 最久未访问的桶中先淘汰最早写入的条目
+            keep = np.ones(len(bucket), dtype=bool)
+            keep[0] = False
+            bucket.drop(keep)
+            total -= 1
+
+    def invalidate(self, collection: Optional[str] = None) -> None:
+        for key in [k for k in self._buckets if collection is None or k[0] == collection]:
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self._buckets.values())
+
+
+cache = SemanticCache(
+    max_distance=settings.SEMANTIC_CACHE_MAX_DISTANCE,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from src.app.config import settings
+from src.app.core.metrics import CHAT_SESSION_EVICTIONS_TOTAL, CHAT_SESSIONS_ACTIVE
+
+_Key = Tuple[str, str]  # (tenant, session_id)
+
+
+class SessionState(BaseModel):
+    session_id: str
+    tenant: str
+    model: str
+    # Ollama /api/generate 返回的 context（已编码的对话 token），下一轮原样回传
+    context: List[int] = Field(default_factory=list)
+    turns: int = 0
+    updated_at: float = 0.0
+
+
+class SessionStore:
+    """Per-session Ollama ``context`` with TTL expiry and a per-tenant LRU cap.
+
+    Sessions live in process memory, mirrored to Redis (``sess:{tenant}:{id}``) when
+    ``redis_enabled`` so they survive restarts and are shared by replicas. A context
+    longer than ``max_context_tokens`` is dropped (the next turn starts fresh) rather than
+    truncated, since a clipped KV prefix no longer matches the conversation.
+
+    Expired sessions of every tenant are swept at most every ``sweep_interval`` seconds,
+    and per-session locks only exist while a turn holds or waits for them.
+    """
+
+    def __init__(self, *, ttl: float, max_per_tenant: int, max_context_tokens: int, redis_enabled: bool = False) -> None:
+        self.ttl = max(0.0, float(ttl))
+        self.max_per_tenant = max(1, int(max_per_tenant))
+        self.max_context_tokens = max(0, int(max_context_tokens))
+        self.redis_enabled = redis_enabled
+        self._sessions: Dict[str, "OrderedDict[str, SessionState]"] = {}
+        # 会话锁及其当前持有/等待者数；计数归零即移除，避免锁表随会话 ID 无界增长
+        self._locks: Dict[_Key, Tuple[asyncio.Lock, int]] = {}
+        self.sweep_interval = min(self.ttl, 60.0) if self.ttl > 0 else 0.0
+        self._last_sweep = 0.0
+        self._redis: Any = None
+
+    # --- Redis tier（可选，失败时静默降级为仅内存） ---
+    def _get_redis(self) -> Any:
+        if not self.redis_enabled:
+            return None
+        if self._redis is None:
+            try:
+                from src.app.clients.redis import get_client
+
+                self._redis = get_client()
+            except Exception:
+                return None
+        return self._redis
+
+    @staticmethod
+    def _redis_key(tenant: str, session_id: str) -> str:
+        return f"sess:{tenant}:{session_id}"
+
+    async def _redis_get(self, tenant: str, session_id: str) -> Optional[SessionState]:
+        r = self._get_redis()
+        if r is None:
+            return None
+        try:
+            raw = await r.get(self._redis_key(tenant, session_id))
+            return SessionState(**json.loads(raw)) if raw else None
+        except Exception:
+            return None
+
+    async def _redis_set(self, state: SessionState) -> None:
+        r = self._get_redis()
+        if r is None:
+            return
+        try:
+            payload = json.dumps(state.model_dump(), separators=(",", ":"))
+            if self.ttl > 0:
+                await r.set(self._redis_key(state.tenant, state.session_id), payload, ex=int(self.ttl))
+            else:
+                await r.set(self._redis_key(state.tenant, state.session_id), payload)
+        except Exception:
+            pass
+
+    async def _redis_delete(self, tenant: str, session_id: str) -> None:
+        r = self._get_redis()
+        if r is None:
+            return
+        try:
+            await r.delete(self._redis_key(tenant, session_id))
+        except Exception:
+            pass
+
+    # --- in-process tier ---
+    def _expired(self, state: SessionState, now: float) -> bool:
+        return self.ttl > 0 and now - state.updated_at > self.ttl
+
+    def _drop(self, tenant: str, session_id: str, reason: str) -> None:
+        sessions = self._sessions.get(tenant)
+        if sessions is None or sessions.pop(session_id, None) is None:
+            return
+        CHAT_SESSION_EVICTIONS_TOTAL.labels(reason=reason).inc()
+        CHAT_SESSIONS_ACTIVE.labels(tenant=tenant).set(len(sessions))
+        if not sessions:
+            self._sessions.pop(tenant, None)
+
+    def _sweep(self, tenant: str, now: float) -> None:
+        sessions = self._sessions.get(tenant) or {}
+        for sid in [sid for sid, st in sessions.items() if self._expired(st, now)]:
+            self._drop(tenant, sid, "ttl")
+
+    def _sweep_all(self, now: float) -> None:
+        if self.sweep_interval <= 0 or now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for tenant in list(self._sessions):
+            self._sweep(tenant, now)
+
+    @asynccontextmanager
+    async def lock(self, tenant: str, session_id: str) -> AsyncIterator[None]:
+        """Serializes turns of one session so concurrent messages do not race on ``context``.
+
+        The lock is created on first use and removed once no turn holds or awaits it.
+        """
+        key = (tenant, session_id)
+        lk, users = self._locks.get(key) or (asyncio.Lock(), 0)
+        self._locks[key] = (lk, users + 1)
+        try:
+            async with lk:
+                yield
+        finally:
+            lk, users = self._locks[key]
+            if users <= 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lk, users - 1)
+
+    async def get(self, tenant: str, session_id: str) -> Optional[SessionState]:
+        now = time.time()
+        self._sweep_all(now)
+        self._sweep(tenant, now)
+        sessions = self._sessions.get(tenant)
+        state = sessions.get(session_id) if sessions else None
+        if state is not None:
+            sessions.move_to_end(session_id)
+            return state
+        state = await self._redis_get(tenant, session_id)
+        if state is not None and not self._expired(state, now):
+            self._put_local(state)
+            return state
+        return None
+
+    def _put_local(self, state: SessionState) -> None:
+        sessions = self._sessions.setdefault(state.tenant, OrderedDict())
+        sessions[state.session_id] = state
+        sessions.move_to_end(state.session_id)
+        while len(sessions) > self.max_per_tenant:
+            oldest = next(iter(sessions))
+            self._drop(state.tenant, oldest, "lru")
+        CHAT_SESSIONS_ACTIVE.labels(tenant=state.tenant).set(len(sessions))
+
+    async def save(self, tenant: str, session_id: str, model: str, context: Optional[List[int]], *, turns: int) -> SessionState:
+        ctx = list(context or [])
+        if self.max_context_tokens and len(ctx) > self.max_context_tokens:
+            CHAT_SESSION_EVICTIONS_TOTAL.labels(reason="context_overflow").inc()
+            ctx = []
+        now = time.time()
+        self._sweep_all(now)
+        state = SessionState(session_id=session_id, tenant=tenant, model=model, context=ctx, turns=turns, updated_at=now)
+        self._put_local(state)
+        await self._redis_set(state)
+        return state
+
+    async def delete(self, tenant: str, session_id: str) -> bool:
+        sessions = self._sessions.get(tenant)
+        existed = bool(sessions and session_id in sessions)
+        if existed:
+            self._drop(tenant, session_id, "deleted")
+        await self._redis_delete(tenant, session_id)
+        return existed
+
+    def count(self, tenant: Optional[str] = None) -> int:
+        if tenant is not None:
+            return len(self._sessions.get(tenant) or {})
+        return sum(len(v) for v in self._sessions.values())
+
+
+store = SessionStore(
+    ttl=settings.CHAT_SESSION_TTL,
+    max_per_tenant=settings.CHAT_SESSION_MAX_PER_TENANT,
+    max_context_tokens=settings.CHAT_SESSION_MAX_CONTEXT_TOKENS,
+    redis_enabled=settings.CHAT_SESSION_REDIS_ENABLED,
+)
@@ -0,0 +1,350 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+from src.app.config import settings
+from src.app.core import generation_stats
+from src.app.core.metrics import LLM_GENERATE_SECONDS
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away while a response was still streaming."""
+
+
+class DisconnectWatcher:
+    """Listens on the ASGI receive channel and fires once the client disconnects.
+
+    Callbacks registered with :meth:`on_disconnect` run on disconnect (e.g. to cancel a
+    background pump task), so upstream generation stops even if nothing is awaiting it.
+    """
+
+    def __init__(self, request: Any) -> None:
+        self._request = request
+        self.disconnected = asyncio.Event()
+        self._callbacks: List[Callable[[], Any]] = []
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> "DisconnectWatcher":
+        if self._task is None and self._request is not None:
+            self._task = asyncio.ensure_future(self._watch())
+        return self
+
+    async def _watch(self) -> None:
+        try:
+            while True:
+                message = await self._request.receive()
+                if message.get("type") == "http.disconnect":
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # receive 通道不可用时不做判断（视为仍在线）
+            return
+        self.disconnected.set()
+        for cb in self._callbacks:
+            try:
+                cb()
+            except Exception:
+                pass
+
+    def on_disconnect(self, callback: Callable[[], Any]) -> None:
+        self._callbacks.append(callback)
+
+    def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+
+async def stream_until_disconnect(gen: AsyncGenerator[Any, None], watcher: DisconnectWatcher) -> AsyncIterator[Any]:
+    """Yield from ``gen`` until it ends or the client disconnects.
+
+    On disconnect the pending read is cancelled, ``gen`` is closed (which closes the
+    upstream httpx stream) and :class:`ClientDisconnected` is raised.
+    """
+    disconnect = asyncio.ensure_future(watcher.disconnected.wait())
+    try:
+        while True:
+            nxt = asyncio.ensure_future(gen.__anext__())
+            done, _ = await asyncio.wait({nxt, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if nxt not in done:
+                nxt.cancel()
+                await asyncio.gather(nxt, return_exceptions=True)
+                raise ClientDisconnected()
+            try:
+                chunk = nxt.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        disconnect.cancel()
+        try:
+            await gen.aclose()
+        except Exception:
+            pass
+
+
+@asynccontextmanager
+async def watch_generation(
+    request: Any,
+    *,
+    model: str,
+    stream: str = "true",
+    endpoint: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[DisconnectWatcher]:
+    """Run a streaming generation under a disconnect watcher and record its outcome.
+
+    ``LLM_GENERATE_SECONDS`` is observed with ``outcome`` = ok / error / aborted; a
+    :class:`ClientDisconnected` raised inside the block is swallowed. ``stats`` (filled by
+    ``ollama.generate_stream(stats=...)``) feeds the token histograms under ``endpoint``.
+    """
+    watcher = DisconnectWatcher(request).start()
+    t0 = time.monotonic()
+    outcome = "ok"
+    try:
+        yield watcher
+    except ClientDisconnected:
+        outcome = "aborted"
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "aborted"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        if watcher.disconnected.is_set():
+            outcome = "aborted"
+        watcher.stop()
+        LLM_GENERATE_SECONDS.labels(model=model, stream=stream, outcome=outcome).observe(max(time.monotonic() - t0, 0.0))
+        if endpoint:
+            generation_stats.observe(stats, model=model, endpoint=endpoint)
+
+
+async def cancel_and_close(task: Optional["asyncio.Future[Any]"], gen: Optional[AsyncGenerator[Any, None]]) -> None:
+    """Cancel a task driving ``gen`` (if still running), wait for it, then close ``gen``."""
+    if task is not None:
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    if gen is not None:
+        try:
+            await gen.aclose()
+        except Exception:
+            pass
+
+
+# -------- SSE 流式引擎（有界队列 + 共享心跳 + 小分片合并） --------
+
+def sse_data_frame(text: str) -> bytes:
+    """One SSE event carrying ``text`` verbatim (ask-style framing)."""
+    return b"data: " + text.encode("utf-8") + b"\n\n"
+
+
+def sse_line_frames(text: str) -> bytes:
+    """One SSE event per line of ``text`` (chat-style framing)."""
+    return "".join(f"data: {line}\n\n" for line in text.splitlines()).encode("utf-8")
+
+
+def _as_text(chunk: Any) -> str:
+    if isinstance(chunk, (bytes, bytearray)):
+        return bytes(chunk).decode("utf-8", errors="replace")
+    return str(chunk)
+
+
+class _HeartbeatHub:
+    """A single timer task per event loop that emits heartbeats for every idle stream.
+
+    Replaces a ``wait_for`` timeout per chunk per stream with one periodic sweep.
+    """
+
+    def __init__(self, tick: float = 0.05) -> None:
+        self.tick = tick
+        self._streams: Set["SSEStream"] = set()
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def register(self, stream: "SSEStream") -> None:
+        self._streams.add(stream)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    def unregister(self, stream: "SSEStream") -> None:
+        self._streams.discard(stream)
+
+    async def _run(self) -> None:
+        while self._streams:
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            for stream in list(self._streams):
+                stream._maybe_heartbeat(now)
+
+
+_heartbeats = _HeartbeatHub()
+
+
+class SSEStream:
+    """Streams an upstream token generator to SSE frames with backpressure.
+
+    - A background pump reads ``source`` into a bounded queue (``SSE_QUEUE_SIZE``), so a
+      slow socket stops upstream reads instead of buffering without limit.
+    - Token chunks that arrive within ``SSE_FLUSH_MS`` are coalesced into one frame, up to
+      ``SSE_FLUSH_BYTES``; the first chunk is flushed immediately to keep TTFT low.
+    - Idle heartbeats come from one shared timer rather than a per-chunk ``wait_for``.
+    - ``time_limit_ms`` / ``max_chunks`` cap the stream; the pump is always cancelled on
+      exit, and a disconnect reported by ``watcher`` stops the stream without a done frame.
+    - Upstream errors become an ``[error]`` frame, or propagate with ``raise_errors=True``.
+    """
+
+    def __init__(
+        self,
+        source: AsyncGenerator[Any, None],
+        *,
+        frame: Callable[[str], bytes] = sse_data_frame,
+        watcher: Optional[DisconnectWatcher] = None,
+        heartbeat_ms: Optional[float] = None,
+        time_limit_ms: Optional[float] = None,
+        max_chunks: Optional[int] = None,
+        started_frame: Optional[bytes] = None,
+        done_frame: Optional[bytes] = None,
+        heartbeat_frame: bytes = b"data: [heartbeat]\n\n",
+        flush_ms: Optional[float] = None,
+        flush_bytes: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        raise_errors: bool = False,
+    ) -> None:
+        self.source = source
+        self.raise_errors = raise_errors
+        self.frame = frame
+        self.watcher = watcher
+        self.heartbeat = (float(heartbeat_ms) / 1000.0) if heartbeat_ms else None
+        self.time_limit = (float(time_limit_ms) / 1000.0) if time_limit_ms is not None else None
+        self.max_chunks = max_chunks
+        self.started_frame = started_frame
+        self.done_frame = done_frame
+        self.heartbeat_frame = heartbeat_frame
+        self.flush = max(0.0, float(settings.SSE_FLUSH_MS if flush_ms is None else flush_ms)) / 1000.0
+        self.flush_bytes = int(settings.SSE_FLUSH_BYTES if flush_bytes is None else flush_bytes)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, int(settings.SSE_QUEUE_SIZE if queue_size is None else queue_size)))
+        self._last_activity = time.monotonic()
+
+    def _maybe_heartbeat(self, now: float) -> None:
+        if self.heartbeat is None or now - self._last_activity < self.heartbeat:
+            return
+        self._last_activity = now
+        try:
+            self._queue.put_nowait(("hb", None))
+        except asyncio.QueueFull:
+            # 队列满说明数据仍在流动，无需心跳
+            pass
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self.source:
+                if chunk:
+                    await self._queue.put(("data", chunk))
+            await self._queue.put(("eof", None))
+        except asyncio.CancelledError:
+            # 被取消（断连/超时）时流已作废：必要时丢弃一条数据，保证消费端能读到 eof
+            if self._queue.full():
+                self._queue.get_nowait()
+            self._queue.put_nowait(("eof", None))
+            raise
+        except Exception as e:
+            await self._queue.put(("error", e))
+
+    def _disconnected(self) -> bool:
+        return self.watcher is not None and self.watcher.disconnected.is_set()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        pump = asyncio.ensure_future(self._pump())
+        if self.watcher is not None:
+            self.watcher.on_disconnect(pump.cancel)
+        if self.heartbeat is not None:
+            _heartbeats.register(self)
+        try:
+            if self.started_frame:
+                yield self.started_frame
+            async for out in self._frames():
+                if self._disconnected():
+                    return
+                yield out
+            if self.done_frame and not self._disconnected():
+                yield self.done_frame
+        finally:
+            _heartbeats.unregister(self)
+            await cancel_and_close(pump, self.source)
+
+    async def _frames(self) -> AsyncIterator[bytes]:
+        start = time.monotonic()
+        chunks = 0
+        first = True
+        while True:
+            kind, payload = await self._queue.get()
+            if kind == "hb":
+                yield self.heartbeat_frame
+            elif kind == "error":
+                if self.raise_errors:
+                    raise payload
+                yield sse_data_frame(f"[error]: {type(payload).__name__}: {payload}")
+                return
+            elif kind == "eof":
+                return
+            else:
+                parts = [_as_text(payload)]
+                size = len(parts[0])
+                chunks += 1
+                ended = False
+                if not first and self.flush > 0 and size < self.flush_bytes:
+                    # 合并窗口：等待一个 flush 周期，再一次性取走已到达的小分片
+                    await asyncio.sleep(self.flush)
+                while not ended and size < self.flush_bytes and (self.max_chunks is None or chunks < self.max_chunks):
+                    try:
+                        nkind, npayload = self._queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if nkind == "data":
+                        parts.append(_as_text(npayload))
+                        size += len(parts[-1])
+                        chunks += 1
+                    elif nkind != "hb":
+                        # error / eof：先输出已合并的数据，再放回控制事件
+                        self._queue.put_nowait((nkind, npayload))
+                        ended = True
+                first = False
+                self._last_activity = time.monotonic()
+                out = self.frame("".join(parts))
+                if out:
+                    yield out
+                if self.max_chunks is not None and chunks >= self.max_chunks:
+                    return
+            if self.time_limit is not None and time.monotonic() - start >= self.time_limit:
+                return
+
+
+async def heartbeat_while(aw: Awaitable[T], heartbeat_ms: Optional[float], result: List[Any], *, frame: bytes = b"data: [heartbeat]\n\n") -> AsyncIterator[bytes]:
+    """Await ``aw`` while yielding heartbeat frames every ``heartbeat_ms``; the outcome is appended to ``result``.
+
+    Exceptions raised by ``aw`` propagate to the caller after the last heartbeat.
+    """
+    task = asyncio.ensure_future(aw)
+    try:
+        if heartbeat_ms and heartbeat_ms > 0:
+            interval = max(heartbeat_ms / 1000.0, 0.1)
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=interval)
+                if done:
+                    break
+                yield frame
+        result.append(await task)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
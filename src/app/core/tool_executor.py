@@ -2,17 +2,27 @@ from __future__ import annotations
 
 import asyncio
 import hashlib
+import importlib.util
+import ipaddress
 import json
 import logging
+import math
+import socket
 import time
-from typing import Any, Dict, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set, Tuple
 
+import httpcore
 import httpx
 from urllib.parse import urlparse
 from fastapi import HTTPException
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 from psycopg.rows import dict_row
 from src.app.clients.postgres import get_connection
+from src.app.config import settings
+from src.app.core import tool_state
+from src.app.core.tool_state import RATE_ALGORITHMS, STATE_ENTRIES, RateRule, StateBackend
 from src.app.routers.db import validate_sql as _db_validate_sql, wrap_with_limit as _db_wrap_with_limit
 
 logger = logging.getLogger(__name__)
@@ -36,9 +46,27 @@ CACHE_HIT_TOTAL = Counter(
 RETRY_TOTAL = Counter(
     "tools_retries_total", "Total retries executed", ["tool_type", "tool_name", "tenant"]
 )
+# 等待令牌（options.rate_limit_max_wait_ms > 0）后放行的请求所等待的时长
+RL_WAIT_SEC = Histogram(
+    "tools_rate_limit_wait_seconds", "Time admitted requests waited for a rate-limit token", ["tool_type", "tool_name", "tenant"]
+)
 LATENCY_SEC = Histogram(
     "tools_request_latency_seconds", "Tool request latency in seconds", ["tool_type", "tool_name", "tenant"]
 )
+# 合并到进行中相同调用（singleflight）并共享其结果的请求数
+SF_SHARED_TOTAL = Counter(
+    "tools_singleflight_shared_total", "Calls that shared an in-flight identical call's result", ["tool_type", "tool_name", "tenant"]
+)
+# http_get/http_post 连接池：每个主机的在途请求数、占 max_connections 的比例与客户端创建次数（持续增长说明池被频繁淘汰）
+HTTP_POOL_IN_FLIGHT = Gauge(
+    "tools_http_pool_in_flight", "In-flight requests on pooled tool HTTP clients", ["host"]
+)
+HTTP_POOL_UTILIZATION = Gauge(
+    "tools_http_pool_utilization", "In-flight requests / max_connections of pooled tool HTTP clients", ["host"]
+)
+HTTP_POOL_CREATED_TOTAL = Counter(
+    "tools_http_pool_clients_created_total", "Pooled tool HTTP clients created", ["host"]
+)
 
 SENSITIVE_KEYS = {"token", "authorization", "cookie", "api_key", "apikey", "password"}
 
@@ -66,12 +94,27 @@ def _mask_dict(d: Any) -> Any:
         return d
 
 
-# 内部状态（进程内）
-_RATE_BUCKET: Dict[Tuple[Any, ...], Tuple[int, float]] = {}
-_SINGLEFLIGHT: Dict[Tuple[Any, ...], asyncio.Lock] = {}
-_CACHE: Dict[Tuple[Any, ...], Tuple[float, Dict[str, Any]]] = {}
-_BREAKER: Dict[Tuple[Any, ...], Tuple[int, float]] = {}
+# 进行中的调用在完成时即移除（数量受并发上限约束），只统计条目数
+_SINGLEFLIGHT: Dict[Tuple[Any, ...], "asyncio.Future[Dict[str, Any]]"] = {}
 _RATE_DEFAULT_PER_SEC = 5
+_RATE_MAX_WAIT_MS = 5000
+
+
+def sweep_state() -> int:
+    """Expire stale entries in the in-process state tables and refresh the size gauges."""
+    removed = tool_state.memory.sweep()
+    STATE_ENTRIES.labels(table="singleflight").set(len(_SINGLEFLIGHT))
+    return removed
+
+
+async def run_state_sweeper(interval: float) -> None:
+    """Background sweeper started from the FastAPI lifespan (cancelled on shutdown)."""
+    while True:
+        await asyncio.sleep(max(0.1, interval))
+        try:
+            sweep_state()
+        except Exception as e:
+            logger.warning("tools_state_sweep_failed error=%s: %s", type(e).__name__, e)
 
 
 def _exc_text(e: Exception) -> str:
@@ -84,16 +127,204 @@ def _exc_text(e: Exception) -> str:
     return f"{e.__class__.__name__}: {msg}"
 
 
-class _AsyncLockCtx:
-    def __init__(self, lock: asyncio.Lock):
-        self.lock = lock
+class _DnsCachingBackend(httpcore.AsyncNetworkBackend):
+    """Network backend that caches host → IP lookups for ``ttl`` seconds.
 
-    async def __aenter__(self):
-        await self.lock.acquire()
-        return self
+    Only the TCP connect target is rewritten; TLS still verifies against the original
+    hostname (httpcore passes it to ``start_tls`` separately). At most ``max_entries``
+    lookups are kept (least recently used first out).
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024) -> None:
+        self._inner = httpcore.AnyIOBackend()
+        self._ttl = ttl
+        self._max_entries = max(1, int(max_entries))
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, str]]" = OrderedDict()
+
+    async def _lookup(self, host: str, port: int) -> str:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        return infos[0][4][0]
+
+    async def resolve(self, host: str, port: int) -> str:
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+        now = time.monotonic()
+        hit = self._cache.get((host, port))
+        if hit is not None and hit[0] > now:
+            self._cache.move_to_end((host, port))
+            return hit[1]
+        addr = await self._lookup(host, port)
+        self._cache[(host, port)] = (now + self._ttl, addr)
+        self._cache.move_to_end((host, port))
+        while len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
+        return addr
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addr = await self.resolve(host, port)
+        return await self._inner.connect_tcp(addr, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._inner.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._inner.sleep(seconds)
+
+
+class _PooledClient:
+    __slots__ = ("client", "label", "in_flight", "closing", "closed")
+
+    def __init__(self, client: httpx.AsyncClient, label: str) -> None:
+        self.client = client
+        self.label = label
+        self.in_flight = 0
+        self.closing = False
+        self.closed = False
+
+
+class HttpClientPool:
+    """Long-lived httpx clients for the http_get/http_post tools.
+
+    Clients are keyed by (scheme, host[:port], timeout class) so connections are reused
+    across invocations; the exact per-call timeout is still applied per request. At most
+    ``max_clients`` clients are kept (least recently used is closed once idle); a host's
+    metric series are removed once its last client has closed.
+    """
+
+    _TIMEOUT_CLASSES = ((2.0, "fast"), (5.0, "default"))
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        dns_cache_ttl: float = 0.0,
+        max_clients: int = 64,
+    ) -> None:
+        self.max_connections = max(1, int(max_connections))
+        self.keepalive_expiry = max(0.0, float(keepalive_expiry))
+        self.http2 = bool(http2)
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("tools_http2_unavailable: package 'h2' not installed, falling back to HTTP/1.1")
+            self.http2 = False
+        self.dns_cache_ttl = max(0.0, float(dns_cache_ttl))
+        self.max_clients = max(1, int(max_clients))
+        self._backend = _DnsCachingBackend(self.dns_cache_ttl) if self.dns_cache_ttl > 0 else None
+        self._clients: "OrderedDict[Tuple[str, str, str], _PooledClient]" = OrderedDict()
+        self._closing: Set["asyncio.Task[None]"] = set()
+        # 各指标标签下尚未关闭的客户端数（同一主机可有多个超时档位的客户端）
+        self._open: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def timeout_class(cls, timeout_s: float) -> str:
+        for bound, name in cls._TIMEOUT_CLASSES:
+            if timeout_s <= bound:
+                return name
+        return "slow"
+
+    def _key(self, url: str, timeout_s: float) -> Tuple[str, str, str]:
+        u = httpx.URL(url)
+        host = u.host.lower() + (f":{u.port}" if u.port else "")
+        return (u.scheme, host, self.timeout_class(timeout_s))
+
+    def _new_client(self, timeout_class: str) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        default_timeout = dict((name, bound) for bound, name in self._TIMEOUT_CLASSES).get(timeout_class, 15.0)
+        # 由 httpx 按 HTTP(S)_PROXY/ALL_PROXY/NO_PROXY 构建代理挂载（trust_env），与逐次创建客户端时一致
+        client = httpx.AsyncClient(limits=limits, http2=self.http2, timeout=default_timeout, follow_redirects=True)
+        # DNS 缓存只装到直连传输上；走代理的请求由代理解析 DNS
+        pool = getattr(client._transport, "_pool", None)
+        if self._backend is not None and type(pool) is httpcore.AsyncConnectionPool:
+            pool._network_backend = self._backend
+        return client
+
+    async def _finish(self, entry: _PooledClient) -> None:
+        if entry.closed:
+            return
+        entry.closed = True
+        try:
+            await entry.client.aclose()
+        except Exception as e:
+            logger.debug("tools_http_client_close_failed error=%s: %s", type(e).__name__, e)
+        # 该主机最后一个客户端关闭后移除其指标序列，避免按主机无界累积
+        left = self._open.get(entry.label, 1) - 1
+        if left > 0:
+            self._open[entry.label] = left
+            return
+        self._open.pop(entry.label, None)
+        for metric in (HTTP_POOL_IN_FLIGHT, HTTP_POOL_UTILIZATION, HTTP_POOL_CREATED_TOTAL):
+            try:
+                metric.remove(entry.label)
+            except KeyError:
+                pass
+
+    def _close_later(self, entry: _PooledClient) -> None:
+        task = asyncio.ensure_future(self._finish(entry))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _retire(self, entry: _PooledClient) -> None:
+        entry.closing = True
+        if entry.in_flight == 0:
+            self._close_later(entry)
+
+    def _get(self, key: Tuple[str, str, str]) -> _PooledClient:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 连接绑定在创建它的事件循环上；循环变化（测试/重启）时关闭旧客户端（旧循环上的请求已不会再回来）
+            stale = list(self._clients.values())
+            self._clients.clear()
+            self._closing.clear()
+            self._loop = loop
+            for old in stale:
+                old.closing = True
+                self._close_later(old)
+        entry = self._clients.get(key)
+        if entry is not None:
+            self._clients.move_to_end(key)
+            return entry
+        label = f"{key[0]}://{key[1]}"
+        entry = _PooledClient(self._new_client(key[2]), label)
+        self._clients[key] = entry
+        self._open[label] = self._open.get(label, 0) + 1
+        HTTP_POOL_CREATED_TOTAL.labels(host=label).inc()
+        while len(self._clients) > self.max_clients:
+            _, old = self._clients.popitem(last=False)
+            self._retire(old)
+        return entry
+
+    def _observe(self, entry: _PooledClient, delta: int) -> None:
+        entry.in_flight += delta
+        HTTP_POOL_IN_FLIGHT.labels(host=entry.label).inc(delta)
+        HTTP_POOL_UTILIZATION.labels(host=entry.label).set(entry.in_flight / self.max_connections)
+
+    @asynccontextmanager
+    async def client(self, url: str, timeout_s: float) -> AsyncIterator[httpx.AsyncClient]:
+        entry = self._get(self._key(url, timeout_s))
+        self._observe(entry, 1)
+        try:
+            yield entry.client
+        finally:
+            self._observe(entry, -1)
+            if entry.closing and entry.in_flight == 0:
+                await self._finish(entry)
 
-    async def __aexit__(self, exc_type, exc, tb):
-        self.lock.release()
+    async def close(self) -> None:
+        """Close every pooled client (called from the FastAPI lifespan)."""
+        entries = list(self._clients.values())
+        self._clients.clear()
+        for e in entries:
+            e.closing = True
+        await asyncio.gather(*(self._finish(e) for e in entries), *self._closing, return_exceptions=True)
 
 
 class ToolExecutor:
@@ -106,61 +337,89 @@ class ToolExecutor:
         h = hashlib.sha256(blob.encode("utf-8")).hexdigest()
         return ":".join([tenant_id, tool_type.lower(), tool_name.lower(), h])
 
-    def _rate_limit_check(self, key: Union[Tuple[Any, ...], str], options: Dict[str, Any]) -> None:
-        limit = options.get("rate_limit_per_sec", _RATE_DEFAULT_PER_SEC)
-        if not isinstance(limit, int) or limit <= 0:
-            limit = _RATE_DEFAULT_PER_SEC
-        now = time.time()
-        window = int(now)
-        k = ("rl", key) if isinstance(key, str) else key
-        count, win = _RATE_BUCKET.get(k, (0, window))
-        if win != window:
-            count, win = 0, window
-        count += 1
-        _RATE_BUCKET[k] = (count, win)
-        if count > limit:
-            # 指标在路由层处理标签更可靠，这里不强绑
-            raise HTTPException(status_code=429, detail="Too Many Requests (rate limited)")
-
-    def _breaker_check_and_mark(self, key: Union[Tuple[Any, ...], str], ok: Optional[bool], threshold: int, cooldown_ms: int) -> bool:
-        now = time.time()
-        k = ("cb", key) if isinstance(key, str) else key
-        fails, until = _BREAKER.get(k, (0, 0.0))
-        if now < until:
-            return False
-        if ok is None:
+    def _rate_rule(self, options: Dict[str, Any]) -> Tuple[RateRule, float]:
+        """Build the rate-limit rule and the max wait (seconds) from merged policy options."""
+        algorithm = str(options.get("rate_limit_algorithm") or settings.TOOLS_RATE_LIMIT_ALGORITHM).lower()
+        if algorithm not in RATE_ALGORITHMS:
+            raise HTTPException(status_code=400, detail=f"options.rate_limit_algorithm must be one of {list(RATE_ALGORITHMS)}")
+        rate = options.get("rate_limit_per_sec", _RATE_DEFAULT_PER_SEC)
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0:
+            rate = _RATE_DEFAULT_PER_SEC
+        burst = options.get("rate_limit_burst")
+        if isinstance(burst, bool) or not isinstance(burst, int) or burst <= 0:
+            burst = max(1, math.ceil(rate))
+        window_ms = options.get("rate_limit_window_ms", 1000)
+        if isinstance(window_ms, bool) or not isinstance(window_ms, int) or not (10 <= window_ms <= 60000):
+            window_ms = 1000
+        max_wait_ms = options.get("rate_limit_max_wait_ms", settings.TOOLS_RATE_LIMIT_MAX_WAIT_MS)
+        if isinstance(max_wait_ms, bool) or not isinstance(max_wait_ms, int) or max_wait_ms < 0:
+            max_wait_ms = settings.TOOLS_RATE_LIMIT_MAX_WAIT_MS
+        rule = RateRule(algorithm=algorithm, rate=float(rate), burst=burst, window_s=window_ms / 1000.0)
+        return rule, min(max_wait_ms, _RATE_MAX_WAIT_MS) / 1000.0
+
+    async def _rate_limit_check(self, state: StateBackend, key: str, rule: RateRule, max_wait_s: float, labels: Dict[str, str]) -> None:
+        waited = 0.0
+        while True:
+            wait = await state.rate_acquire(f"rl:{rule.algorithm}:{key}", rule)
+            if wait <= 0:
+                break
+            if waited + wait > max_wait_s:
+                # 指标在路由层处理标签更可靠，这里不强绑
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too Many Requests (rate limited)",
+                    headers={"Retry-After": str(max(1, math.ceil(wait)))},
+                )
+            # 等待模式：短暂等待下一个令牌/窗口空位后重试，而不是直接拒绝
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited > 0:
+            RL_WAIT_SEC.labels(**labels).observe(waited)
+
+    def _state_backend(self, options: Dict[str, Any]) -> StateBackend:
+        try:
+            return tool_state.get_backend(options.get("state_backend"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"options.state_backend must be one of {list(tool_state.BACKEND_NAMES)}")
+
+    @staticmethod
+    def _collapsible(tool_type: str, tool_name: str, cache_ttl_ms: int) -> bool:
+        """Only idempotent (http_get, db_query) or cacheable calls may share a flight."""
+        if cache_ttl_ms > 0 or tool_type.lower() == "http_get":
             return True
-        if ok:
-            _BREAKER[k] = (0, 0.0)
-        else:
-            fails += 1
-            if fails >= max(1, threshold):
-                _BREAKER[k] = (fails, now + max(100.0, cooldown_ms / 1000.0))
-            else:
-                _BREAKER[k] = (fails, 0.0)
-        return True
-
-    def _cache_get(self, key: Tuple[Any, ...]) -> Optional[Dict[str, Any]]:
-        entry = _CACHE.get(key)
-        if not entry:
-            return None
-        expire_at, value = entry
-        if time.time() > expire_at:
-            _CACHE.pop(key, None)
-            return None
-        return value
-
-    def _cache_put(self, key: Tuple[Any, ...], value: Dict[str, Any], ttl_ms: int) -> None:
-        if ttl_ms <= 0:
-            return
-        _CACHE[key] = (time.time() + ttl_ms / 1000.0, value)
+        return (tool_type.lower(), tool_name.lower()) in (("db_query", "template"), ("db", "query_template"))
+
+    @staticmethod
+    def _options_key(options: Dict[str, Any]) -> str:
+        # 选项会改变请求本身（content_type、timeout_ms、retry_max、resp_max_chars 等），须纳入 singleflight 键
+        try:
+            blob = json.dumps(options or {}, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+        except Exception:
+            blob = repr(sorted((options or {}).items(), key=lambda kv: str(kv[0])))
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _singleflight_join(
+        self, key: Tuple[Any, ...], work: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Tuple["asyncio.Future[Dict[str, Any]]", bool]:
+        """Return (flight, is_leader): the in-flight call for ``key``, starting ``work`` if none.
 
-    def _singleflight_lock(self, key: Tuple[Any, ...]) -> _AsyncLockCtx:
-        lock = _SINGLEFLIGHT.get(key)
-        if lock is None:
-            lock = asyncio.Lock()
-            _SINGLEFLIGHT[key] = lock
-        return _AsyncLockCtx(lock)
+        The flight runs as its own task so a cancelled caller does not fail the others;
+        its entry is removed as soon as it completes.
+        """
+        flight = _SINGLEFLIGHT.get(key)
+        if flight is not None and not flight.done() and flight.get_loop() is asyncio.get_running_loop():
+            return flight, False
+        flight = asyncio.ensure_future(work())
+        _SINGLEFLIGHT[key] = flight
+
+        def _done(t: "asyncio.Future[Dict[str, Any]]") -> None:
+            if _SINGLEFLIGHT.get(key) is t:
+                del _SINGLEFLIGHT[key]
+            if not t.cancelled():
+                t.exception()  # 所有调用方都已取消时避免 "exception was never retrieved"
+
+        flight.add_done_callback(_done)
+        return flight, True
 
     # 校验
     def _check_host_policy(self, url: str, options: Dict[str, Any]) -> None:
@@ -229,8 +488,9 @@ class ToolExecutor:
             raise ValueError("params.headers must be an object")
         timeout_ms = int(options.get("timeout_ms", 2000))
         max_chars = int(options.get("resp_max_chars", 2048))
-        async with httpx.AsyncClient(timeout=timeout_ms / 1000.0, follow_redirects=True) as client:
-            resp = await client.get(url, headers=headers)
+        timeout_s = timeout_ms / 1000.0
+        async with http_pool.client(url, timeout_s) as client:
+            resp = await client.get(url, headers=headers, timeout=timeout_s)
         body = resp.text or ""
         if max_chars > 0 and len(body) > max_chars:
             body = body[:max_chars]
@@ -250,7 +510,8 @@ class ToolExecutor:
         max_chars = int(options.get("resp_max_chars", 2048))
         content_type = str(options.get("content_type", "application/json")).lower()
         raw_body = params.get("body") if isinstance(params, dict) else None
-        async with httpx.AsyncClient(timeout=timeout_ms / 1000.0, follow_redirects=True) as client:
+        timeout_s = timeout_ms / 1000.0
+        async with http_pool.client(url, timeout_s) as client:
             if content_type == "application/json":
                 json_body = None
                 if isinstance(raw_body, (dict, list)):
@@ -260,7 +521,7 @@ class ToolExecutor:
                         json_body = json.loads(raw_body)
                     except Exception:
                         headers = {**(headers or {}), "Content-Type": "application/json"}
-                        resp = await client.post(url, headers=headers, content=raw_body)
+                        resp = await client.post(url, headers=headers, content=raw_body, timeout=timeout_s)
                         body = resp.text or ""
                         if max_chars > 0 and len(body) > max_chars:
                             body = body[:max_chars]
@@ -270,13 +531,13 @@ class ToolExecutor:
                             "body": body,
                             "normalized": normalized,
                         }
-                resp = await client.post(url, headers=headers, json=json_body)
+                resp = await client.post(url, headers=headers, json=json_body, timeout=timeout_s)
             else:
                 data = raw_body if isinstance(raw_body, (str, bytes)) else (
                     json.dumps(raw_body) if raw_body is not None else None
                 )
                 headers = {**(headers or {}), "Content-Type": content_type}
-                resp = await client.post(url, headers=headers, content=data)
+                resp = await client.post(url, headers=headers, content=data, timeout=timeout_s)
         body = resp.text or ""
         if max_chars > 0 and len(body) > max_chars:
             body = body[:max_chars]
@@ -341,6 +602,8 @@ class ToolExecutor:
     async def execute(self, tenant_id: str, tool_type: str, tool_name: str, params: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
         # 校验与标准化
         normalized = self._validate(tool_type, tool_name, params, options)
+        # 状态后端（限流/熔断/缓存）：memory 为进程内，redis 为多 worker/多 Pod 共享
+        state = self._state_backend(options)
         # 标签与键
         tenant_label = (tenant_id or "_anon_")
         labels = {"tool_type": tool_type.lower(), "tool_name": tool_name.lower(), "tenant": tenant_label}
@@ -348,72 +611,118 @@ class ToolExecutor:
         start_ts = time.perf_counter()
         key_base = self._stable_key(tenant_label, tool_type, tool_name, params, normalized)
         # 限流
+        rate_rule, rate_max_wait_s = self._rate_rule(options)
         try:
-            self._rate_limit_check((labels["tool_type"], labels["tool_name"], tenant_label, key_base), options)
+            await self._rate_limit_check(state, key_base, rate_rule, rate_max_wait_s, labels)
         except HTTPException:
             RL_TOTAL.labels(**labels).inc()
             LATENCY_SEC.labels(**labels).observe(max(0.0, time.perf_counter() - start_ts))
             raise
         # 熔断预检查
         circuit_threshold = int(options.get("circuit_threshold", 3))
-        circuit_cooldown_ms = int(options.get("circuit_cooldown_ms", 5000))
-        if not self._breaker_check_and_mark(key_base, ok=None, threshold=circuit_threshold, cooldown_ms=circuit_cooldown_ms):
+        circuit_cooldown_s = max(0.1, int(options.get("circuit_cooldown_ms", 5000)) / 1000.0)
+        breaker_key = f"cb:{key_base}"
+        if not await state.breaker_allow(breaker_key, cooldown_s=circuit_cooldown_s):
             CB_OPEN_TOTAL.labels(**labels).inc()
             LATENCY_SEC.labels(**labels).observe(max(0.0, time.perf_counter() - start_ts))
             raise HTTPException(status_code=503, detail="Service temporarily unavailable (circuit open)")
         # 缓存
         cache_ttl_ms = int(options.get("cache_ttl_ms", 0))
-        cache_key = ("cache", key_base)
+        cache_key = f"cache:{key_base}"
         if cache_ttl_ms > 0:
-            cached = self._cache_get(cache_key)
+            cached = await state.cache_get(cache_key)
             if cached is not None:
                 CACHE_HIT_TOTAL.labels(**labels).inc()
                 LATENCY_SEC.labels(**labels).observe(max(0.0, time.perf_counter() - start_ts))
                 logger.info("cache_hit", extra={"labels": labels, "key": key_base})
                 return {**cached, "from_cache": True}
-        # singleflight
-        async with self._singleflight_lock(("sf", key_base)):
-            masked_params = _mask_dict(params)
-            masked_options = _mask_dict(options)
-            # 重试
-            retry_max = int(options.get("retry_max", 0))
-            backoff_ms = int(options.get("retry_backoff_ms", 100))
-            attempt = 0
-            last_err: Optional[str] = None
-            while True:
-                attempt += 1
-                try:
-                    if bool(options.get("simulate_fail", False)):
-                        raise RuntimeError("simulated failure")
-                    # 执行
-                    if tool_type.lower() == "http_get":
-                        result = await self._do_http_get(params, options, normalized)
-                    elif tool_type.lower() == "http_post":
-                        result = await self._do_http_post(params, options, normalized)
-                    elif (tool_type.lower(), tool_name.lower()) in (("db_query", "template"), ("db", "query_template")):
-                        result = await self._do_db_query(params, options, normalized)
-                    else:
-                        result = {"message": "tool invoked (validated)", "normalized": normalized}
-                    # 缓存写入
-                    if cache_ttl_ms > 0:
-                        self._cache_put(cache_key, result, cache_ttl_ms)
-                    # 熔断成功标记
-                    self._breaker_check_and_mark(("cb", key_base), ok=True, threshold=circuit_threshold, cooldown_ms=circuit_cooldown_ms)
+        def run() -> Awaitable[Dict[str, Any]]:
+            return self._run_with_retries(
+                tool_type, tool_name, params, options, normalized, labels,
+                state=state, breaker_key=breaker_key, cache_key=cache_key, cache_ttl_ms=cache_ttl_ms,
+                circuit_threshold=circuit_threshold, circuit_cooldown_s=circuit_cooldown_s, start_ts=start_ts,
+            )
+
+        if not self._collapsible(tool_type, tool_name, cache_ttl_ms):
+            # 非幂等且不缓存的调用（如 http_post）每次都真正执行
+            result = await run()
+            return {**result, "from_cache": False, "echo": _mask_dict(params), "options": _mask_dict(options)}
+        # singleflight：并发的相同调用（相同参数与选项）只执行一次，其余调用共享结果或错误
+        flight, leader = self._singleflight_join(("sf", key_base, self._options_key(options)), run)
+        if not leader:
+            SF_SHARED_TOTAL.labels(**labels).inc()
+        try:
+            result = await asyncio.shield(flight)
+        finally:
+            if not leader:
+                LATENCY_SEC.labels(**labels).observe(max(0.0, time.perf_counter() - start_ts))
+        return {**result, "from_cache": False, "echo": _mask_dict(params), "options": _mask_dict(options)}
+
+    async def _run_with_retries(
+        self,
+        tool_type: str,
+        tool_name: str,
+        params: Dict[str, Any],
+        options: Dict[str, Any],
+        normalized: Dict[str, Any],
+        labels: Dict[str, str],
+        *,
+        state: StateBackend,
+        breaker_key: str,
+        cache_key: str,
+        cache_ttl_ms: int,
+        circuit_threshold: int,
+        circuit_cooldown_s: float,
+        start_ts: float,
+    ) -> Dict[str, Any]:
+        # 重试
+        retry_max = int(options.get("retry_max", 0))
+        backoff_ms = int(options.get("retry_backoff_ms", 100))
+        attempt = 0
+        last_err: Optional[str] = None
+        while True:
+            attempt += 1
+            try:
+                if bool(options.get("simulate_fail", False)):
+                    raise RuntimeError("simulated failure")
+                # 执行
+                if tool_type.lower() == "http_get":
+                    result = await self._do_http_get(params, options, normalized)
+                elif tool_type.lower() == "http_post":
+                    result = await self._do_http_post(params, options, normalized)
+                elif (tool_type.lower(), tool_name.lower()) in (("db_query", "template"), ("db", "query_template")):
+                    result = await self._do_db_query(params, options, normalized)
+                else:
+                    result = {"message": "tool invoked (validated)", "normalized": normalized}
+                # 缓存写入
+                if cache_ttl_ms > 0:
+                    await state.cache_put(cache_key, result, cache_ttl_ms / 1000.0)
+                # 熔断成功标记
+                await state.breaker_record(breaker_key, True, threshold=circuit_threshold, cooldown_s=circuit_cooldown_s)
+                LATENCY_SEC.labels(**labels).observe(max(0.0, time.perf_counter() - start_ts))
+                logger.info("tool_success", extra={"labels": labels, "attempt": attempt})
+                return result
+            except Exception as e:
+                last_err = _exc_text(e)
+                if attempt > retry_max:
+                    await state.breaker_record(breaker_key, False, threshold=circuit_threshold, cooldown_s=circuit_cooldown_s)
+                    ERR_TOTAL.labels(**labels, reason="exec_failure").inc()
                     LATENCY_SEC.labels(**labels).observe(max(0.0, time.perf_counter() - start_ts))
-                    logger.info("tool_success", extra={"labels": labels, "attempt": attempt})
-                    return {**result, "from_cache": False, "echo": masked_params, "options": masked_options}
-                except Exception as e:
-                    last_err = _exc_text(e)
-                    if attempt > retry_max:
-                        self._breaker_check_and_mark(("cb", key_base), ok=False, threshold=circuit_threshold, cooldown_ms=circuit_cooldown_ms)
-                        ERR_TOTAL.labels(**labels, reason="exec_failure").inc()
-                        LATENCY_SEC.labels(**labels).observe(max(0.0, time.perf_counter() - start_ts))
-                        logger.warning("tool_failure", extra={"labels": labels, "attempt": attempt, "error": last_err})
-                        raise HTTPException(status_code=502, detail=f"tool execution failed: {last_err}")
-                    RETRY_TOTAL.labels(**labels).inc()
-                    logger.info("tool_retry", extra={"labels": labels, "attempt": attempt, "error": last_err})
-                    await asyncio.sleep(max(0.0, backoff_ms * attempt / 1000.0))
-
+                    logger.warning("tool_failure", extra={"labels": labels, "attempt": attempt, "error": last_err})
+                    raise HTTPException(status_code=502, detail=f"tool execution failed: {last_err}")
+                RETRY_TOTAL.labels(**labels).inc()
+                logger.info("tool_retry", extra={"labels": labels, "attempt": attempt, "error": last_err})
+                await asyncio.sleep(max(0.0, backoff_ms * attempt / 1000.0))
+
+
+# 进程级 HTTP 连接池（生命周期结束时关闭）
+http_pool = HttpClientPool(
+    max_connections=settings.TOOLS_HTTP_MAX_CONNECTIONS,
+    keepalive_expiry=settings.TOOLS_HTTP_KEEPALIVE_EXPIRY,
+    http2=settings.TOOLS_HTTP2,
+    dns_cache_ttl=settings.TOOLS_HTTP_DNS_CACHE_TTL,
+    max_clients=settings.TOOLS_HTTP_MAX_POOLS,
+)
 
 # 单例执行器
 executor = ToolExecutor()
@@ -0,0 +1,429 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+from pydantic import BaseModel
+
+from src.app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 进程内状态表（rate/cache/breaker/singleflight）：条目数与按原因（capacity=LRU 淘汰，expired=TTL 过期）的淘汰次数
+STATE_ENTRIES = Gauge(
+    "tools_state_entries", "Entries held in the tool executor's in-process state tables", ["table"]
+)
+STATE_EVICTIONS_TOTAL = Counter(
+    "tools_state_evictions_total", "Entries evicted from the tool executor's state tables", ["table", "reason"]
+)
+# 共享状态后端（Redis）调用失败、降级为进程内状态的次数
+STATE_BACKEND_ERRORS_TOTAL = Counter(
+    "tools_state_backend_errors_total", "Shared state backend failures (fell back to in-process state)", ["backend", "op"]
+)
+
+class StateTable:
+    """Bounded in-process map with per-entry TTL and LRU eviction.
+
+    Expired entries are dropped when read and by :meth:`sweep` (run periodically from the
+    lifespan, see ``tool_executor.run_state_sweeper``); past ``max_entries`` the least recently used
+    entry is evicted, so memory stays bounded whatever the key cardinality.
+    """
+
+    def __init__(self, name: str, *, max_entries: int, ttl: float) -> None:
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._size = STATE_ENTRIES.labels(table=name)
+        self._expired = STATE_EVICTIONS_TOTAL.labels(table=name, reason="expired")
+        self._capacity = STATE_EVICTIONS_TOTAL.labels(table=name, reason="capacity")
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            self._expired.inc()
+            self._size.set(len(self._data))
+            return default
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self._capacity.inc()
+        self._size.set(len(self._data))
+
+    def pop(self, key: Any) -> None:
+        if self._data.pop(key, None) is not None:
+            self._size.set(len(self._data))
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._size.set(0)
+
+    def sweep(self) -> int:
+        """Drop every expired entry; returns how many were removed."""
+        now = time.monotonic()
+        dead = [k for k, (expires, _) in self._data.items() if expires <= now]
+        for k in dead:
+            del self._data[k]
+        if dead:
+            self._expired.inc(len(dead))
+        self._size.set(len(self._data))
+        return len(dead)
+
+
+RATE_ALGORITHMS: Tuple[str, ...] = ("token_bucket", "sliding_window", "fixed_window")
+
+
+class RateRule(BaseModel):
+    # token_bucket：按 rate 匀速补充、容量 burst；sliding_window / fixed_window：每 window_s 秒最多 limit 次
+    algorithm: str = "token_bucket"
+    rate: float
+    burst: int
+    window_s: float = 1.0
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(round(self.rate * self.window_s)))
+
+
+class StateBackend(ABC):
+    """Where the tool executor keeps rate-limit, circuit-breaker and result-cache state.
+
+    ``rate_acquire`` returns 0.0 when the call is admitted (and consumes a token/slot),
+    otherwise the seconds until one frees up; nothing is consumed on rejection except
+    by ``fixed_window``, which counts every attempt. The breaker is closed → open (``threshold`` consecutive failures)
+    → half-open after ``cooldown_s``, where a single probe call decides whether it closes
+    again or reopens.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def rate_acquire(self, key: str, rule: RateRule) -> float:
+        """0.0 when admitted, else seconds until a token/slot frees up."""
+
+    @abstractmethod
+    async def breaker_allow(self, key: str, *, cooldown_s: float) -> bool:
+        """Whether the breaker for ``key`` lets a call (or the half-open probe) through."""
+
+    @abstractmethod
+    async def breaker_record(self, key: str, ok: bool, *, threshold: int, cooldown_s: float) -> None:
+        """Record a call outcome, opening or closing the breaker."""
+
+    @abstractmethod
+    async def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """A cached result, or None when missing or expired."""
+
+    @abstractmethod
+    async def cache_put(self, key: str, value: Dict[str, Any], ttl_s: float) -> None:
+        """Cache ``value`` for ``ttl_s`` seconds."""
+
+    async def close(self) -> None:
+        return None
+
+
+class MemoryStateBackend(StateBackend):
+    """Per-process state in bounded :class:`StateTable` maps (the default)."""
+
+    name = "memory"
+
+    def __init__(self, *, max_entries: int, cache_max_entries: int, breaker_idle_ttl: float) -> None:
+        # 限流条目在桶补满/窗口结束后即可丢弃；熔断失败计数空闲一段时间后清零
+        self.rate = StateTable("rate", max_entries=max_entries, ttl=2.0)
+        self.cache = StateTable("cache", max_entries=cache_max_entries, ttl=60.0)
+        self.breaker = StateTable("breaker", max_entries=max_entries, ttl=breaker_idle_ttl)
+
+    def sweep(self) -> int:
+        return sum(t.sweep() for t in (self.rate, self.cache, self.breaker))
+
+    async def rate_acquire(self, key: str, rule: RateRule) -> float:
+        now = time.time()
+        if rule.algorithm == "token_bucket":
+            tokens, last = self.rate.get(key) or (float(rule.burst), now)
+            tokens = min(float(rule.burst), tokens + max(0.0, now - last) * rule.rate)
+            ttl = rule.burst / rule.rate + 1.0
+            if tokens >= 1.0:
+                self.rate.set(key, (tokens - 1.0, now), ttl=ttl)
+                return 0.0
+            self.rate.set(key, (tokens, now), ttl=ttl)
+            return (1.0 - tokens) / rule.rate
+        if rule.algorithm == "sliding_window":
+            log = self.rate.get(key)
+            if log is None:
+                log = deque()
+            while log and log[0] <= now - rule.window_s:
+                log.popleft()
+            self.rate.set(key, log, ttl=rule.window_s)
+            if len(log) >= rule.limit:
+                return log[0] + rule.window_s - now
+            log.append(now)
+            return 0.0
+        window = math.floor(now / rule.window_s)
+        count, win = self.rate.get(key) or (0, window)
+        if win != window:
+            count, win = 0, window
+        count += 1
+        self.rate.set(key, (count, win), ttl=rule.window_s * 2)
+        return (win + 1) * rule.window_s - now if count > rule.limit else 0.0
+
+    async def breaker_allow(self, key: str, *, cooldown_s: float) -> bool:
+        now = time.time()
+        fails, open_until, probe_until = self.breaker.get(key) or (0, 0.0, 0.0)
+        if open_until == 0.0:
+            return True
+        if now < open_until or now < probe_until:
+            return False
+        # 半开：放行一个探测请求；探测超过一个冷却期仍未回报时再放行下一个
+        self.breaker.set(key, (fails, open_until, now + cooldown_s), ttl=cooldown_s + self.breaker.ttl)
+        return True
+
+    async def breaker_record(self, key: str, ok: bool, *, threshold: int, cooldown_s: float) -> None:
+        now = time.time()
+        fails, open_until, _ = self.breaker.get(key) or (0, 0.0, 0.0)
+        if ok:
+            # 打开期间迟到的成功不关闭熔断
+            if now >= open_until:
+                self.breaker.pop(key)
+            return
+        fails += 1
+        if open_until > 0.0 or fails >= max(1, threshold):
+            self.breaker.set(key, (fails, now + cooldown_s, 0.0), ttl=cooldown_s + self.breaker.ttl)
+        else:
+            self.breaker.set(key, (fails, 0.0, 0.0))
+
+    async def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.cache.get(key)
+
+    async def cache_put(self, key: str, value: Dict[str, Any], ttl_s: float) -> None:
+        self.cache.set(key, value, ttl=ttl_s)
+
+
+# 限流脚本均使用 Redis 服务器时间（避免各 Pod 时钟偏差），返回需等待的毫秒数（0 表示放行）
+# 令牌桶：HASH 保存剩余令牌与上次补充时间
+TOKEN_BUCKET_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(ARGV[1]) / 1000
+local burst = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate) + 1000)
+return wait
+"""
+
+# 滑动窗口日志：窗口内的请求时间戳（毫秒）存于 ZSET
+SLIDING_WINDOW_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+  local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+  return math.max(1, tonumber(oldest[2]) + window - now)
+end
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], window)
+return 0
+"""
+
+# 固定窗口：首个请求开启窗口，窗口内计数（含被拒绝的请求）
+FIXED_WINDOW_LUA = """
+local n = redis.call('INCR', KEYS[1])
+if n == 1 then redis.call('PEXPIRE', KEYS[1], ARGV[2]) end
+if n > tonumber(ARGV[1]) then return math.max(1, redis.call('PTTL', KEYS[1])) end
+return 0
+"""
+
+# 返回 1=关闭放行，2=半开探测放行，0=拒绝
+BREAKER_ALLOW_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until') or '0')
+if open_until == 0 then return 1 end
+if now < open_until then return 0 end
+local probe_until = tonumber(redis.call('HGET', KEYS[1], 'probe_until') or '0')
+if now < probe_until then return 0 end
+redis.call('HSET', KEYS[1], 'probe_until', now + tonumber(ARGV[1]))
+return 2
+"""
+
+BREAKER_RECORD_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until') or '0')
+if ARGV[1] == '1' then
+  if now >= open_until then redis.call('DEL', KEYS[1]) end
+  return 0
+end
+local cooldown = tonumber(ARGV[3])
+local fails = redis.call('HINCRBY', KEYS[1], 'fails', 1)
+local ttl = tonumber(ARGV[4])
+if open_until > 0 or fails >= tonumber(ARGV[2]) then
+  redis.call('HSET', KEYS[1], 'open_until', now + cooldown, 'probe_until', 0)
+  ttl = ttl + cooldown
+end
+redis.call('PEXPIRE', KEYS[1], ttl)
+return fails
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """State shared by every worker and pod through Redis.
+
+    Rate limiting and breaker transitions run as Lua scripts so each decision is atomic;
+    cached results are stored as JSON with a PX expiry. When Redis fails, the call falls
+    back to ``fallback`` (per-process state) instead of failing the tool call.
+    """
+
+    name = "redis"
+
+    def __init__(self, *, prefix: str, fallback: StateBackend, idle_ttl: float, client: Any = None) -> None:
+        self.prefix = prefix
+        self.fallback = fallback
+        self.idle_ttl_ms = int(max(1.0, idle_ttl) * 1000)
+        self._client = client
+        self._scripts: Dict[str, Any] = {}
+
+    def _redis(self) -> Any:
+        if self._client is None:
+            from src.app.clients.redis import get_client
+
+            self._client = get_client()
+        return self._client
+
+    def _script(self, source: str) -> Any:
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._redis().register_script(source)
+            self._scripts[source] = script
+        return script
+
+    def _degraded(self, op: str, e: Exception) -> None:
+        STATE_BACKEND_ERRORS_TOTAL.labels(backend=self.name, op=op).inc()
+        logger.warning("tools_state_backend_failed backend=%s op=%s error=%s: %s", self.name, op, type(e).__name__, e)
+
+    async def rate_acquire(self, key: str, rule: RateRule) -> float:
+        window_ms = max(1, int(rule.window_s * 1000))
+        if rule.algorithm == "token_bucket":
+            source, args = TOKEN_BUCKET_LUA, [rule.rate, rule.burst]
+        elif rule.algorithm == "sliding_window":
+            source, args = SLIDING_WINDOW_LUA, [rule.limit, window_ms, uuid.uuid4().hex]
+        else:
+            source, args = FIXED_WINDOW_LUA, [rule.limit, window_ms]
+        try:
+            wait_ms = await self._script(source)(keys=[self.prefix + key], args=args)
+            return int(wait_ms) / 1000.0
+        except Exception as e:
+            self._degraded("rate", e)
+            return await self.fallback.rate_acquire(key, rule)
+
+    async def breaker_allow(self, key: str, *, cooldown_s: float) -> bool:
+        try:
+            return int(await self._script(BREAKER_ALLOW_LUA)(keys=[self.prefix + key], args=[int(cooldown_s * 1000)])) > 0
+        except Exception as e:
+            self._degraded("breaker", e)
+            return await self.fallback.breaker_allow(key, cooldown_s=cooldown_s)
+
+    async def breaker_record(self, key: str, ok: bool, *, threshold: int, cooldown_s: float) -> None:
+        try:
+            await self._script(BREAKER_RECORD_LUA)(
+                keys=[self.prefix + key],
+                args=["1" if ok else "0", max(1, threshold), int(cooldown_s * 1000), self.idle_ttl_ms],
+            )
+        except Exception as e:
+            self._degraded("breaker", e)
+            await self.fallback.breaker_record(key, ok, threshold=threshold, cooldown_s=cooldown_s)
+
+    async def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await self._redis().get(self.prefix + key)
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            self._degraded("cache", e)
+            return await self.fallback.cache_get(key)
+
+    async def cache_put(self, key: str, value: Dict[str, Any], ttl_s: float) -> None:
+        try:
+            payload = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+            await self._redis().set(self.prefix + key, payload, px=max(1, int(ttl_s * 1000)))
+        except Exception as e:
+            self._degraded("cache", e)
+            await self.fallback.cache_put(key, value, ttl_s)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            try:
+                await self._client.aclose()
+            except Exception:
+                pass
+            self._client = None
+            self._scripts.clear()
+
+
+memory = MemoryStateBackend(
+    max_entries=settings.TOOLS_STATE_MAX_ENTRIES,
+    cache_max_entries=settings.TOOLS_CACHE_MAX_ENTRIES,
+    breaker_idle_ttl=settings.TOOLS_BREAKER_IDLE_TTL,
+)
+_backends: Dict[str, StateBackend] = {"memory": memory}
+BACKEND_NAMES: Tuple[str, ...] = ("memory", "redis")
+
+
+def get_backend(name: Optional[str] = None) -> StateBackend:
+    """Backend for ``options.state_backend`` (falls back to ``TOOLS_STATE_BACKEND``)."""
+    key = str(name or settings.TOOLS_STATE_BACKEND or "memory").lower()
+    backend = _backends.get(key)
+    if backend is None:
+        if key != "redis":
+            raise ValueError(f"unknown state backend: {key}")
+        # Redis 故障时回落到同一份进程内状态
+        backend = _backends[key] = RedisStateBackend(
+            prefix=settings.TOOLS_REDIS_PREFIX, fallback=memory, idle_ttl=settings.TOOLS_BREAKER_IDLE_TTL
+        )
+    return backend
+
+
+def set_backend(name: str, backend: Optional[StateBackend]) -> None:
+    """Install (or with ``None`` drop) the backend used for ``name``; mainly for tests."""
+    if backend is None:
+        _backends.pop(name, None)
+    else:
+        _backends[name] = backend
+
+
+async def close() -> None:
+    """Release shared backends (called from the FastAPI lifespan)."""
+    for name, backend in list(_backends.items()):
+        if name != "memory":
+            await backend.close()
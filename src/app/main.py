@@ -21,6 +21,9 @@ from src.app.config import settings
 from src.app.clients import ollama
 from src.app.clients import qdrant as qcli
 from src.app.core.logging_config import setup_logging
+from src.app.core import admin_store, tool_state
+from src.app.core.eval_runner import runner as eval_runner
+from src.app.core.tool_executor import http_pool as tool_http_pool, run_state_sweeper
 from src.app.core.tool_executor import REQ_TOTAL, ERR_TOTAL, RL_TOTAL, CB_OPEN_TOTAL, CACHE_HIT_TOTAL, RETRY_TOTAL, LATENCY_SEC
 
 setup_logging()
@@ -78,12 +81,12 @@ async def lifespan(app: FastAPI):
         # 预热 RAG 检索链路（embedding + Qdrant search），非强制
         try:
             coll = settings.QDRANT_COLLECTION
-            if qcli.collection_exists(coll):
+            if await qcli.collection_exists(coll):
                 t_rag = time.perf_counter()
                 vecs = await ollama.embeddings(["warmup"], model=(getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL), timeout=30)
                 dim = len(vecs[0]) if vecs and vecs[0] else 0
                 try:
-                    _ = qcli.search_vectors(coll, query=vecs[0], top_k=1, filters=None)
+                    _ = await qcli.search_vectors(coll, query=vecs[0], top_k=1, filters=None)
                     dt_rag = (time.perf_counter() - t_rag) * 1000.0
                     logger.info("warmup_rag_ok latency_ms=%.2f dim=%s collection=%s", dt_rag, dim, coll)
                 except Exception as e:
@@ -95,9 +98,29 @@ async def lifespan(app: FastAPI):
             logger.warning("warmup_rag_failed error=%s: %s", type(e).__name__, e)
 
     asyncio.create_task(_task())
+    # 定期清理工具执行器状态表中的过期条目
+    state_sweeper = asyncio.create_task(run_state_sweeper(settings.TOOLS_STATE_SWEEP_INTERVAL))
+
+    # 已失联 worker 的评测运行无法续跑，标记为 failed；其他 worker 仍在心跳的运行不受影响
+    try:
+        await admin_store.get_store().mark_interrupted(stale_after=3 * settings.ADMIN_RUN_HEARTBEAT_INTERVAL)
+    except Exception as e:
+        logger.warning("admin_store_unavailable error=%s: %s", type(e).__name__, e)
+    run_heartbeat = asyncio.create_task(admin_store.run_heartbeat(settings.ADMIN_RUN_HEARTBEAT_INTERVAL))
 
     yield
 
+    # 取消仍在执行的评测运行（记录为 cancelled）
+    await eval_runner.shutdown()
+    run_heartbeat.cancel()
+    await admin_store.close()
+    state_sweeper.cancel()
+    # 关闭工具网关的 HTTP 连接池与共享状态后端
+    await tool_http_pool.close()
+    await tool_state.close()
+    # 关闭进程级 Qdrant 客户端连接池
+    await qcli.close()
+
 app = FastAPI(title="AI Support System API", lifespan=lifespan)
 
 # Middlewares
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
-import json
+import asyncio
 import uuid
 from datetime import datetime
-from pathlib import Path
 from typing import Dict, List, Optional, Any
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel, Field
 
+from src.app.clients import ollama
+from src.app.config import settings
+from src.app.core import admin_store
+from src.app.core.eval_runner import runner
+from src.app.core.rag_pipeline import RagPipeline, build_ask_prompt, pack_ask_contexts
+
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 
 
@@ -47,88 +52,50 @@ class EvalImportPayload(BaseModel):
 
 class EvalRunCreate(BaseModel):
     config_version: Optional[str] = None
+    # 运行配置（默认与 /api/v1/ask 一致）
+    collection: Optional[str] = None
+    top_k: Optional[int] = None
+    model: Optional[str] = None
+    options: Optional[Dict[str, Any]] = None
+    concurrency: Optional[int] = None  # 单次运行并发，默认 EVAL_RUN_CONCURRENCY，不超过 EVAL_RUNNER_WORKERS
 
 
 class EvalRun(BaseModel):
     id: str
     eval_id: str
     created_at: datetime
-    status: str = Field("completed", description="queued|running|completed|failed")
-    # 最小占位指标，后续接入真实评测后替换
+    status: str = Field("completed", description="queued|running|completed|failed|cancelled")
+    # 准确率、各阶段延迟 p50/p95/p99（毫秒）、吞吐等；运行中持续更新
     metrics: Dict[str, Any] = Field(default_factory=dict)
 
 
-# ---------- In-memory Stores + JSON 持久化 ----------
-DATA_DIR = Path("data")
-DATA_FILE = DATA_DIR / "admin_evals.json"
-
-EVALS: Dict[str, Eval] = {}
-EVAL_ITEMS: Dict[str, List[EvalItem]] = {}
-EVAL_RUNS: Dict[str, EvalRun] = {}
-
-
-def _serialize_dt(dt: datetime) -> str:
-    return dt.isoformat()
-
-
-def _deserialize_dt(s: str) -> datetime:
-    return datetime.fromisoformat(s)
-
-
-def _save_store() -> None:
-    try:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        payload = {
-            "evals": {k: v.model_dump() | {"created_at": _serialize_dt(v.created_at), "updated_at": _serialize_dt(v.updated_at)} for k, v in EVALS.items()},
-            "eval_items": {k: [i.model_dump() for i in lst] for k, lst in EVAL_ITEMS.items()},
-            "eval_runs": {k: r.model_dump() | {"created_at": _serialize_dt(r.created_at)} for k, r in EVAL_RUNS.items()},
-        }
-        DATA_FILE.write_text(json.dumps(payload, ensure_ascii=False))
-    except Exception:
-        # 持久化失败不阻断主流程（可在日志中记录，后续接入统一日志）
-        pass
-
-
-def _load_store() -> None:
-    if not DATA_FILE.exists():
-        return
-    try:
-        data = json.loads(DATA_FILE.read_text())
-        EVALS.clear()
-        EVAL_ITEMS.clear()
-        EVAL_RUNS.clear()
-        for k, v in (data.get("evals") or {}).items():
-            EVALS[k] = Eval(
-                id=v["id"],
-                name=v["name"],
-                description=v.get("description"),
-                created_at=_deserialize_dt(v["created_at"]),
-                updated_at=_deserialize_dt(v["updated_at"]),
-                items_count=int(v.get("items_count", 0)),
-            )
-        for k, items in (data.get("eval_items") or {}).items():
-            EVAL_ITEMS[k] = [EvalItem(**it) for it in items]
-        for k, v in (data.get("eval_runs") or {}).items():
-            EVAL_RUNS[k] = EvalRun(
-                id=v["id"],
-                eval_id=v["eval_id"],
-                created_at=_deserialize_dt(v["created_at"]),
-                status=v.get("status", "completed"),
-                metrics=v.get("metrics", {}),
-            )
-    except Exception:
-        # 读取失败时忽略（可在日志中记录）
-        EVALS.clear(); EVAL_ITEMS.clear(); EVAL_RUNS.clear()
-
-
-# 模块加载时尝试恢复
-_load_store()
+# ---------- 存储（SQLite WAL / Postgres，按行写入） ----------
+def _store() -> admin_store.AdminStore:
+    return admin_store.get_store()
+
+
+def _page(response: Response, total: int) -> None:
+    # 分页：列表仍为数组，总数放在响应头
+    response.headers["X-Total-Count"] = str(total)
+
+
+async def _get_eval_or_404(eval_id: str) -> Eval:
+    row = await _store().get_eval(eval_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Eval not found")
+    return Eval(**row)
 
 
 # ---------- Eval CRUD ----------
 @router.get("/evals", response_model=List[Eval])
-async def list_evals() -> List[Eval]:
-    return list(EVALS.values())
+async def list_evals(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+) -> List[Eval]:
+    rows, total = await _store().list_evals(limit=limit, offset=offset)
+    _page(response, total)
+    return [Eval(**r) for r in rows]
 
 
 @router.post("/evals", response_model=Eval)
@@ -143,25 +110,18 @@ async def create_eval(payload: EvalCreate) -> Eval:
         updated_at=now,
         items_count=0,
     )
-    EVALS[eid] = rec
-    EVAL_ITEMS[eid] = []
-    _save_store()
+    await _store().put_eval(rec.model_dump(mode="json"))
     return rec
 
 
 @router.get("/evals/{eval_id}", response_model=Eval)
 async def get_eval(eval_id: str) -> Eval:
-    rec = EVALS.get(eval_id)
-    if not rec:
-        raise HTTPException(status_code=404, detail="Eval not found")
-    return rec
+    return await _get_eval_or_404(eval_id)
 
 
 @router.put("/evals/{eval_id}", response_model=Eval)
 async def update_eval(eval_id: str, payload: EvalUpdate) -> Eval:
-    rec = EVALS.get(eval_id)
-    if not rec:
-        raise HTTPException(status_code=404, detail="Eval not found")
+    rec = await _get_eval_or_404(eval_id)
     update_data = rec.model_dump()
     if payload.name is not None:
         update_data["name"] = payload.name
@@ -169,71 +129,121 @@ async def update_eval(eval_id: str, payload: EvalUpdate) -> Eval:
         update_data["description"] = payload.description
     update_data["updated_at"] = datetime.utcnow()
     updated = Eval(**update_data)
-    EVALS[eval_id] = updated
-    _save_store()
+    await _store().put_eval(updated.model_dump(mode="json"))
     return updated
 
 
 @router.delete("/evals/{eval_id}")
 async def delete_eval(eval_id: str) -> Dict[str, str]:
-    if eval_id not in EVALS:
-        raise HTTPException(status_code=404, detail="Eval not found")
-    EVALS.pop(eval_id, None)
-    EVAL_ITEMS.pop(eval_id, None)
-    # 同时清理关联的 runs
-    to_delete = [rid for rid, r in EVAL_RUNS.items() if r.eval_id == eval_id]
-    for rid in to_delete:
-        EVAL_RUNS.pop(rid, None)
-    _save_store()
+    await _get_eval_or_404(eval_id)
+    # 先取消本进程中该评测仍在执行的运行并等待其落盘，避免删除后又被进度更新写回
+    runs, _ = await _store().list_runs(eval_id=eval_id)
+    live = [r["id"] for r in runs if runner.cancel(r["id"])]
+    await asyncio.gather(*(runner.wait(rid) for rid in live))
+    # 同时清理关联的 items 与 runs
+    await _store().delete_eval(eval_id)
     return {"status": "ok"}
 
 
 # ---------- Eval Import ----------
 @router.post("/evals/{eval_id}/import", response_model=Eval)
 async def import_eval_items(eval_id: str, payload: EvalImportPayload) -> Eval:
-    rec = EVALS.get(eval_id)
-    if not rec:
-        raise HTTPException(status_code=404, detail="Eval not found")
-    EVAL_ITEMS.setdefault(eval_id, [])
-    EVAL_ITEMS[eval_id].extend(payload.items)
-    rec.items_count = len(EVAL_ITEMS[eval_id])
-    rec.updated_at = datetime.utcnow()
-    EVALS[eval_id] = rec
-    _save_store()
-    return rec
+    await _get_eval_or_404(eval_id)
+    # 只追加新条目，不重写已有数据
+    await _store().add_items(
+        eval_id,
+        [it.model_dump() for it in payload.items],
+        updated_at=datetime.utcnow().isoformat(),
+    )
+    return await _get_eval_or_404(eval_id)
 
 
 # ---------- Eval Runs ----------
+def _ask_executor(cfg: EvalRunCreate):
+    """Run one eval item through /api/v1/ask's retrieval, packing, prompt and generation
+    defaults, returning (answer, stage timings in ms).
+
+    Unlike ``/ask`` it does not ensure the generation model and makes a single
+    ``ollama.generate`` call without retry/backoff, so a failed generation counts as an
+    item error instead of being retried.
+    """
+    coll = cfg.collection or settings.QDRANT_COLLECTION
+    top_k = cfg.top_k or settings.DEFAULT_TOP_K
+    model = cfg.model or settings.OLLAMA_MODEL
+    opts: Dict[str, Any] = dict(cfg.options or {})
+    opts.setdefault("num_predict", settings.DEFAULT_NUM_PREDICT)
+    # 与 /api/v1/ask 相同的保守生成参数
+    opts.setdefault("temperature", 0.4)
+    opts.setdefault("top_p", 0.9)
+    opts.setdefault("repeat_penalty", 1.05)
+
+    async def execute(item: EvalItem):
+        pipe = RagPipeline(collection=coll, top_k=top_k, pack=pack_ask_contexts, build_prompt=build_ask_prompt)
+        rc = await pipe.run(item.query)
+        if not rc.exists or not rc.contexts:
+            return "未在文档中找到相关信息", pipe.timings.as_dict()
+        resp = await pipe.timings.timed("generate", ollama.generate(rc.prompt, model=model, **opts))
+        return resp.get("response", ""), pipe.timings.as_dict()
+
+    return execute
+
+
+def _run_progress(run: EvalRun):
+    async def on_progress(status: str, metrics: Dict[str, Any]) -> None:
+        run.status = status
+        run.metrics = metrics
+        # 只改写该运行这一行
+        await _store().put_run(run.model_dump(mode="json"))
+
+    return on_progress
+
+
 @router.post("/evals/{eval_id}/runs", response_model=EvalRun)
 async def create_eval_run(eval_id: str, payload: EvalRunCreate) -> EvalRun:
-    if eval_id not in EVALS:
-        raise HTTPException(status_code=404, detail="Eval not found")
+    """Queue a background run of the eval's items; poll ``/eval-runs/{id}`` for progress."""
+    await _get_eval_or_404(eval_id)
     run_id = str(uuid.uuid4())
     now = datetime.utcnow()
-    items = EVAL_ITEMS.get(eval_id, [])
-    # 占位：立即完成并给出基础统计。后续接入真实执行与评分。
-    metrics = {
+    items = [EvalItem(**it) for it in await _store().list_items(eval_id)]
+    base = {
         "config_version": payload.config_version or "dev",
+        "collection": payload.collection or settings.QDRANT_COLLECTION,
+        "model": payload.model or settings.OLLAMA_MODEL,
+        "top_k": payload.top_k or settings.DEFAULT_TOP_K,
         "total_items": len(items),
-        "passed": len(items),  # 占位为全通过
-        "failed": 0,
-        "accuracy": 1.0 if items else None,
     }
-    run = EvalRun(id=run_id, eval_id=eval_id, created_at=now, status="completed", metrics=metrics)
-    EVAL_RUNS[run_id] = run
-    _save_store()
+    run = EvalRun(id=run_id, eval_id=eval_id, created_at=now, status="queued", metrics=base)
+    await _store().put_run(run.model_dump(mode="json"))
+    runner.start(run_id, items, _ask_executor(payload), _run_progress(run.model_copy()), concurrency=payload.concurrency, base_metrics=base)
     return run
 
 
+@router.post("/eval-runs/{run_id}/cancel", response_model=EvalRun)
+async def cancel_eval_run(run_id: str) -> EvalRun:
+    run = await get_eval_run(run_id)
+    if not runner.cancel(run_id):
+        raise HTTPException(status_code=409, detail=f"Eval run is not running (status={run.status})")
+    # 等待运行协程记录 cancelled 状态与已完成部分的指标
+    await runner.wait(run_id)
+    return await get_eval_run(run_id)
+
+
 @router.get("/eval-runs", response_model=List[EvalRun])
-async def list_eval_runs() -> List[EvalRun]:
+async def list_eval_runs(
+    response: Response,
+    eval_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+) -> List[EvalRun]:
     # 按创建时间倒序
-    return sorted(EVAL_RUNS.values(), key=lambda r: r.created_at, reverse=True)
+    rows, total = await _store().list_runs(eval_id=eval_id, limit=limit, offset=offset)
+    _page(response, total)
+    return [EvalRun(**r) for r in rows]
 
 
 @router.get("/eval-runs/{run_id}", response_model=EvalRun)
 async def get_eval_run(run_id: str) -> EvalRun:
-    run = EVAL_RUNS.get(run_id)
-    if not run:
+    row = await _store().get_run(run_id)
+    if not row:
         raise HTTPException(status_code=404, detail="Eval run not found")
-    return run
+    return EvalRun(**row)
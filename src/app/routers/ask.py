@@ -5,16 +5,19 @@ import time
 import asyncio
 import logging
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from src.app.clients import ollama
-from src.app.clients import qdrant as qcli
 from src.app.config import settings
+from src.app.core import extractive, generation_stats, hedging
+from src.app.core import semantic_cache
+from src.app.core.context_packer import estimate_tokens
+from src.app.core.deadline import Deadline, DeadlineExceeded
+from src.app.core.rag_pipeline import DimensionMismatch, EmbeddingError, RagPipeline, build_ask_prompt, pack_ask_contexts
+from src.app.core.streaming import DisconnectWatcher, SSEStream, heartbeat_while, watch_generation
 from src.app.core.metrics import (
-    EMBED_SECONDS,
-    RAG_RETRIEVAL_SECONDS,
     LLM_GENERATE_SECONDS,
     RAG_MATCHES_TOTAL,
 )
@@ -30,42 +33,8 @@ class AskRequest(BaseModel):
     model: Optional[str] = None
     options: Optional[Dict[str, Any]] = None
     filters: Optional[Dict[str, Any]] = None
-
-
-def _build_prompt(query: str, contexts: List[str]) -> str:
-    if not contexts:
-        return f"问题：{query}\n请用不超过两句话作答。"
-    ctx = "\n\n".join(c for c in contexts)
-    return (
-        f"上下文：{ctx}\n"
-        f"问题：{query}\n"
-        "请仅依据上下文，用不超过两句话简洁作答。"
-    )
-
-
-def _prepare_contexts(scored: list, max_docs: int = 1, per_doc_max_chars: int = 180, total_max_chars: int = 480):
-    seen = set()
-    contexts: List[str] = []
-    sources: List[Dict[str, Any]] = []
-    total_chars = 0
-    for s in scored:
-        pl = getattr(s, "payload", None) or {}
-        txt = pl.get("text") if isinstance(pl, dict) else None
-        if not txt:
-            continue
-        key = str(txt)
-        if key in seen:
-            continue
-        seen.add(key)
-        snippet = key[:per_doc_max_chars]
-        if total_chars + len(snippet) > total_max_chars:
-            break
-        contexts.append(snippet)
-        total_chars += len(snippet)
-        sources.append({"id": s.id, "score": s.score, "payload": pl})
-        if len(contexts) >= max_docs:
-            break
-    return contexts, sources
+    # "extractive"：top-1 高分命中且 payload 含答案字段时直接返回，不调用 LLM（仅 /ask）
+    answer_mode: Optional[str] = None
 
 
 class PreflightRequest(BaseModel):
@@ -76,7 +45,7 @@ class PreflightRequest(BaseModel):
 
 
 @router.post("/rag/preflight")
-async def rag_preflight(req: PreflightRequest, request: Request) -> Dict[str, Any]:
+async def rag_preflight(req: PreflightRequest, request: Request, response: Response) -> Dict[str, Any]:
     """Embedding + retrieval only; return stats for UI tips.
 
     Response fields:
@@ -91,83 +60,53 @@ async def rag_preflight(req: PreflightRequest, request: Request) -> Dict[str, An
     request_id = getattr(request.state, "request_id", "")
     coll = req.collection or settings.QDRANT_COLLECTION
     top_k = req.top_k or settings.DEFAULT_TOP_K
+    dl = Deadline.from_request(request, endpoint="preflight")
+    pipe = RagPipeline(collection=coll, top_k=top_k, filters=req.filters, deadline=dl, pack=pack_ask_contexts, build_prompt=build_ask_prompt)
+
+    def _result(ok: bool, *, error: Optional[str] = None, scored: Optional[list] = None, contexts: Optional[List[str]] = None) -> Dict[str, Any]:
+        scores = [getattr(s, "score", None) for s in (scored or []) if getattr(s, "score", None) is not None]
+        out: Dict[str, Any] = {"ok": ok}
+        if error is not None:
+            out["error"] = error
+        out.update({
+            "contexts_count": len(contexts or []),
+            "ctx_total_len": sum(len(c) for c in (contexts or [])),
+            "max_score": max(scores) if scores else None,
+            "avg_score": (sum(scores) / len(scores)) if scores else None,
+            "collection": coll,
+            "meta": {"tenant": tenant, "request_id": request_id, "deadline": dl.meta(), "timings": pipe.timings.as_dict()},
+        })
+        response.headers["Server-Timing"] = pipe.timings.header()
+        return out
 
-    # 1) embeddings（软失败：不抛 500，返回 ok=false）
+    # 1) embeddings 与 collection check 并发（软失败：不抛 500，返回 ok=false）
     try:
-        emb_model = (getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL)
-        qvecs = await ollama.embeddings([req.query], model=emb_model)
+        qvec, coll_meta = await pipe.embed_and_describe(req.query)
+    except EmbeddingError as e:
+        return _result(False, error=("preflight embed returned empty vector" if str(e) == "empty_embedding" else f"preflight {e}"))
     except Exception as e:
-        return {
-            "ok": False,
-            "error": f"preflight embed failed: {type(e).__name__}: {e}",
-            "contexts_count": 0,
-            "ctx_total_len": 0,
-            "max_score": None,
-            "avg_score": None,
-            "collection": coll,
-            "meta": {"tenant": tenant, "request_id": request_id},
-        }
-    if not qvecs or not qvecs[0]:
-        return {
-            "ok": False,
-            "error": "preflight embed returned empty vector",
-            "contexts_count": 0,
-            "ctx_total_len": 0,
-            "max_score": None,
-            "avg_score": None,
-            "collection": coll,
-            "meta": {"tenant": tenant, "request_id": request_id},
-        }
+        return _result(False, error=f"preflight embed failed: {type(e).__name__}: {e}")
 
     # 2) collection check
-    if not qcli.collection_exists(coll):
-        return {
-            "ok": True,
-            "contexts_count": 0,
-            "ctx_total_len": 0,
-            "max_score": None,
-            "avg_score": None,
-            "collection": coll,
-            "meta": {"tenant": tenant, "request_id": request_id},
-        }
+    if not coll_meta.exists:
+        return _result(True)
 
     # 3) retrieval（软失败：不抛 500，返回 ok=false）
     try:
-        scored = qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
+        scored = await pipe.retrieve(qvec)
     except Exception as e:
-        return {
-            "ok": False,
-            "error": f"preflight retrieval failed: {type(e).__name__}: {e}",
-            "contexts_count": 0,
-            "ctx_total_len": 0,
-            "max_score": None,
-            "avg_score": None,
-            "collection": coll,
-            "meta": {"tenant": tenant, "request_id": request_id},
-        }
+        return _result(False, error=f"preflight retrieval failed: {type(e).__name__}: {e}")
 
-    contexts, sources = _prepare_contexts(scored)
-    ctx_total_len = sum(len(c) for c in contexts)
-    scores = [getattr(s, "score", None) for s in scored if getattr(s, "score", None) is not None]
-    max_score = max(scores) if scores else None
-    avg_score = (sum(scores) / len(scores)) if scores else None
-
-    return {
-        "ok": True,
-        "contexts_count": len(contexts),
-        "ctx_total_len": ctx_total_len,
-        "max_score": max_score,
-        "avg_score": avg_score,
-        "collection": coll,
-        "meta": {"tenant": tenant, "request_id": request_id},
-        "sources": sources,
-    }
+    contexts, _ = pipe.pack(scored)
+    return _result(True, scored=scored, contexts=contexts)
 
 
 @router.post("/ask")
-async def ask(req: AskRequest, request: Request) -> Dict[str, Any]:
+async def ask(req: AskRequest, request: Request, response: Response) -> Dict[str, Any]:
     tenant = getattr(request.state, "tenant", "_anon_")
     request_id = getattr(request.state, "request_id", "")
+    # 端到端预算：各阶段超时与重试退避均裁剪到剩余预算内
+    dl = Deadline.from_request(request, endpoint="ask")
 
     # Plain LLM path
     if not req.use_rag:
@@ -179,111 +118,126 @@ async def ask(req: AskRequest, request: Request) -> Dict[str, Any]:
         opts.setdefault("top_p", 0.9)
         opts.setdefault("repeat_penalty", 1.05)
         model_name = (req.model or settings.OLLAMA_MODEL)
-        # 确保模型已存在
-        await ollama.ensure_model(model_name)
         # 指数退避重试生成
         t0 = time.monotonic()
         resp: Dict[str, Any] = {}
         gen_error: Optional[str] = None
-        max_attempts = 6
-        delay = 0.5
-        for attempt in range(1, max_attempts + 1):
-            try:
-                resp = await ollama.generate(
-                    req.query,
-                    model=model_name,
-                    **opts,
-                )
-                gen_error = None
-                break
-            except Exception as e:
-                gen_error = f"plain_generation_exception: {type(e).__name__}: {e}"
-                if attempt < max_attempts:
-                    await asyncio.sleep(delay)
-                    delay = min(delay * 2.0, 8.0)
-                else:
+        try:
+            # 确保模型已存在
+            await dl.run(ollama.ensure_model(model_name), "ensure_model")
+            max_attempts = 6
+            delay = 0.5
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    resp = await dl.run(
+                        ollama.generate(req.query, model=model_name, timeout=dl.clip(settings.GENERATE_TIMEOUT), **opts),
+                        "generate",
+                    )
+                    gen_error = None
                     break
-        LLM_GENERATE_SECONDS.labels(model=model_name, stream="false").observe(max(time.monotonic() - t0, 0.0))
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    gen_error = f"plain_generation_exception: {type(e).__name__}: {e}"
+                    if attempt < max_attempts:
+                        if not await dl.backoff(delay, "generate"):
+                            break
+                        delay = min(delay * 2.0, 8.0)
+                    else:
+                        break
+        except DeadlineExceeded as e:
+            gen_error = f"deadline_exceeded: {e.stage}"
+        LLM_GENERATE_SECONDS.labels(model=model_name, stream="false", outcome=("error" if gen_error else "ok")).observe(max(time.monotonic() - t0, 0.0))
         if gen_error is not None:
             # 软失败：返回 200，携带错误信息
             return {
                 "response": "",
                 "sources": [],
-                "meta": {"tenant": tenant, "request_id": request_id, "use_rag": False, "error": gen_error},
+                "meta": {"tenant": tenant, "request_id": request_id, "use_rag": False, "error": gen_error, "deadline": dl.meta()},
             }
+        gen_stats = generation_stats.parse(resp)
+        generation_stats.observe(gen_stats, model=model_name, endpoint="ask")
         return {
             "response": resp.get("response", ""),
             "sources": [],
-            "meta": {"tenant": tenant, "request_id": request_id, "use_rag": False},
+            "meta": {"tenant": tenant, "request_id": request_id, "use_rag": False, "deadline": dl.meta(), "generation": gen_stats},
         }
 
     # RAG path
+    t_rag = time.monotonic()
     coll = req.collection or settings.QDRANT_COLLECTION
     top_k = req.top_k or settings.DEFAULT_TOP_K
+    extractive_mode = req.answer_mode == extractive.MODE
+
+    pipe: Optional[RagPipeline] = None
+
+    def _meta(**extra: Any) -> Dict[str, Any]:
+        meta: Dict[str, Any] = {"tenant": tenant, "request_id": request_id, "use_rag": True, "collection": coll}
+        meta.update(extra)
+        meta["deadline"] = dl.meta()
+        if pipe is not None:
+            meta["timings"] = pipe.timings.as_dict()
+            response.headers["Server-Timing"] = pipe.timings.header()
+        return meta
+
+    def _respond(answer: str, sources: List[Dict[str, Any]], **extra: Any) -> Dict[str, Any]:
+        return {"response": answer, "sources": sources, "meta": _meta(**extra)}
+
+    # 共享 RAG 流水线：嵌入（专用嵌入模型，指数退避重试）与集合检查并发执行；各阶段计时
+    pipe = RagPipeline(
+        collection=coll,
+        top_k=top_k,
+        filters=req.filters,
+        deadline=dl,
+        pack=pack_ask_contexts,
+        build_prompt=build_ask_prompt,
+        embed_attempts=6,
+        ensure_embed_model=True,
+    )
+    emb_model = pipe.embed_model
+    try:
+        qvec, coll_meta = await pipe.embed_and_describe(req.query)
+    except (EmbeddingError, DeadlineExceeded) as e:
+        # 软失败返回 200
+        return _respond("未在文档中找到相关信息", [], top_k=top_k, error=(f"deadline_exceeded: {e.stage}" if isinstance(e, DeadlineExceeded) else str(e)))
+    except Exception as e:
+        return _respond("未在文档中找到相关信息", [], top_k=top_k, error=f"retrieval_failed: {e}")
 
-    # embed query (force dedicated embed model to ensure dim match and speed)
-    t_emb = time.monotonic()
-    emb_model = (getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL)
-    # 先确保嵌入模型存在
-    await ollama.ensure_model(emb_model)
-    # 指数退避重试获取嵌入；软失败返回 200
-    qvecs: List[List[float]] = []
-    emb_error: Optional[str] = None
-    max_attempts = 6
-    delay = 0.5
-    for attempt in range(1, max_attempts + 1):
-        try:
-            qvecs = await ollama.embeddings([req.query], model=emb_model)
-            if qvecs and qvecs[0]:
-                emb_error = None
-                break
-            emb_error = "empty_embedding"
-        except Exception as e:
-            emb_error = f"embed_failed: {type(e).__name__}: {e}"
-        if attempt < max_attempts:
-            await asyncio.sleep(delay)
-            delay = min(delay * 2.0, 8.0)
-        else:
-            break
-    EMBED_SECONDS.labels(model=emb_model).observe(max(time.monotonic() - t_emb, 0.0))
-    if emb_error is not None or not qvecs or not qvecs[0]:
-        return {
-            "response": "未在文档中找到相关信息",
-            "sources": [],
-            "meta": {"tenant": tenant, "request_id": request_id, "use_rag": True, "collection": coll, "top_k": top_k, "error": emb_error or "empty_embedding"},
-        }
-
-    if not qcli.collection_exists(coll):
-        # 返回无命中但不报错，便于前端处理
-        return {
-            "response": "未在文档中找到相关信息",
-            "sources": [],
-            "meta": {"tenant": tenant, "request_id": request_id, "use_rag": True, "collection": coll, "matches": 0},
-        }
+    # 语义缓存：相似问题直接复用答案，跳过检索与生成
+    gen_model = (req.model or settings.OLLAMA_MODEL)
+    cache_key = (coll, emb_model, gen_model, semantic_cache.params_hash(top_k=top_k, options=req.options, filters=req.filters))
+    if settings.SEMANTIC_CACHE_ENABLED:
+        cached = semantic_cache.cache.lookup(cache_key, qvec)
+        if cached is not None:
+            answer, similarity = cached
+            return _respond(answer["response"], answer["sources"], top_k=top_k, match=True, cache="semantic", similarity=round(similarity, 4))
+    t_answer = time.monotonic()
 
     # Retrieval (soft-fail on errors)
+    if not coll_meta.exists:
+        # 返回无命中但不报错，便于前端处理
+        return _respond("未在文档中找到相关信息", [], matches=0)
     try:
-        t_ret = time.monotonic()
-        scored = qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
-        RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
+        scored = await pipe.retrieve(qvec, coll_meta)
+    except DeadlineExceeded as e:
+        return _respond("未在文档中找到相关信息", [], top_k=top_k, error=f"deadline_exceeded: {e.stage}")
     except Exception as e:
-        return {
-            "response": "未在文档中找到相关信息",
-            "sources": [],
-            "meta": {"tenant": tenant, "request_id": request_id, "use_rag": True, "collection": coll, "top_k": top_k, "error": f"retrieval_failed: {e}"},
-        }
-
-    contexts, sources = _prepare_contexts(scored)
+        return _respond("未在文档中找到相关信息", [], top_k=top_k, error=f"retrieval_failed: {e}")
+
+    contexts, sources = pipe.pack(scored)
+    if extractive_mode:
+        # 抽取式快速路径：FAQ 类集合高分命中时直接返回 payload 答案，跳过生成
+        hit = extractive.try_answer(scored, collection=coll, endpoint="ask", distance=coll_meta.distance)
+        if hit is not None:
+            RAG_MATCHES_TOTAL.labels(collection=coll, has_match="true").inc()
+            extractive.observe_answer("ask", "extractive", time.monotonic() - t_rag)
+            return _respond(hit.answer, sources, top_k=top_k, match=True, answer_mode=extractive.MODE, extractive=hit.model_dump())
     if not contexts:
         # No usable contexts; return graceful response without LLM call
         RAG_MATCHES_TOTAL.labels(collection=coll, has_match="false").inc()
-        return {
-            "response": "未在文档中找到相关信息",
-            "sources": [],
-            "meta": {"tenant": tenant, "request_id": request_id, "use_rag": True, "collection": coll, "top_k": top_k, "match": False},
-        }
+        return _respond("未在文档中找到相关信息", [], top_k=top_k, match=False)
 
-    prompt = _build_prompt(req.query, contexts)
+    prompt = pipe.prompt(req.query, contexts)
 
     # Generation
     opts: Dict[str, Any] = dict(req.options or {})
@@ -294,59 +248,52 @@ async def ask(req: AskRequest, request: Request) -> Dict[str, Any]:
     opts.setdefault("top_p", 0.9)
     opts.setdefault("repeat_penalty", 1.05)
     # 生成阶段：确保模型并加入重试；失败软返回 200
-    gen_model = (req.model or settings.OLLAMA_MODEL)
-    await ollama.ensure_model(gen_model)
     t_gen = time.monotonic()
     resp: Dict[str, Any] = {}
     gen_error: Optional[str] = None
-    max_attempts = 6
-    delay = 0.5
-    for attempt in range(1, max_attempts + 1):
-        try:
-            resp = await ollama.generate(
-                prompt,
-                model=gen_model,
-                **opts,
-            )
-            gen_error = None
-            break
-        except Exception as e:
-            gen_error = f"rag_generation_exception: {type(e).__name__}: {e}"
-        if attempt < max_attempts:
-            await asyncio.sleep(delay)
-            delay = min(delay * 2.0, 8.0)
-        else:
-            break
-    LLM_GENERATE_SECONDS.labels(model=gen_model, stream="false").observe(max(time.monotonic() - t_gen, 0.0))
+    try:
+        await dl.run(ollama.ensure_model(gen_model), "ensure_model")
+        max_attempts = 6
+        delay = 0.5
+        for attempt in range(1, max_attempts + 1):
+            try:
+                resp = await dl.run(
+                    ollama.generate(prompt, model=gen_model, timeout=dl.clip(settings.GENERATE_TIMEOUT), **opts),
+                    "generate",
+                )
+                gen_error = None
+                break
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                gen_error = f"rag_generation_exception: {type(e).__name__}: {e}"
+            if attempt < max_attempts:
+                if not await dl.backoff(delay, "generate"):
+                    break
+                delay = min(delay * 2.0, 8.0)
+            else:
+                break
+    except DeadlineExceeded as e:
+        gen_error = f"deadline_exceeded: {e.stage}"
+    LLM_GENERATE_SECONDS.labels(model=gen_model, stream="false", outcome=("error" if gen_error else "ok")).observe(max(time.monotonic() - t_gen, 0.0))
+    pipe.timings.add("generate", time.monotonic() - t_gen)
     if gen_error is not None:
-        return {
-            "response": "未在文档中找到相关信息",
-            "sources": sources,
-            "meta": {
-                "tenant": tenant,
-                "request_id": request_id,
-                "use_rag": True,
-                "collection": coll,
-                "top_k": top_k,
-                "match": bool(scored),
-                "error": gen_error,
-            },
-        }
+        return _respond("未在文档中找到相关信息", sources, top_k=top_k, match=bool(scored), error=gen_error)
 
+    gen_stats = generation_stats.parse(resp)
+    generation_stats.observe(gen_stats, model=gen_model, endpoint="ask")
     RAG_MATCHES_TOTAL.labels(collection=coll, has_match=str(bool(scored)).lower()).inc()
+    if settings.SEMANTIC_CACHE_ENABLED and resp.get("response"):
+        semantic_cache.cache.store(
+            cache_key,
+            qvec,
+            {"response": resp.get("response", ""), "sources": sources},
+            cost=time.monotonic() - t_answer,
+        )
+    if extractive_mode:
+        extractive.observe_answer("ask", "llm", time.monotonic() - t_rag)
 
-    return {
-        "response": resp.get("response", ""),
-        "sources": sources,
-        "meta": {
-            "tenant": tenant,
-            "request_id": request_id,
-            "use_rag": True,
-            "collection": coll,
-            "top_k": top_k,
-            "match": bool(scored),
-        },
-    }
+    return _respond(resp.get("response", ""), sources, top_k=top_k, match=bool(scored), generation=gen_stats)
 
 
 @router.post("/ask/stream")
@@ -354,98 +301,22 @@ async def ask_stream(req: AskRequest, request: Request) -> StreamingResponse:
     tenant = getattr(request.state, "tenant", "_anon_")
     request_id = getattr(request.state, "request_id", "")
 
-    async def _sse_wrapper(gen):
-        # immediate handshake event to help proxies/clients flush headers
-        yield b"data: [started]\n\n"
-        try:
-            async for chunk in gen:
-                if not chunk:
-                    continue
-                if isinstance(chunk, str):
-                    chunk_b = chunk.encode("utf-8")
-                else:
-                    chunk_b = bytes(chunk)
-                yield b"data: " + chunk_b + b"\n\n"
-            yield b"data: [done]\n\n"
-        except Exception as e:
-            # emit error and close
-            msg = f"[error]: {type(e).__name__}: {e}"
-            yield ("data: " + msg + "\n\n").encode("utf-8")
-
-    async def _limit_stream(gen, *, time_limit_ms: Optional[int] = None, max_tokens_streamed: Optional[int] = None):
-        start_ts = time.perf_counter()
-        tokens = 0
-        async for chunk in gen:
-            yield chunk
-            # 以“分片”为单位近似 token 数，避免解析成本
-            tokens += 1
-            if max_tokens_streamed is not None and tokens >= max_tokens_streamed:
-                break
-            if time_limit_ms is not None:
-                elapsed_ms = (time.perf_counter() - start_ts) * 1000.0
-                if elapsed_ms >= time_limit_ms:
-                    break
-
-    async def _with_heartbeat(gen, *, time_limit_ms: Optional[int], max_tokens_streamed: Optional[int], heartbeat_ms: Optional[int]):
-        """Wrap a base async generator to inject heartbeat events when idle, and enforce limits."""
-        queue: asyncio.Queue = asyncio.Queue()
-
-        async def _pump():
-            try:
-                async for chunk in gen:
-                    await queue.put(("data", chunk))
-            except Exception as e:
-                await queue.put(("error", e))
-            finally:
-                await queue.put(("eof", None))
-
-        # start background pump
-        asyncio.create_task(_pump())
-
-        # emit started
-        yield b"data: [started]\n\n"
-
-        start_ts = time.perf_counter()
-        tokens = 0
-        while True:
-            timeout = (heartbeat_ms / 1000.0) if heartbeat_ms else None
-            try:
-                kind, payload = await asyncio.wait_for(queue.get(), timeout=timeout)
-            except asyncio.TimeoutError:
-                # heartbeat only when enabled
-                if heartbeat_ms:
-                    yield b"data: [heartbeat]\n\n"
-                # also check time limit after heartbeat
-                if time_limit_ms is not None:
-                    elapsed_ms = (time.perf_counter() - start_ts) * 1000.0
-                    if elapsed_ms >= time_limit_ms:
-                        break
-                continue
-
-            if kind == "data":
-                if payload:
-                    if isinstance(payload, str):
-                        chunk_b = payload.encode("utf-8")
-                    else:
-                        chunk_b = bytes(payload)
-                    yield b"data: " + chunk_b + b"\n\n"
-                    tokens += 1
-                    if max_tokens_streamed is not None and tokens >= max_tokens_streamed:
-                        break
-                # time limit check after data
-                if time_limit_ms is not None:
-                    elapsed_ms = (time.perf_counter() - start_ts) * 1000.0
-                    if elapsed_ms >= time_limit_ms:
-                        break
-            elif kind == "error":
-                msg = f"[error]: {type(payload).__name__}: {payload}"
-                yield ("data: " + msg + "\n\n").encode("utf-8")
-                break
-            elif kind == "eof":
-                break
-
-        # graceful end
-        yield b"data: [done]\n\n"
+    def _with_heartbeat(gen, *, time_limit_ms: Optional[int], max_tokens_streamed: Optional[int], heartbeat_ms: Optional[int], watcher: Optional[DisconnectWatcher] = None):
+        """Stream ``gen`` through the shared SSE engine: [started], coalesced data frames,
+        idle heartbeats, limits (``max_tokens_streamed`` counts upstream chunks) and [done].
+
+        The upstream stream is closed when the engine finishes for any reason, including a
+        client disconnect reported by ``watcher`` (in which case no [done] is sent).
+        """
+        return SSEStream(
+            gen,
+            watcher=watcher,
+            heartbeat_ms=heartbeat_ms,
+            time_limit_ms=time_limit_ms,
+            max_chunks=max_tokens_streamed,
+            started_frame=b"data: [started]\n\n",
+            done_frame=b"data: [done]\n\n",
+        )
 
     headers = {
         "x-request-id": request_id,
@@ -478,17 +349,8 @@ async def ask_stream(req: AskRequest, request: Request) -> StreamingResponse:
             model_name = (req.model or settings.OLLAMA_MODEL)
             # 等待模型可用，同时发心跳避免 ReadTimeout
             try:
-                if heartbeat_ms and heartbeat_ms > 0:
-                    ensure_task = asyncio.create_task(ollama.ensure_model(model_name))
-                    interval = max(heartbeat_ms / 1000.0, 0.1)
-                    while not ensure_task.done():
-                        await asyncio.sleep(interval)
-                        if not ensure_task.done():
-                            yield b"data: [heartbeat]\n\n"
-                    # propagate exceptions if any
-                    await ensure_task
-                else:
-                    await ollama.ensure_model(model_name)
+                async for hb in heartbeat_while(ollama.ensure_model(model_name), heartbeat_ms, []):
+                    yield hb
             except Exception as e:
                 # 软失败：报告错误并结束
                 msg = f"[error]: EnsureModelError: {e}"
@@ -496,19 +358,23 @@ async def ask_stream(req: AskRequest, request: Request) -> StreamingResponse:
                 yield b"data: [done]\n\n"
                 return
 
-            # 模型就绪后开始流式生成，并继续使用心跳包装器
-            gen = ollama.generate_stream(
-                req.query,
-                model=model_name,
-                **opts,
-            )
-            async for chunk in _with_heartbeat(
-                gen,
-                time_limit_ms=time_limit_ms,
-                max_tokens_streamed=max_tokens_streamed,
-                heartbeat_ms=heartbeat_ms,
-            ):
-                yield chunk
+            # 模型就绪后开始流式生成，并继续使用心跳包装器；客户端断开即中止上游
+            stats: Dict[str, Any] = {}
+            async with watch_generation(request, model=model_name, endpoint="ask_stream", stats=stats) as watcher:
+                gen = ollama.generate_stream(
+                    req.query,
+                    model=model_name,
+                    stats=stats,
+                    **opts,
+                )
+                async for chunk in _with_heartbeat(
+                    gen,
+                    time_limit_ms=time_limit_ms,
+                    max_tokens_streamed=max_tokens_streamed,
+                    heartbeat_ms=heartbeat_ms,
+                    watcher=watcher,
+                ):
+                    yield chunk
 
         return StreamingResponse(_plain_flow(), media_type="text/event-stream; charset=utf-8", headers=headers)
 
@@ -539,91 +405,62 @@ async def ask_stream(req: AskRequest, request: Request) -> StreamingResponse:
         opts.setdefault("num_ctx", 320)
         opts.setdefault("stop", ["\n\n["])
 
-        # 1) Embedding (async) with periodic heartbeats
-        # 强制使用专用嵌入模型，避免因生成模型不同导致维度不一致
-        emb_model = (getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL)
-        # 先确保嵌入模型存在
-        await ollama.ensure_model(emb_model)
-
-        async def _embed_with_retry() -> List[List[float]]:
-            max_attempts = 6
-            delay = 0.5
-            last: Optional[List[List[float]]] = None
-            for attempt in range(1, max_attempts + 1):
-                try:
-                    vecs = await ollama.embeddings([req.query], model=emb_model)
-                    if vecs and vecs[0]:
-                        return vecs
-                    last = vecs
-                except Exception:
-                    last = None
-                if attempt < max_attempts:
-                    await asyncio.sleep(delay)
-                    delay = min(delay * 2.0, 8.0)
-            return last or []
-
-        emb_task = asyncio.create_task(_embed_with_retry())
-        if heartbeat_ms and heartbeat_ms > 0:
-            interval = max(heartbeat_ms / 1000.0, 0.1)
-            while not emb_task.done():
-                await asyncio.sleep(interval)
-                if not emb_task.done():
-                    yield b"data: [heartbeat]\n\n"
-        qvecs = await emb_task
-        if not qvecs or not qvecs[0]:
+        # 1) Embedding（专用嵌入模型，确保模型存在并指数退避重试）与集合元数据并发获取，期间发心跳
+        pipe = RagPipeline(
+            collection=coll,
+            top_k=top_k,
+            filters=req.filters,
+            pack=pack_ask_contexts,
+            build_prompt=build_ask_prompt,
+            embed_attempts=6,
+            ensure_embed_model=True,
+        )
+        first: List[Any] = []
+        try:
+            async for hb in heartbeat_while(pipe.embed_and_describe(req.query), heartbeat_ms, first):
+                yield hb
+        except EmbeddingError:
             yield b"data: [error]: EmbeddingError: failed to get query embedding\n\n"
             yield b"data: [done]\n\n"
             return
+        except Exception as e:
+            msg = f"[error]: QdrantSearchError: {e}"
+            yield ("data: " + msg + "\n\n").encode("utf-8")
+            yield b"data: [done]\n\n"
+            return
+        qvec, meta = first[0]
 
-        # 2) If no collection, return a graceful message (check in thread)
-        exists = await asyncio.to_thread(qcli.collection_exists, coll)
-        if not exists:
+        # 2) If no collection, return a graceful message (metadata served from the catalog cache)
+        if not meta.exists:
             yield "data: 未在文档中找到相关信息\n\n".encode("utf-8")
             yield b"data: [done]\n\n"
             return
 
-        # Validate vector dimension to avoid Qdrant 400 errors
-        dim = len(qvecs[0])
+        # 3) Retrieval with heartbeats（先校验向量维度，避免 Qdrant 400）
+        search_result: List[Any] = []
         try:
-            info = await asyncio.to_thread(qcli.get_collection_info, coll)
-            expected = (
-                info.get("config", {}).get("params", {}).get("vectors", {}).get("size")
-                or info.get("params", {}).get("vectors", {}).get("size")
-                or info.get("params", {}).get("size")
-                or (info.get("vectors", {}) if isinstance(info.get("vectors", {}), dict) else {}).get("size")
-                or 0
-            )
-            expected = int(expected or 0)
-        except Exception:
-            expected = 0
-        if expected and expected != dim:
-            msg = f"向量维度不匹配：集合期望 {expected}，查询为 {dim}；请使用相同嵌入模型重建集合或切换到匹配的集合。"
+            async for hb in heartbeat_while(pipe.retrieve(qvec, meta), heartbeat_ms, search_result):
+                yield hb
+            scored = search_result[0]
+        except DimensionMismatch as e:
+            msg = f"向量维度不匹配：集合期望 {e.expected}，查询为 {e.got}；请使用相同嵌入模型重建集合或切换到匹配的集合。"
             yield ("data: " + msg + "\n\n").encode("utf-8")
             yield b"data: [done]\n\n"
             return
-
-        # 3) Retrieval with heartbeats (run blocking search in thread)
-        async def _search_thread():
-            return await asyncio.to_thread(qcli.search_vectors, coll, qvecs[0], top_k, req.filters)
-
-        search_task = asyncio.create_task(_search_thread())
-        if heartbeat_ms and heartbeat_ms > 0:
-            interval = max(heartbeat_ms / 1000.0, 0.1)
-            while not search_task.done():
-                await asyncio.sleep(interval)
-                if not search_task.done():
-                    yield b"data: [heartbeat]\n\n"
-        try:
-            scored = await search_task
         except Exception as e:
             msg = f"[error]: QdrantSearchError: {e}"
             yield ("data: " + msg + "\n\n").encode("utf-8")
             yield b"data: [done]\n\n"
             return
 
-        contexts, _ = _prepare_contexts(scored)
+        contexts, _ = pipe.pack(scored)
         ctx_total_len = sum(len(c) for c in contexts)
-        prompt = _build_prompt(req.query, contexts)
+        prompt = pipe.prompt(req.query, contexts)
+        try:
+            # SSE 响应头在检索前已发出，阶段耗时记录到日志
+            logger.info("rag_stream_timings %s", pipe.timings.header())
+        except Exception:
+            pass
 
         # 3.5) 检索短路：上下文缺失或过短，直接走非RAG
         if not contexts or ctx_total_len < 80:
@@ -637,105 +474,98 @@ async def ask_stream(req: AskRequest, request: Request) -> StreamingResponse:
             # 确保生成模型已拉取
             model_name = (req.model or settings.OLLAMA_MODEL)
             await ollama.ensure_model(model_name)
-            plain_gen = ollama.generate_stream(
-                req.query,
-                model=model_name,
-                **plain_opts,
-            )
-            async for chunk in _with_heartbeat(plain_gen, time_limit_ms=time_limit_ms, max_tokens_streamed=max_tokens_streamed, heartbeat_ms=heartbeat_ms):
-                yield chunk
+            stats: Dict[str, Any] = {}
+            async with watch_generation(request, model=model_name, endpoint="ask_stream", stats=stats) as watcher:
+                plain_gen = ollama.generate_stream(
+                    req.query,
+                    model=model_name,
+                    stats=stats,
+                    **plain_opts,
+                )
+                async for chunk in _with_heartbeat(plain_gen, time_limit_ms=time_limit_ms, max_tokens_streamed=max_tokens_streamed, heartbeat_ms=heartbeat_ms, watcher=watcher):
+                    yield chunk
             return
 
-        # 4) 并行竞速：RAG 与 非RAG 同时尝试，8 秒内谁先出首 token 用谁
+        # 4) 对冲生成：先发 RAG；若在 TTFT p 分位延迟内无首包且未超对冲比例上限，
+        #    再（优先在另一节点）启动更短的非 RAG 生成，谁先出首 token 用谁
         t_race_start = time.perf_counter()
         # 确保生成模型已拉取，避免冷启动/404
         model_name = (req.model or settings.OLLAMA_MODEL)
         await ollama.ensure_model(model_name)
-        rag_gen = ollama.generate_stream(
-            prompt,
-            model=model_name,
-            **opts,
-        )
+        # 两路各自记账，结束时把实际输出一路的统计并入 stats
+        stats: Dict[str, Any] = {}
+        rag_stats: Dict[str, Any] = {}
+        plain_stats: Dict[str, Any] = {}
         plain_opts: Dict[str, Any] = dict(opts)
         # 非 RAG 更短一些
         plain_opts["num_predict"] = min(plain_opts.get("num_predict", 4), 4)
-        plain_gen = ollama.generate_stream(
-            req.query,
-            model=model_name,
-            **plain_opts,
-        )
+        async with watch_generation(request, model=model_name, endpoint="ask_stream", stats=stats) as watcher:
+            rag_gen = ollama.generate_stream(
+                prompt,
+                model=model_name,
+                stats=rag_stats,
+                **opts,
+            )
 
-        t_rag = asyncio.create_task(rag_gen.__anext__())
-        t_plain = asyncio.create_task(plain_gen.__anext__())
-        done, pending = await asyncio.wait({t_rag, t_plain}, timeout=8.0, return_when=asyncio.FIRST_COMPLETED)
+            def _make_hedge():
+                exclude = [rag_stats["backend"]] if hedging.policy.prefer_other_backend and rag_stats.get("backend") else []
+                return ollama.generate_stream(
+                    req.query,
+                    model=model_name,
+                    stats=plain_stats,
+                    exclude_backends=exclude,
+                    **plain_opts,
+                )
 
-        winner = None
-        first_chunk = None
-        if not done:
-            # 都没首包，取消两路，直接走非RAG全程
-            for t in pending:
-                t.cancel()
-            try:
-                await rag_gen.aclose()
-            except Exception:
-                pass
-            try:
-                logger.info("rag_race_no_first_token elapsed_ms=%.2f fallback=plain", (time.perf_counter()-t_race_start)*1000.0)
-            except Exception:
-                pass
-            # 重新开一个更短的非RAG生成器
-            fb_opts: Dict[str, Any] = dict(plain_opts)
-            fb_gen = ollama.generate_stream(
-                req.query,
-                model=req.model or settings.OLLAMA_MODEL,
-                **fb_opts,
+            winner, live_gen, first_chunk = await hedging.hedged_first_chunk(
+                rag_gen,
+                _make_hedge,
+                endpoint="ask_stream",
+                watcher=watcher,
+                prompt_tokens={"primary": estimate_tokens(prompt), "hedge": estimate_tokens(req.query)},
+                stats={"primary": rag_stats, "hedge": plain_stats},
             )
-            async for chunk in _with_heartbeat(fb_gen, time_limit_ms=time_limit_ms, max_tokens_streamed=max_tokens_streamed, heartbeat_ms=heartbeat_ms):
-                yield chunk
-            return
 
-        # 有胜者
-        if t_rag in done:
-            winner = "rag"
-            try:
-                first_chunk = t_rag.result()
-            except Exception:
-                first_chunk = None
-        else:
-            winner = "plain"
+            if winner is None:
+                # 都没首包（或客户端已断开）：两路均已关闭
+                if watcher.disconnected.is_set():
+                    return
+                try:
+                    logger.info("rag_hedge_no_first_token elapsed_ms=%.2f fallback=plain", (time.perf_counter()-t_race_start)*1000.0)
+                except Exception:
+                    pass
+                # 重新开一个更短的非RAG生成器
+                fb_gen = ollama.generate_stream(
+                    req.query,
+                    model=model_name,
+                    stats=stats,
+                    **plain_opts,
+                )
+                async for chunk in _with_heartbeat(fb_gen, time_limit_ms=time_limit_ms, max_tokens_streamed=max_tokens_streamed, heartbeat_ms=heartbeat_ms, watcher=watcher):
+                    yield chunk
+                return
+
             try:
-                first_chunk = t_plain.result()
+                logger.info("rag_hedge_winner=%s elapsed_ms=%.2f", "rag" if winner == "primary" else "plain", (time.perf_counter()-t_race_start)*1000.0)
             except Exception:
-                first_chunk = None
-
-        try:
-            logger.info("rag_race_winner=%s elapsed_ms=%.2f", winner, (time.perf_counter()-t_race_start)*1000.0)
-        except Exception:
-            pass
-
-        # 取消败者
-        loser_task = t_plain if winner == "rag" else t_rag
-        loser_gen = plain_gen if winner == "rag" else rag_gen
-        if not loser_task.done():
-            loser_task.cancel()
-        try:
-            await loser_gen.aclose()
-        except Exception:
-            pass
+                pass
 
-        # 输出首片
-        if first_chunk is not None:
-            if isinstance(first_chunk, str):
-                first_b = first_chunk.encode("utf-8")
-            else:
-                first_b = bytes(first_chunk)
-            yield first_b
-
-        # 继续用带心跳与限制的包装器输出
-        live_gen = rag_gen if winner == "rag" else plain_gen
-        wrapped = _with_heartbeat(live_gen, time_limit_ms=time_limit_ms, max_tokens_streamed=max_tokens_streamed, heartbeat_ms=heartbeat_ms)
-        async for chunk in wrapped:
-            yield chunk
+            # 首片与后续分片一起交给流式引擎输出（统一 SSE 帧格式与限制）
+            async def _with_first(first: Any, rest: Any):
+                try:
+                    if first:
+                        yield first
+                    async for item in rest:
+                        yield item
+                finally:
+                    await rest.aclose()
+
+            wrapped = _with_heartbeat(_with_first(first_chunk, live_gen), time_limit_ms=time_limit_ms, max_tokens_streamed=max_tokens_streamed, heartbeat_ms=heartbeat_ms, watcher=watcher)
+            try:
+                async for chunk in wrapped:
+                    yield chunk
+            finally:
+                stats.update(rag_stats if winner == "primary" else plain_stats)
 
     return StreamingResponse(_rag_flow(), media_type="text/event-stream; charset=utf-8", headers=headers)
 
@@ -1,19 +1,21 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional, List
+from typing import Any, Dict, Optional, List, Tuple, Union
 import json
 import time
-import asyncio
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from pydantic import BaseModel
 
 from src.app.clients import ollama
 from src.app.clients import qdrant as qcli
 from src.app.config import settings
+from src.app.core import extractive, generation_stats, sessions
+from src.app.core import rag_eval as rag_eval_core
+from src.app.core.context_packer import pack_contexts
+from src.app.core.rag_pipeline import DimensionMismatch, EmbeddingError, RagContext, RagPipeline
+from src.app.core.streaming import SSEStream, sse_line_frames, stream_until_disconnect, watch_generation
 from src.app.core.metrics import (
-    EMBED_SECONDS,
-    RAG_RETRIEVAL_SECONDS,
     LLM_GENERATE_SECONDS,
     RAG_MATCHES_TOTAL,
 )
@@ -40,9 +42,10 @@ async def chat(req: ChatRequest) -> Dict[str, Any]:
         # 使用客户端内置的 keep_alive 与 timeout 默认值
         **opts,
     )
-    LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="false").observe(
+    LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="false", outcome="ok").observe(
         max(time.monotonic() - t0, 0.0)
     )
+    generation_stats.observe(generation_stats.parse(resp), model=(req.model or settings.OLLAMA_MODEL), endpoint="chat")
     # Ollama /api/generate returns {response: str, ...}
     return {
         "model": req.model or settings.OLLAMA_MODEL,
@@ -52,23 +55,22 @@ async def chat(req: ChatRequest) -> Dict[str, Any]:
 
 
 @router.post("/stream")
-async def chat_stream(req: ChatRequest) -> StreamingResponse:
+async def chat_stream(req: ChatRequest, request: Request) -> StreamingResponse:
     opts: Dict[str, Any] = dict(req.options or {})
     if "num_predict" not in opts:
         opts["num_predict"] = settings.DEFAULT_NUM_PREDICT
     async def gen():
-        t0 = time.monotonic()
-        try:
-            async for chunk in ollama.generate_stream(
+        # 客户端断开时中止上游生成并记录 outcome=aborted
+        stats: Dict[str, Any] = {}
+        async with watch_generation(request, model=(req.model or settings.OLLAMA_MODEL), endpoint="chat_stream", stats=stats) as watcher:
+            upstream = ollama.generate_stream(
                 req.prompt,
                 model=req.model or settings.OLLAMA_MODEL,
                 **opts,
-            ):
-                yield chunk
-        finally:
-            LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="true").observe(
-                max(time.monotonic() - t0, 0.0)
+                stats=stats,
             )
+            async for chunk in stream_until_disconnect(upstream, watcher):
+                yield chunk
     # 以 text/plain 流返回，便于在终端实时显示；若需要 SSE 可后续扩展为 text/event-stream
     headers = {
         "Cache-Control": "no-cache",
@@ -78,7 +80,7 @@ async def chat_stream(req: ChatRequest) -> StreamingResponse:
 
 
 @router.post("/stream_sse")
-async def chat_stream_sse(req: ChatRequest) -> StreamingResponse:
+async def chat_stream_sse(req: ChatRequest, request: Request) -> StreamingResponse:
     opts: Dict[str, Any] = dict(req.options or {})
     if "num_predict" not in opts:
         opts["num_predict"] = settings.DEFAULT_NUM_PREDICT
@@ -86,20 +88,19 @@ async def chat_stream_sse(req: ChatRequest) -> StreamingResponse:
     async def gen():
         # SSE 自动重连时间（毫秒）
         yield "retry: 3000\n\n"
-        t0 = time.monotonic()
-        try:
-            async for chunk in ollama.generate_stream(
+        stats: Dict[str, Any] = {}
+        async with watch_generation(request, model=(req.model or settings.OLLAMA_MODEL), endpoint="chat_stream_sse", stats=stats) as watcher:
+            upstream = ollama.generate_stream(
                 req.prompt,
                 model=req.model or settings.OLLAMA_MODEL,
                 **opts,
-            ):
-                # SSE: 每条消息以 'data: ' 前缀，空行分隔
-                for line in str(chunk).splitlines():
-                    yield f"data: {line}\n\n"
-        finally:
-            LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="true").observe(
-                max(time.monotonic() - t0, 0.0)
+                stats=stats,
             )
+            # SSE: 每条消息以 'data: ' 前缀，空行分隔；相邻小分片在引擎内合并为一帧
+            async for frame in SSEStream(upstream, frame=sse_line_frames, watcher=watcher, raise_errors=True):
+                yield frame
+        if watcher.disconnected.is_set():
+            return
         # 结束标记（可选）
         yield "data: [DONE]\n\n"
 
@@ -111,23 +112,21 @@ async def chat_stream_sse(req: ChatRequest) -> StreamingResponse:
 
 
 @router.post("/stream_raw")
-async def chat_stream_raw(req: ChatRequest) -> StreamingResponse:
+async def chat_stream_raw(req: ChatRequest, request: Request) -> StreamingResponse:
     opts: Dict[str, Any] = dict(req.options or {})
     if "num_predict" not in opts:
         opts["num_predict"] = settings.DEFAULT_NUM_PREDICT
     async def gen():
-        t0 = time.monotonic()
-        try:
-            async for line in ollama.generate_stream_raw(
+        stats: Dict[str, Any] = {}
+        async with watch_generation(request, model=(req.model or settings.OLLAMA_MODEL), endpoint="chat_stream_raw", stats=stats) as watcher:
+            upstream = ollama.generate_stream_raw(
                 req.prompt,
                 model=req.model or settings.OLLAMA_MODEL,
                 **opts,
-            ):
-                yield line
-        finally:
-            LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="true").observe(
-                max(time.monotonic() - t0, 0.0)
+                stats=stats,
             )
+            async for line in stream_until_disconnect(upstream, watcher):
+                yield line
     headers = {
         "Cache-Control": "no-cache",
         "X-Accel-Buffering": "no",
@@ -136,6 +135,99 @@ async def chat_stream_raw(req: ChatRequest) -> StreamingResponse:
     return StreamingResponse(gen(), media_type="application/x-ndjson; charset=utf-8", headers=headers)
 
 
+# -------- Sessions（复用 Ollama KV context 的多轮对话） --------
+
+class SessionMessageRequest(BaseModel):
+    prompt: str
+    model: Optional[str] = None
+    options: Optional[Dict[str, Any]] = None
+    stream: bool = False
+
+
+def _session_info(state: sessions.SessionState) -> Dict[str, Any]:
+    return {
+        "session_id": state.session_id,
+        "model": state.model,
+        "turns": state.turns,
+        "context_tokens": len(state.context),
+        "updated_at": state.updated_at,
+    }
+
+
+@router.post("/sessions/{session_id}/messages")
+async def chat_session_message(session_id: str, req: SessionMessageRequest, request: Request):
+    """One conversation turn: the session's stored ``context`` is passed back to Ollama,
+    so only the new prompt tokens are evaluated; the returned ``context`` replaces it.
+
+    A different ``model`` than the session's starts a fresh context.
+    """
+    tenant = getattr(request.state, "tenant", "_anon_")
+    model = req.model or settings.OLLAMA_MODEL
+    opts: Dict[str, Any] = dict(req.options or {})
+    opts.pop("context", None)
+    if "num_predict" not in opts:
+        opts["num_predict"] = settings.DEFAULT_NUM_PREDICT
+
+    async def _previous() -> Tuple[List[int], int]:
+        state = await sessions.store.get(tenant, session_id)
+        if state is None or state.model != model:
+            return [], 0
+        return state.context, state.turns
+
+    if not req.stream:
+        async with sessions.store.lock(tenant, session_id):
+            context, turns = await _previous()
+            if context:
+                opts["context"] = context
+            t0 = time.monotonic()
+            resp = await ollama.generate(req.prompt, model=model, **opts)
+            LLM_GENERATE_SECONDS.labels(model=model, stream="false", outcome="ok").observe(max(time.monotonic() - t0, 0.0))
+            stats = generation_stats.parse(resp)
+            generation_stats.observe(stats, model=model, endpoint="chat_session")
+            state = await sessions.store.save(tenant, session_id, model, resp.get("context"), turns=turns + 1)
+        return {
+            "session_id": session_id,
+            "model": model,
+            "response": resp.get("response", ""),
+            "turns": state.turns,
+            "context_reused": bool(context),
+            "generation": stats,
+        }
+
+    async def gen():
+        async with sessions.store.lock(tenant, session_id):
+            context, turns = await _previous()
+            if context:
+                opts["context"] = context
+            stats: Dict[str, Any] = {}
+            async with watch_generation(request, model=model, endpoint="chat_session", stats=stats) as watcher:
+                upstream = ollama.generate_stream(req.prompt, model=model, stats=stats, **opts)
+                async for chunk in stream_until_disconnect(upstream, watcher):
+                    yield chunk
+            # 中途断开时不落盘，会话保持上一轮的 context
+            if not watcher.disconnected.is_set() and "context" in stats:
+                await sessions.store.save(tenant, session_id, model, stats["context"], turns=turns + 1)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "x-session-id": session_id}
+    return StreamingResponse(gen(), media_type="text/plain; charset=utf-8", headers=headers)
+
+
+@router.get("/sessions/{session_id}")
+async def chat_session_get(session_id: str, request: Request) -> Dict[str, Any]:
+    tenant = getattr(request.state, "tenant", "_anon_")
+    state = await sessions.store.get(tenant, session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="session not found")
+    return _session_info(state)
+
+
+@router.delete("/sessions/{session_id}")
+async def chat_session_delete(session_id: str, request: Request) -> Dict[str, Any]:
+    tenant = getattr(request.state, "tenant", "_anon_")
+    deleted = await sessions.store.delete(tenant, session_id)
+    return {"session_id": session_id, "deleted": deleted}
+
+
 # -------- RAG (Retrieval Augmented Generation) --------
 
 class RagChatRequest(BaseModel):
@@ -145,6 +237,8 @@ class RagChatRequest(BaseModel):
     model: Optional[str] = None
     options: Optional[Dict[str, Any]] = None
     filters: Optional[Dict[str, Any]] = None
+    # "extractive"：top-1 高分命中且 payload 含答案字段时直接返回，不调用 LLM（仅 /chat/rag）
+    answer_mode: Optional[str] = None
 
 
 def _build_rag_prompt(query: str, contexts: List[str]) -> str:
@@ -163,36 +257,38 @@ def _build_rag_prompt(query: str, contexts: List[str]) -> str:
 def _prepare_contexts(
     scored: list,
     max_docs: int = 5,
-    per_doc_max_chars: int = 500,
-    total_max_chars: int = 2000,
+    per_doc_max_tokens: int = 400,
+    total_max_tokens: int = 1200,
+    *,
+    distance: Optional[str] = None,
 ):
-    """From scored points, build deduplicated contexts and a sources list.
+    """From scored points, build token-budgeted, MMR-diversified contexts and a sources list.
 
     Returns (contexts: List[str], sources: List[dict])
     """
-    seen = set()
-    contexts: List[str] = []
-    sources: List[Dict[str, Any]] = []
-    total_chars = 0
-    for s in scored:
-        pl = getattr(s, "payload", None) or {}
-        txt = pl.get("text") if isinstance(pl, dict) else None
-        if not txt:
-            continue
-        key = str(txt)
-        if key in seen:
-            continue
-        seen.add(key)
-        snippet = key[:per_doc_max_chars]
-        if total_chars + len(snippet) > total_max_chars:
-            break
-        contexts.append(snippet)
-        total_chars += len(snippet)
-        src = {"id": s.id, "score": s.score, "payload": pl}
-        sources.append(src)
-        if len(contexts) >= max_docs:
-            break
-    return contexts, sources
+    return pack_contexts(
+        scored, max_docs=max_docs, max_tokens=total_max_tokens, per_doc_max_tokens=per_doc_max_tokens, distance=distance,
+    )
+
+
+async def _run_pipeline(
+    query: str, coll: str, top_k: int, filters: Optional[Dict[str, Any]], *, with_vectors: bool = True,
+) -> Tuple[RagPipeline, RagContext]:
+    """Embed (with OLLAMA_EMBED_MODEL) → collection check → retrieve → pack → prompt, timed per stage."""
+    pipe = RagPipeline(
+        collection=coll,
+        top_k=top_k,
+        filters=filters,
+        pack=_prepare_contexts,
+        build_prompt=_build_rag_prompt,
+        with_vectors=with_vectors,
+    )
+    try:
+        return pipe, await pipe.run(query)
+    except EmbeddingError:
+        raise HTTPException(status_code=500, detail="failed to get query embedding")
+    except DimensionMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # -------- RAG 评估（批量查询统计） --------
@@ -203,186 +299,178 @@ class RagEvalRequest(BaseModel):
     collection: Optional[str] = None
     model: Optional[str] = None
     filters: Optional[Dict[str, Any]] = None
-    export: Optional[str] = None  # 'csv' or 'json'
+    export: Optional[str] = None  # 'csv' / 'ndjson'（流式逐行输出）或 'json'
+    # 与 queries 对齐的期望命中 ID 列表；提供时计算 recall@k 与 MRR
+    expected_ids: Optional[List[Optional[List[Union[str, int]]]]] = None
+    batch_size: Optional[int] = None
+    concurrency: Optional[int] = None
+
+
+_EVAL_CSV_COLUMNS = ["query", "has_match", "top1_score", "mean_score", "count", "extractive", "recall_at_k", "reciprocal_rank"]
+_EVAL_CSV_SUMMARY = ["collection", "total", "hit_ratio", "avg_top1", "avg_mean_score", "top_k", "extractive_ratio", "recall_at_k", "mrr", "error"]
+
+
+def _csv_line(values: List[Any]) -> str:
+    import io, csv
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+
+def _fmt(v: Any) -> Any:
+    return f"{v:.6f}" if isinstance(v, float) else ("" if v is None else v)
 
 
 @router.post("/rag_eval")
 async def rag_eval(req: RagEvalRequest):
     coll = req.collection or settings.QDRANT_COLLECTION
     top_k = req.top_k or settings.DEFAULT_TOP_K
-    if not qcli.collection_exists(coll):
+    meta = await qcli.describe_collection(coll)
+    if not meta.exists:
         raise HTTPException(status_code=404, detail=f"collection not found: {coll}")
+    if req.expected_ids is not None and len(req.expected_ids) != len(req.queries):
+        raise HTTPException(status_code=400, detail="expected_ids must align with queries")
 
-    # 批量嵌入（确保模型 + 指数退避重试，最终软失败返回空结果而非 500）
+    # 分批嵌入 + search_batch，有界并发；嵌入失败最终软失败（返回带 error 的汇总）而非 500
     emb_model = (req.model or getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL)
     await ollama.ensure_model(emb_model)
-    t_emb = time.monotonic()
-    vecs: List[List[float]] = []
-    err_detail: Optional[str] = None
-    max_attempts = 6
-    delay = 0.5
-    for attempt in range(1, max_attempts + 1):
+    # 按当前目录策略统计会走抽取式快速路径的比例，便于调节阈值
+    policy = qcli.catalog.extractive_policy(coll)
+    summary = rag_eval_core.EvalSummary(collection=coll, total=len(req.queries), top_k=top_k, policy=policy)
+    batches = rag_eval_core.evaluate(
+        req.queries,
+        collection=coll,
+        top_k=top_k,
+        embed_model=emb_model,
+        filters=req.filters,
+        expected_ids=req.expected_ids,
+        batch_size=req.batch_size or settings.RAG_EVAL_BATCH_SIZE,
+        concurrency=req.concurrency or settings.RAG_EVAL_CONCURRENCY,
+        # 距离度量集合不走抽取式路径，不计入 extractive_ratio
+        policy=policy if extractive.supports_distance(meta.distance) else None,
+    )
+
+    async def rows():
         try:
-            vecs = await ollama.embeddings(req.queries, model=emb_model)
-            if vecs and len(vecs) == len(req.queries) and all(isinstance(v, list) and len(v) > 0 for v in vecs):
-                err_detail = None
-                break
-            err_detail = "empty_or_mismatched_vectors"
-        except Exception as e:
-            err_detail = f"embed_exception: {type(e).__name__}: {e}"
-        if attempt < max_attempts:
-            await asyncio.sleep(delay)
-            delay = min(delay * 2.0, 8.0)
-        else:
-            break
-    EMBED_SECONDS.labels(model=emb_model).observe(max(time.monotonic() - t_emb, 0.0))
-    if err_detail is not None or not vecs or len(vecs) != len(req.queries):
-        # 软失败：返回空结果，便于 CI gate 不中断；下游可据此判定失败
-        details: List[Dict[str, Any]] = []
-        summary = {
-            "collection": coll,
-            "total": len(req.queries),
-            "hit_ratio": 0.0,
-            "avg_top1": 0.0,
-            "avg_mean_score": 0.0,
-            "top_k": top_k,
-            "error": err_detail or "failed_to_get_embeddings",
-        }
-        return {"summary": summary, "details": details}
-
-    details: List[Dict[str, Any]] = []
-    match_cnt = 0
-    sum_top1 = 0.0
-    sum_mean = 0.0
-    n_with_results = 0
-
-    for q, v in zip(req.queries, vecs):
-        t_ret = time.monotonic()
-        scored = qcli.search_vectors(coll, query=v, top_k=top_k, filters=req.filters)
-        RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
-        has = bool(scored)
-        match_cnt += 1 if has else 0
-        top1 = float(scored[0].score) if has else 0.0
-        mean_score = float(sum(s.score for s in scored) / len(scored)) if has else 0.0
-        if has:
-            n_with_results += 1
-            sum_top1 += top1
-            sum_mean += mean_score
-        details.append({
-            "query": q,
-            "has_match": has,
-            "top1_score": top1,
-            "mean_score": mean_score,
-            "count": len(scored),
-        })
-
-    total = len(req.queries)
-    summary = {
-        "collection": coll,
-        "total": total,
-        "hit_ratio": (match_cnt / total) if total else 0.0,
-        "avg_top1": (sum_top1 / n_with_results) if n_with_results else 0.0,
-        "avg_mean_score": (sum_mean / n_with_results) if n_with_results else 0.0,
-        "top_k": top_k,
-    }
+            async for batch in batches:
+                for row in batch:
+                    summary.add(row)
+                    yield row
+        except rag_eval_core.EvalEmbeddingError as e:
+            summary.error = str(e)
+
+    export = (req.export or "").lower()
+    if export == "ndjson":
+        async def ndjson_gen():
+            async for row in rows():
+                yield json.dumps({"type": "row", **row}, ensure_ascii=False) + "\n"
+            yield json.dumps({"type": "summary", **summary.as_dict()}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(ndjson_gen(), media_type="application/x-ndjson; charset=utf-8", headers={"Cache-Control": "no-cache"})
+
+    if export == "csv":
+        # 流式 CSV：逐行输出完成的查询（完成顺序），尾部追加汇总
+        async def csv_gen():
+            yield _csv_line(_EVAL_CSV_COLUMNS)
+            async for row in rows():
+                yield _csv_line([_fmt(row[c]) for c in _EVAL_CSV_COLUMNS])
+            s = summary.as_dict()
+            yield _csv_line([])
+            yield _csv_line(_EVAL_CSV_SUMMARY)
+            yield _csv_line([_fmt(s.get(c)) for c in _EVAL_CSV_SUMMARY])
 
-    if (req.export or "").lower() == "csv":
-        # 生成 CSV 报告
-        import io, csv
-        buf = io.StringIO()
-        writer = csv.writer(buf)
-        writer.writerow(["query", "has_match", "top1_score", "mean_score", "count"]) 
-        for d in details:
-            writer.writerow([d["query"], d["has_match"], f"{d['top1_score']:.6f}", f"{d['mean_score']:.6f}", d["count"]])
-        # 在尾部追加汇总
-        writer.writerow([])
-        writer.writerow(["collection", "total", "hit_ratio", "avg_top1", "avg_mean_score", "top_k"]) 
-        writer.writerow([summary["collection"], summary["total"], f"{summary['hit_ratio']:.6f}", f"{summary['avg_top1']:.6f}", f"{summary['avg_mean_score']:.6f}", summary["top_k"]])
-        data = buf.getvalue()
         headers = {
             "Content-Disposition": "attachment; filename=rag_eval.csv",
             "Cache-Control": "no-cache",
         }
-        return Response(content=data, media_type="text/csv; charset=utf-8", headers=headers)
+        return StreamingResponse(csv_gen(), media_type="text/csv; charset=utf-8", headers=headers)
+
+    details = [row async for row in rows()]
+    details.sort(key=lambda r: r["index"])
+    for row in details:
+        row.pop("index", None)
+    return {"summary": summary.as_dict(), "details": details}
 
-    return {"summary": summary, "details": details}
 
 @router.post("/rag")
-async def chat_rag(req: RagChatRequest) -> Dict[str, Any]:
+async def chat_rag(req: RagChatRequest, response: Response) -> Dict[str, Any]:
+    t_req = time.monotonic()
     coll = req.collection or settings.QDRANT_COLLECTION
     top_k = req.top_k or settings.DEFAULT_TOP_K
-    # embed query
-    t_emb = time.monotonic()
-    qvecs = await ollama.embeddings([req.query], model=req.model or settings.OLLAMA_MODEL)
-    EMBED_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL)).observe(max(time.monotonic() - t_emb, 0.0))
-    if not qvecs or not qvecs[0]:
-        raise HTTPException(status_code=500, detail="failed to get query embedding")
-    # if collection is missing, return empty result
-    if not qcli.collection_exists(coll):
-        return {"collection": coll, "matches": [], "response": "未在文档中找到相关信息"}
-    t_ret = time.monotonic()
-    scored = qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
-    RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
-    # pick contexts with dedup and limits, and collect sources
-    contexts, sources = _prepare_contexts(scored)
-    # build prompt
-    prompt = _build_rag_prompt(req.query, contexts)
+    # embed query / retrieve / pack contexts / build prompt（各阶段计时）
+    pipe, rc = await _run_pipeline(req.query, coll, top_k, req.filters)
+    if not rc.exists:
+        # if collection is missing, return empty result
+        response.headers["Server-Timing"] = pipe.timings.header()
+        return {"collection": coll, "matches": [], "response": "未在文档中找到相关信息", "meta": {"timings": pipe.timings.as_dict()}}
+    scored, sources, prompt = rc.scored, rc.sources, rc.prompt
+
+    def _matches() -> List[Dict[str, Any]]:
+        return [{"id": s.id, "score": s.score, "payload": getattr(s, "payload", None)} for s in scored]
+
+    extractive_mode = req.answer_mode == extractive.MODE
+    if extractive_mode:
+        hit = extractive.try_answer(scored, collection=coll, endpoint="chat_rag", distance=rc.meta.distance if rc.meta else None)
+        if hit is not None:
+            RAG_MATCHES_TOTAL.labels(collection=coll, has_match="true").inc()
+            extractive.observe_answer("chat_rag", "extractive", time.monotonic() - t_req)
+            response.headers["Server-Timing"] = pipe.timings.header()
+            return {
+                "collection": coll,
+                "matches": _matches(),
+                "response": hit.answer,
+                "sources": sources,
+                "meta": {"timings": pipe.timings.as_dict(), "answer_mode": extractive.MODE, "extractive": hit.model_dump()},
+            }
     # call LLM
     opts: Dict[str, Any] = dict(req.options or {})
     if "num_predict" not in opts:
         opts["num_predict"] = settings.DEFAULT_NUM_PREDICT
     t_gen = time.monotonic()
-    resp = await ollama.generate(
+    resp = await pipe.timings.timed("generate", ollama.generate(
         prompt,
         model=req.model or settings.OLLAMA_MODEL,
         **opts,
-    )
-    LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="false").observe(max(time.monotonic() - t_gen, 0.0))
+    ))
+    LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="false", outcome="ok").observe(max(time.monotonic() - t_gen, 0.0))
+    generation_stats.observe(generation_stats.parse(resp), model=(req.model or settings.OLLAMA_MODEL), endpoint="chat_rag")
     RAG_MATCHES_TOTAL.labels(collection=coll, has_match=str(bool(scored)).lower()).inc()
+    if extractive_mode:
+        extractive.observe_answer("chat_rag", "llm", time.monotonic() - t_req)
+    response.headers["Server-Timing"] = pipe.timings.header()
     return {
         "collection": coll,
-        "matches": [
-            {"id": s.id, "score": s.score, "payload": getattr(s, "payload", None)} for s in scored
-        ],
+        "matches": _matches(),
         "response": resp.get("response", ""),
         "sources": sources,
+        "meta": {"timings": pipe.timings.as_dict()},
     }
 
 
 @router.post("/rag_stream")
-async def chat_rag_stream(req: RagChatRequest) -> StreamingResponse:
+async def chat_rag_stream(req: RagChatRequest, request: Request) -> StreamingResponse:
     coll = req.collection or settings.QDRANT_COLLECTION
     top_k = req.top_k or settings.DEFAULT_TOP_K
-    qvecs = await ollama.embeddings([req.query], model=req.model or settings.OLLAMA_MODEL)
-    if not qvecs or not qvecs[0]:
-        raise HTTPException(status_code=500, detail="failed to get query embedding")
-    if not qcli.collection_exists(coll):
+    pipe, rc = await _run_pipeline(req.query, coll, top_k, req.filters)
+    if not rc.exists:
         # 直接返回固定文本流
         async def empty_gen():
             yield "未在文档中找到相关信息"
-        return StreamingResponse(empty_gen(), media_type="text/plain; charset=utf-8")
-    t_ret = time.monotonic()
-    scored = qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
-    RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
-    contexts, sources = _prepare_contexts(scored)
-    prompt = _build_rag_prompt(req.query, contexts)
+        return StreamingResponse(empty_gen(), media_type="text/plain; charset=utf-8", headers={"Server-Timing": pipe.timings.header()})
+    scored, sources, prompt = rc.scored, rc.sources, rc.prompt
 
-    async def gen():
+    async def gen(watcher, stats):
         opts: Dict[str, Any] = dict(req.options or {})
         if "num_predict" not in opts:
             opts["num_predict"] = settings.DEFAULT_NUM_PREDICT
-        t0 = time.monotonic()
-        try:
-            async for chunk in ollama.generate_stream(
-                prompt,
-                model=req.model or settings.OLLAMA_MODEL,
-                **opts,
-            ):
-                yield chunk
-        finally:
-            LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="true").observe(
-                max(time.monotonic() - t0, 0.0)
-            )
+        upstream = ollama.generate_stream(
+            prompt,
+            model=req.model or settings.OLLAMA_MODEL,
+            **opts,
+            stats=stats,
+        )
+        async for chunk in stream_until_disconnect(upstream, watcher):
+            yield chunk
         RAG_MATCHES_TOTAL.labels(collection=coll, has_match=str(bool(scored)).lower()).inc()
     async def tail_sources():
         # 在尾部追加参考来源
@@ -401,51 +489,42 @@ async def chat_rag_stream(req: RagChatRequest) -> StreamingResponse:
 
     async def merged_gen():
         yield "retry: 3000\n\n"
-        async for chunk in gen():
-            yield chunk
+        # 客户端断开时中止上游生成并记录 outcome=aborted，不再追加来源
+        stats: Dict[str, Any] = {}
+        async with watch_generation(request, model=(req.model or settings.OLLAMA_MODEL), endpoint="chat_rag_stream", stats=stats) as watcher:
+            async for chunk in gen(watcher, stats):
+                yield chunk
+        if watcher.disconnected.is_set():
+            return
         async for line in tail_sources():
             yield line
 
-    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": pipe.timings.header()}
     return StreamingResponse(merged_gen(), media_type="text/plain; charset=utf-8", headers=headers)
 
 
 @router.post("/rag_stream_sse")
-async def chat_rag_stream_sse(req: RagChatRequest) -> StreamingResponse:
+async def chat_rag_stream_sse(req: RagChatRequest, request: Request) -> StreamingResponse:
     coll = req.collection or settings.QDRANT_COLLECTION
     top_k = req.top_k or settings.DEFAULT_TOP_K
-    t_emb = time.monotonic()
-    qvecs = await ollama.embeddings([req.query], model=req.model or settings.OLLAMA_MODEL)
-    EMBED_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL)).observe(max(time.monotonic() - t_emb, 0.0))
-    if not qvecs or not qvecs[0]:
-        raise HTTPException(status_code=500, detail="failed to get query embedding")
-    if not qcli.collection_exists(coll):
+    pipe, rc = await _run_pipeline(req.query, coll, top_k, req.filters)
+    if not rc.exists:
         async def empty_gen():
             yield "data: 未在文档中找到相关信息\n\n"
             yield "data: [DONE]\n\n"
-        return StreamingResponse(empty_gen(), media_type="text/event-stream")
-    t_ret = time.monotonic()
-    scored = qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
-    RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
-    contexts, sources = _prepare_contexts(scored)
-    prompt = _build_rag_prompt(req.query, contexts)
+        return StreamingResponse(empty_gen(), media_type="text/event-stream", headers={"Server-Timing": pipe.timings.header()})
+    scored, sources, prompt = rc.scored, rc.sources, rc.prompt
 
-    async def gen():
+    def upstream(stats):
         opts: Dict[str, Any] = dict(req.options or {})
         if "num_predict" not in opts:
             opts["num_predict"] = settings.DEFAULT_NUM_PREDICT
-        t0 = time.monotonic()
-        try:
-            async for chunk in ollama.generate_stream(
-                prompt,
-                model=req.model or settings.OLLAMA_MODEL,
-                **opts,
-            ):
-                yield chunk
-        finally:
-            LLM_GENERATE_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL), stream="true").observe(
-                max(time.monotonic() - t0, 0.0)
-            )
+        return ollama.generate_stream(
+            prompt,
+            model=req.model or settings.OLLAMA_MODEL,
+            **opts,
+            stats=stats,
+        )
 
     async def tail_sources_sse():
         yield "data: 参考来源:\n\n"
@@ -464,45 +543,52 @@ async def chat_rag_stream_sse(req: RagChatRequest) -> StreamingResponse:
 
     async def merged_sse():
         yield "retry: 3000\n\n"
-        async for chunk in gen():
-            for line in str(chunk).splitlines():
-                yield f"data: {line}\n\n"
+        stats: Dict[str, Any] = {}
+        async with watch_generation(request, model=(req.model or settings.OLLAMA_MODEL), endpoint="chat_rag_stream_sse", stats=stats) as watcher:
+            async for frame in SSEStream(upstream(stats), frame=sse_line_frames, watcher=watcher, raise_errors=True):
+                yield frame
+        if watcher.disconnected.is_set():
+            return
         async for line in tail_sources_sse():
             yield line
         # 记录是否命中
         RAG_MATCHES_TOTAL.labels(collection=coll, has_match=str(bool(scored)).lower()).inc()
 
-    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": pipe.timings.header()}
     return StreamingResponse(merged_sse(), media_type="text/event-stream", headers=headers)
 
 
 @router.get("/stream_sse")
-async def chat_stream_sse_get(prompt: str, model: Optional[str] = None, num_predict: Optional[int] = None) -> StreamingResponse:
+async def chat_stream_sse_get(request: Request, prompt: str, model: Optional[str] = None, num_predict: Optional[int] = None) -> StreamingResponse:
     opts: Dict[str, Any] = {}
     opts["num_predict"] = num_predict or settings.DEFAULT_NUM_PREDICT
 
     async def gen():
         yield "retry: 3000\n\n"
-        t0 = time.monotonic()
-        try:
-            async for chunk in ollama.generate_stream(
+        stats: Dict[str, Any] = {}
+        async with watch_generation(request, model=(model or settings.OLLAMA_MODEL), endpoint="chat_stream_sse", stats=stats) as watcher:
+            upstream = ollama.generate_stream(
                 prompt,
                 model=model or settings.OLLAMA_MODEL,
                 **opts,
-            ):
-                for line in str(chunk).splitlines():
-                    yield f"data: {line}\n\n"
-        finally:
-            LLM_GENERATE_SECONDS.labels(model=(model or settings.OLLAMA_MODEL), stream="true").observe(
-                max(time.monotonic() - t0, 0.0)
+                stats=stats,
             )
+            async for frame in SSEStream(upstream, frame=sse_line_frames, watcher=watcher, raise_errors=True):
+                yield frame
+        if watcher.disconnected.is_set():
+            return
         yield "data: [DONE]\n\n"
 
-
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    }
+    return StreamingResponse(gen(), media_type="text/event-stream", headers=headers)
 
 
 @router.get("/rag_stream_sse")
 async def chat_rag_stream_sse_get(
+    request: Request,
     query: str,
     collection: Optional[str] = None,
     top_k: Optional[int] = None,
@@ -516,39 +602,29 @@ async def chat_rag_stream_sse_get(
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="invalid filters json")
 
-    t_emb = time.monotonic()
-    qvecs = await ollama.embeddings([query], model=model or settings.OLLAMA_MODEL)
-    EMBED_SECONDS.labels(model=(model or settings.OLLAMA_MODEL)).observe(max(time.monotonic() - t_emb, 0.0))
-    if not qvecs or not qvecs[0]:
-        raise HTTPException(status_code=500, detail="failed to get query embedding")
-    if not qcli.collection_exists(coll):
+    pipe, rc = await _run_pipeline(query, coll, k, flt)
+    if not rc.exists:
         async def empty_gen():
             yield "data: 未在文档中找到相关信息\n\n"
             yield "data: [DONE]\n\n"
-        return StreamingResponse(empty_gen(), media_type="text/event-stream")
-
-    t_ret = time.monotonic()
-    scored = qcli.search_vectors(coll, query=qvecs[0], top_k=k, filters=flt)
-    RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
-    contexts, sources = _prepare_contexts(scored)
-    prompt = _build_rag_prompt(query, contexts)
+        return StreamingResponse(empty_gen(), media_type="text/event-stream", headers={"Server-Timing": pipe.timings.header()})
+    sources, prompt = rc.sources, rc.prompt
 
     async def gen():
         opts: Dict[str, Any] = {"num_predict": settings.DEFAULT_NUM_PREDICT}
         yield "retry: 3000\n\n"
-        t0 = time.monotonic()
-        try:
-            async for chunk in ollama.generate_stream(
+        stats: Dict[str, Any] = {}
+        async with watch_generation(request, model=(model or settings.OLLAMA_MODEL), endpoint="chat_rag_stream_sse", stats=stats) as watcher:
+            upstream = ollama.generate_stream(
                 prompt,
                 model=model or settings.OLLAMA_MODEL,
                 **opts,
-            ):
-                for line in str(chunk).splitlines():
-                    yield f"data: {line}\n\n"
-        finally:
-            LLM_GENERATE_SECONDS.labels(model=(model or settings.OLLAMA_MODEL), stream="true").observe(
-                max(time.monotonic() - t0, 0.0)
+                stats=stats,
             )
+            async for frame in SSEStream(upstream, frame=sse_line_frames, watcher=watcher, raise_errors=True):
+                yield frame
+        if watcher.disconnected.is_set():
+            return
         # 追加参考来源
         yield "data: 参考来源:\n\n"
         for src in sources:
@@ -564,29 +640,24 @@ async def chat_rag_stream_sse_get(
             yield f"data: {content}\n\n"
         yield "data: [DONE]\n\n"
 
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": pipe.timings.header()}
+    return StreamingResponse(gen(), media_type="text/event-stream", headers=headers)
+
 
 # -------- RAG 预览（仅检索，不生成） --------
 
 @router.post("/rag_preview")
-async def rag_preview(req: RagChatRequest) -> Dict[str, Any]:
+async def rag_preview(req: RagChatRequest, response: Response) -> Dict[str, Any]:
     coll = req.collection or settings.QDRANT_COLLECTION
     top_k = req.top_k or settings.DEFAULT_TOP_K
-    t_emb = time.monotonic()
-    qvecs = await ollama.embeddings([req.query], model=req.model or settings.OLLAMA_MODEL)
-    EMBED_SECONDS.labels(model=(req.model or settings.OLLAMA_MODEL)).observe(max(time.monotonic() - t_emb, 0.0))
-    if not qvecs or not qvecs[0]:
-        raise HTTPException(status_code=500, detail="failed to get query embedding")
-    if not qcli.collection_exists(coll):
-        return {"collection": coll, "sources": []}
-    t_ret = time.monotonic()
-    scored = qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
-    RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
-    _, sources = _prepare_contexts(scored)
-    return {"collection": coll, "sources": sources}
+    pipe, rc = await _run_pipeline(req.query, coll, top_k, req.filters, with_vectors=False)
+    response.headers["Server-Timing"] = pipe.timings.header()
+    return {"collection": coll, "sources": rc.sources, "meta": {"timings": pipe.timings.as_dict()}}
 
 
 @router.get("/rag_preview")
 async def rag_preview_get(
+    response: Response,
     query: str,
     collection: Optional[str] = None,
     top_k: Optional[int] = None,
@@ -599,18 +670,6 @@ async def rag_preview_get(
         flt = json.loads(filters) if filters else None
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="invalid filters json")
-    t_emb = time.monotonic()
-    qvecs = await ollama.embeddings([query], model=model or settings.OLLAMA_MODEL)
-    EMBED_SECONDS.labels(model=(model or settings.OLLAMA_MODEL)).observe(max(time.monotonic() - t_emb, 0.0))
-    if not qvecs or not qvecs[0]:
-        raise HTTPException(status_code=500, detail="failed to get query embedding")
-    if not qcli.collection_exists(coll):
-        return {"collection": coll, "sources": []}
-    t_ret = time.monotonic()
-    scored = qcli.search_vectors(coll, query=qvecs[0], top_k=k, filters=flt)
-    RAG_RETRIEVAL_SECONDS.labels(collection=coll).observe(max(time.monotonic() - t_ret, 0.0))
-    _, sources = _prepare_contexts(scored)
-    return {"collection": coll, "sources": sources}
-
-    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
-    return StreamingResponse(gen(), media_type="text/event-stream", headers=headers)
+    pipe, rc = await _run_pipeline(query, coll, k, flt, with_vectors=False)
+    response.headers["Server-Timing"] = pipe.timings.header()
+    return {"collection": coll, "sources": rc.sources, "meta": {"timings": pipe.timings.as_dict()}}
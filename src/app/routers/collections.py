@@ -85,45 +85,16 @@ _export_semaphore = asyncio.Semaphore(_EXPORT_MAX_CONCURRENCY)
 _download_semaphore = asyncio.Semaphore(_DOWNLOAD_MAX_CONCURRENCY)
 
 
-def _extract_vector_size(info: Dict[str, Any]) -> int:
-    """Best-effort 从 Qdrant collection info 中提取向量维度 size。
-
-    兼容多种结构：
-    - info["config"]["params"]["vectors"]["size"]
-    - info["params"]["vectors"]["size"]
-    - info["params"]["size"]
-    - info["vectors"]["size"]
-    未找到则返回 0。
-    """
-    try:
-        return int(info.get("config", {}).get("params", {}).get("vectors", {}).get("size") or 0)
-    except Exception:
-        pass
-    try:
-        return int(info.get("params", {}).get("vectors", {}).get("size") or 0)
-    except Exception:
-        pass
-    try:
-        return int(info.get("params", {}).get("size") or 0)
-    except Exception:
-        pass
-    try:
-        return int(info.get("vectors", {}).get("size") or 0)
-    except Exception:
-        pass
-    return 0
-
-
 @router.get("")
 async def list_collections() -> Dict[str, Any]:
-    return {"collections": qcli.list_collections()}
+    return {"collections": await qcli.list_collections()}
 
 
 @router.get("/{name}")
 async def collection_info(name: str) -> Dict[str, Any]:
-    if not qcli.collection_exists(name):
+    if not await qcli.collection_exists(name):
         raise HTTPException(status_code=404, detail="collection not found")
-    return {"name": name, "info": qcli.get_collection_info(name)}
+    return {"name": name, "info": await qcli.get_collection_info(name)}
 
 
 @router.post("/ensure")
@@ -135,50 +106,77 @@ async def ensure_collection(req: EnsureRequest) -> Dict[str, Any]:
         distance = getattr(qmodels.Distance, dist)
     except AttributeError:
         raise HTTPException(status_code=400, detail=f"invalid distance: {req.distance}")
-    qcli.ensure_collection(req.name, vector_size=req.vector_size, distance=distance)
+    await qcli.ensure_collection(req.name, vector_size=req.vector_size, distance=distance)
     return {"name": req.name, "distance": distance.value, "vector_size": req.vector_size}
 
 
 @router.delete("/{name}")
 async def delete_collection(name: str) -> Dict[str, Any]:
-    if not qcli.collection_exists(name):
+    if not await qcli.collection_exists(name):
         # idempotent delete
         return {"name": name, "deleted": False, "reason": "not found"}
-    qcli.delete_collection(name)
+    await qcli.delete_collection(name)
     return {"name": name, "deleted": True}
 
 
 @router.post("/{name}/clear")
 async def clear_collection(name: str) -> Dict[str, Any]:
-    if not qcli.collection_exists(name):
+    if not await qcli.collection_exists(name):
         raise HTTPException(status_code=404, detail="collection not found")
-    qcli.clear_collection(name)
+    await qcli.clear_collection(name)
     return {"name": name, "cleared": True}
 
 
+class ExtractivePolicyRequest(BaseModel):
+    min_score: float
+    answer_field: Optional[str] = None  # 默认 EXTRACTIVE_ANSWER_FIELD
+
+
+@router.get("/{name}/extractive")
+async def get_extractive_policy(name: str) -> Dict[str, Any]:
+    return {"name": name, **qcli.catalog.extractive_policy(name).model_dump()}
+
+
+@router.put("/{name}/extractive")
+async def set_extractive_policy(name: str, req: ExtractivePolicyRequest) -> Dict[str, Any]:
+    """Tune the ``answer_mode=extractive`` threshold/answer field of one collection (in-process)."""
+    policy = qcli.ExtractivePolicy(
+        min_score=req.min_score,
+        answer_field=req.answer_field or qcli.catalog.extractive_policy(name).answer_field,
+    )
+    qcli.catalog.set_extractive_policy(name, policy)
+    return {"name": name, **policy.model_dump()}
+
+
+@router.delete("/{name}/extractive")
+async def reset_extractive_policy(name: str) -> Dict[str, Any]:
+    qcli.catalog.set_extractive_policy(name, None)
+    return {"name": name, **qcli.catalog.extractive_policy(name).model_dump()}
+
+
 @router.post("/points/delete_by_ids")
 async def delete_points_by_ids(req: DeletePointsByIdsRequest) -> Dict[str, Any]:
-    if not qcli.collection_exists(req.collection):
+    if not await qcli.collection_exists(req.collection):
         raise HTTPException(status_code=404, detail="collection not found")
     if not req.ids:
         raise HTTPException(status_code=400, detail="ids is required")
-    deleted = qcli.delete_points_by_ids(req.collection, req.ids)
+    deleted = await qcli.delete_points_by_ids(req.collection, req.ids)
     return {"collection": req.collection, "deleted_ids": req.ids, "deleted_count": deleted}
 
 
 @router.post("/points/delete_by_filter")
 async def delete_points_by_filter(req: DeletePointsByFilterRequest) -> Dict[str, Any]:
-    if not qcli.collection_exists(req.collection):
+    if not await qcli.collection_exists(req.collection):
         raise HTTPException(status_code=404, detail="collection not found")
     if not req.filters:
         raise HTTPException(status_code=400, detail="filters is required")
-    deleted = qcli.delete_points_by_filter(req.collection, req.filters)
+    deleted = await qcli.delete_points_by_filter(req.collection, req.filters)
     return {"collection": req.collection, "filters": req.filters, "deleted": True, "deleted_count": deleted}
 
 
 @router.post("/points/upsert_texts")
 async def upsert_texts(req: UpsertTextsRequest) -> Dict[str, Any]:
-    if not qcli.collection_exists(req.collection):
+    if not await qcli.collection_exists(req.collection):
         raise HTTPException(status_code=404, detail="collection not found")
     if not req.texts:
         raise HTTPException(status_code=400, detail="texts is required")
@@ -198,7 +196,7 @@ async def upsert_texts(req: UpsertTextsRequest) -> Dict[str, Any]:
         payloads.append(base)
 
     # 写入 Qdrant
-    qcli.upsert_vectors(req.collection, vectors=vecs, payloads=payloads, ids=req.ids)
+    await qcli.upsert_vectors(req.collection, vectors=vecs, payloads=payloads, ids=req.ids)
 
     return {
         "collection": req.collection,
@@ -209,18 +207,18 @@ async def upsert_texts(req: UpsertTextsRequest) -> Dict[str, Any]:
 
 @router.post("/export")
 async def export_collection(req: ExportRequest):
-    if not qcli.collection_exists(req.collection):
+    if not await qcli.collection_exists(req.collection):
         raise HTTPException(status_code=404, detail="collection not found")
     # 直接使用 Qdrant scroll，规避潜在兼容性问题
     from qdrant_client.http import models as qmodels
-    from src.app.clients.qdrant import get_client, _build_filter  # type: ignore
+    from src.app.clients.qdrant import get_async_client, _build_filter  # type: ignore
 
-    client = get_client()
+    client = get_async_client()
     flt = _build_filter(req.filters) if req.filters else None
     next_page: Optional[qmodels.ScrollOffset] = None
     lines: List[str] = []
     while True:
-        points, next_page = client.scroll(
+        points, next_page = await client.scroll(
             collection_name=req.collection,
             limit=1000,
             with_vectors=req.with_vectors,
@@ -327,9 +325,9 @@ async def _run_export_task(task_id: str) -> None:
     EXPORT_RUNNING.labels(collection=req.collection, tenant=tenant).inc()
     try:
         from qdrant_client.http import models as qmodels
-        from src.app.clients.qdrant import get_client, _build_filter  # type: ignore
+        from src.app.clients.qdrant import get_async_client, _build_filter  # type: ignore
 
-        client = get_client()
+        client = get_async_client()
         flt = _build_filter(req.filters) if req.filters else None
         next_page: Optional[qmodels.ScrollOffset] = None
         total = 0
@@ -344,7 +342,7 @@ async def _run_export_task(task_id: str) -> None:
         writer_ctx = gzip.open(path, "wt", encoding="utf-8") if getattr(req, "with_gzip", False) else open(path, "w", encoding="utf-8")
         with writer_ctx as f:
             while True:
-                points, next_page = client.scroll(
+                points, next_page = await client.scroll(
                     collection_name=req.collection,
                     limit=1000,
                     with_vectors=req.with_vectors,
@@ -489,7 +487,7 @@ class ExportStartRequest(ExportRequest):
 
 @router.post("/export/start")
 async def export_start(req: ExportStartRequest, request: Request) -> Dict[str, Any]:
-    if not qcli.collection_exists(req.collection):
+    if not await qcli.collection_exists(req.collection):
         raise HTTPException(status_code=404, detail="collection not found")
     task_id = uuid.uuid4().hex
     tenant = getattr(getattr(request, "state", None), "tenant", None) or "_anon_"
@@ -609,11 +607,11 @@ async def _schedule_file_cleanup(task_id: str) -> None:
 
 @router.post("/import")
 async def import_collection(req: ImportRequest) -> Dict[str, Any]:
-    if not qcli.collection_exists(req.collection):
+    meta = await qcli.describe_collection(req.collection)
+    if not meta.exists:
         raise HTTPException(status_code=404, detail="collection not found")
     # 校验向量维度
-    info = qcli.get_collection_info(req.collection)
-    expected_dim = _extract_vector_size(info)
+    expected_dim = meta.vector_size
     lines = [ln for ln in req.jsonl.splitlines() if ln.strip()]
     ids: List[Any] = []
     vectors: List[Any] = []
@@ -644,8 +642,7 @@ async def import_collection(req: ImportRequest) -> Dict[str, Any]:
     batches = 0
     if vectors:
         # 批处理写入
-        from src.app.clients.qdrant import get_client as _get_client
-        client = _get_client()
+        client = qcli.get_async_client()
         bs = max(1, int(req.batch_size or 1000))
         on_conflict = (req.on_conflict or "upsert").lower()
         for i in range(0, len(vectors), bs):
@@ -658,7 +655,7 @@ async def import_collection(req: ImportRequest) -> Dict[str, Any]:
                 existing_ids: Set[Any] = set()
                 if check_ids:
                     try:
-                        existing = client.retrieve(collection_name=req.collection, ids=check_ids, with_vectors=False, with_payload=False)
+                        existing = await client.retrieve(collection_name=req.collection, ids=check_ids, with_vectors=False, with_payload=False)
                         existing_ids = {getattr(p, 'id', None) for p in existing}
                     except Exception:
                         existing_ids = set()
@@ -677,7 +674,7 @@ async def import_collection(req: ImportRequest) -> Dict[str, Any]:
                 sub_vecs, sub_ids, sub_pls = keep_vecs, keep_ids, keep_pls
             if not sub_vecs:
                 continue
-            qcli.upsert_vectors(req.collection, vectors=sub_vecs, payloads=sub_pls, ids=sub_ids)
+            await qcli.upsert_vectors(req.collection, vectors=sub_vecs, payloads=sub_pls, ids=sub_ids)
             batches += 1
             imported += len(sub_vecs)
             IMPORT_BATCHES_TOTAL.labels(collection=req.collection).inc()
@@ -704,7 +701,8 @@ async def import_collection_file(
     on_conflict: str = Form("upsert"),
 ) -> Dict[str, Any]:
     """通过文件上传导入 NDJSON；自动识别 gzip。表单字段与 JSON 版保持一致。"""
-    if not qcli.collection_exists(collection):
+    meta = await qcli.describe_collection(collection)
+    if not meta.exists:
         raise HTTPException(status_code=404, detail="collection not found")
     # 读取文件并解压
     raw = await file.read()
@@ -723,8 +721,7 @@ async def import_collection_file(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"failed to decode file: {e}")
 
-    info = qcli.get_collection_info(collection)
-    expected_dim = _extract_vector_size(info)
+    expected_dim = meta.vector_size
     lines = [ln for ln in text.splitlines() if ln.strip()]
 
     ids: list = []
@@ -757,8 +754,7 @@ async def import_collection_file(
     imported = 0
     batches = 0
     if vectors:
-        from src.app.clients.qdrant import get_client as _get_client
-        client = _get_client()
+        client = qcli.get_async_client()
         bs = max(1, int(batch_size or 1000))
         on_conf = (on_conflict or "upsert").lower()
         for i in range(0, len(vectors), bs):
@@ -770,7 +766,7 @@ async def import_collection_file(
                 existing_ids: set = set()
                 if check_ids:
                     try:
-                        existing = client.retrieve(collection_name=collection, ids=check_ids, with_vectors=False, with_payload=False)
+                        existing = await client.retrieve(collection_name=collection, ids=check_ids, with_vectors=False, with_payload=False)
                         existing_ids = {getattr(p, 'id', None) for p in existing}
                     except Exception:
                         existing_ids = set()
@@ -788,7 +784,7 @@ async def import_collection_file(
                 sub_vecs, sub_ids, sub_pls = keep_vecs, keep_ids, keep_pls
             if not sub_vecs:
                 continue
-            qcli.upsert_vectors(collection, vectors=sub_vecs, payloads=sub_pls, ids=sub_ids)
+            await qcli.upsert_vectors(collection, vectors=sub_vecs, payloads=sub_pls, ids=sub_ids)
             batches += 1
             imported += len(sub_vecs)
             IMPORT_BATCHES_TOTAL.labels(collection=collection).inc()
@@ -823,7 +819,7 @@ async def export_download(
     - with_vectors/with_payload: 是否包含向量/负载
     - filters: JSON 字符串，作为 payload 过滤条件
     """
-    if not qcli.collection_exists(collection):
+    if not await qcli.collection_exists(collection):
         raise HTTPException(status_code=404, detail="collection not found")
 
     try:
@@ -8,6 +8,7 @@ from pydantic import BaseModel
 from src.app.clients import ollama
 from src.app.clients import qdrant as qcli
 from src.app.config import settings
+from src.app.core import embedding_cache
 
 router = APIRouter(prefix="/embedding", tags=["embedding"])
 
@@ -91,10 +92,10 @@ async def upsert(req: UpsertRequest) -> Dict[str, Any]:
                 raise HTTPException(status_code=500, detail=f"embedding failed after retries: {type(e).__name__}: {e}")
     dim = len(vectors[0])
     # ensure collection exists
-    qcli.ensure_collection(coll, vector_size=dim)
+    await qcli.ensure_collection(coll, vector_size=dim)
     # auto-augment payloads with text if not provided
     payloads = req.payloads or [ {"text": t} for t in req.texts ]
-    qcli.upsert_vectors(coll, vectors=vectors, payloads=payloads, ids=req.ids)
+    await qcli.upsert_vectors(coll, vectors=vectors, payloads=payloads, ids=req.ids)
     return {"collection": coll, "dimension": dim, "count": len(vectors)}
 
 
@@ -104,35 +105,19 @@ async def search(req: SearchRequest) -> Dict[str, Any]:
     top_k = req.top_k or settings.DEFAULT_TOP_K
     # embed query
     chosen_model = (req.model or getattr(settings, "OLLAMA_EMBED_MODEL", None) or settings.OLLAMA_MODEL)
-    qvecs = await ollama.embeddings([req.query], model=chosen_model)
+    qvecs = await embedding_cache.embeddings([req.query], model=chosen_model)
     if not qvecs or not qvecs[0]:
         raise HTTPException(status_code=500, detail="failed to get query embedding")
     dim = len(qvecs[0])
-    # If collection exists, validate expected vector dimension to avoid opaque 400 from Qdrant
-    if qcli.collection_exists(coll):
-        try:
-            info = qcli.get_collection_info(coll)
-            # best-effort extract size
-            expected = (
-                info.get("config", {}).get("params", {}).get("vectors", {}).get("size")
-                or info.get("params", {}).get("vectors", {}).get("size")
-                or info.get("params", {}).get("size")
-                or (info.get("vectors", {}) if isinstance(info.get("vectors", {}), dict) else {}).get("size")
-                or 0
-            )
-            expected = int(expected or 0)
-            if expected and expected != dim:
-                raise HTTPException(status_code=400, detail=f"vector dimension mismatch: collection expects {expected}, query has {dim}")
-        except HTTPException:
-            raise
-        except Exception:
-            # proceed; server-side Qdrant may still return detailed error
-            pass
+    # Validate expected vector dimension to avoid opaque 400 from Qdrant
+    meta = await qcli.describe_collection(coll)
     # if collection is missing, return empty
-    if not qcli.collection_exists(coll):
+    if not meta.exists:
         return {"collection": coll, "matches": []}
+    if meta.vector_size and meta.vector_size != dim:
+        raise HTTPException(status_code=400, detail=f"vector dimension mismatch: collection expects {meta.vector_size}, query has {dim}")
     try:
-        scored = qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
+        scored = await qcli.search_vectors(coll, query=qvecs[0], top_k=top_k, filters=req.filters)
     except Exception as e:
         # Surface upstream errors as 400 for easier client debugging
         raise HTTPException(status_code=400, detail=f"qdrant search failed: {e}")
@@ -146,3 +131,10 @@ async def search(req: SearchRequest) -> Dict[str, Any]:
         for s in scored
     ]
     return {"collection": coll, "matches": matches}
+
+
+@router.delete("/cache")
+async def invalidate_cache(model: Optional[str] = None) -> Dict[str, Any]:
+    """清理查询向量缓存；指定 model 时仅清理该模型（模型名需与嵌入时一致），否则全部清理。"""
+    removed = await embedding_cache.cache.invalidate(model)
+    return {"model": model, "removed": removed}
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from src.app.core.admin_store import WORKER_ID, SQLiteAdminStore
+
+
+def _eval(eid, created):
+    return {"id": eid, "name": eid, "description": None, "created_at": created, "updated_at": created, "items_count": 0}
+
+
+@pytest.mark.asyncio
+async def test_items_append_and_pages(tmp_path):
+    store = SQLiteAdminStore(str(tmp_path / "admin.db"))
+    for i in range(5):
+        await store.put_eval(_eval(f"e{i}", f"2026-01-0{i + 1}T00:00:00"))
+    await store.add_items("e0", [{"query": "q1"}, {"query": "q2"}], updated_at="2026-02-01T00:00:00")
+    await store.add_items("e0", [{"query": "q3"}], updated_at="2026-02-02T00:00:00")
+
+    assert [it["query"] for it in await store.list_items("e0")] == ["q1", "q2", "q3"]
+    e0 = await store.get_eval("e0")
+    assert e0["items_count"] == 3 and e0["updated_at"] == "2026-02-02T00:00:00"
+
+    page, total = await store.list_evals(limit=2, offset=2)
+    assert total == 5 and [r["id"] for r in page] == ["e2", "e3"]
+
+    for i in range(3):
+        await store.put_run({"id": f"r{i}", "eval_id": "e0", "created_at": f"2026-03-0{i + 1}T00:00:00", "status": "running", "metrics": {"n": i}}, owner="w-gone")
+    await store.put_run({"id": "r1", "eval_id": "e0", "created_at": "2026-03-02T00:00:00", "status": "completed", "metrics": {"n": 9}})
+    runs, total = await store.list_runs(limit=2)
+    assert total == 3 and [r["id"] for r in runs] == ["r2", "r1"]
+    assert runs[1]["metrics"] == {"n": 9}
+
+    # 其他 worker 的心跳仍新鲜：不视为中断
+    assert await store.mark_interrupted(stale_after=60) == 0
+    assert await store.mark_interrupted(stale_after=0) == 2
+    assert (await store.get_run("r0"))["metrics"]["error"] == "interrupted"
+
+    await store.delete_eval("e0")
+    assert await store.get_eval("e0") is None
+    assert await store.list_items("e0") == []
+    assert (await store.list_runs(eval_id="e0"))[1] == 0
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_mark_interrupted_spares_own_and_heartbeating_runs(tmp_path):
+    store = SQLiteAdminStore(str(tmp_path / "admin.db"))
+    run = {"eval_id": "e", "created_at": "2026-03-01T00:00:00", "status": "running", "metrics": {}}
+    await store.put_run({**run, "id": "mine"})
+    await store.put_run({**run, "id": "alive"}, owner="w-alive")
+    await store.put_run({**run, "id": "gone"}, owner="w-gone")
+    await store._write([("UPDATE admin_eval_runs SET heartbeat_at = 0 WHERE id <> ?", [("alive",)])])
+    await store.heartbeat("w-alive")
+
+    assert await store.mark_interrupted(stale_after=30) == 1
+    assert (await store.get_run("gone"))["status"] == "failed"
+    assert (await store.get_run("alive"))["status"] == "running"
+    assert (await store.get_run("mine"))["status"] == "running"
+    assert WORKER_ID != "w-gone"
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_legacy_schema_gains_owner_columns(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "admin.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE admin_eval_runs (id TEXT PRIMARY KEY, eval_id TEXT NOT NULL, created_at TEXT NOT NULL, status TEXT NOT NULL, metrics TEXT NOT NULL)")
+    conn.execute("INSERT INTO admin_eval_runs VALUES ('old', 'e', '2026-01-01T00:00:00', 'running', '{}')")
+    conn.commit()
+    conn.close()
+
+    store = SQLiteAdminStore(path)
+    assert await store.mark_interrupted(stale_after=30) == 1
+    await store.put_run({"id": "new", "eval_id": "e", "created_at": "2026-01-02T00:00:00", "status": "running", "metrics": {}})
+    assert (await store.get_run("new"))["status"] == "running"
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_legacy_json_is_migrated_once(tmp_path):
+    legacy = tmp_path / "admin_evals.json"
+    legacy.write_text(json.dumps({
+        "evals": {"e1": _eval("e1", "2026-01-01T00:00:00") | {"items_count": 1}},
+        "eval_items": {"e1": [{"query": "旧条目"}]},
+        "eval_runs": {"r1": {"id": "r1", "eval_id": "e1", "created_at": "2026-01-02T00:00:00", "status": "completed", "metrics": {"accuracy": 1.0}}},
+    }, ensure_ascii=False))
+    store = SQLiteAdminStore(str(tmp_path / "admin.db"), legacy_json=str(legacy))
+
+    assert (await store.get_eval("e1"))["items_count"] == 1
+    assert await store.list_items("e1") == [{"query": "旧条目"}]
+    assert (await store.get_run("r1"))["metrics"] == {"accuracy": 1.0}
+    assert not legacy.exists() and (tmp_path / "admin_evals.json.migrated").exists()
+    await store.close()
+
+
+def test_admin_store_is_abstract():
+    from src.app.core.admin_store import AdminStore
+
+    with pytest.raises(TypeError):
+        AdminStore()
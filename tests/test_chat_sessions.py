@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+import respx
+from httpx import AsyncClient, ASGITransport, Response
+
+from src.app.clients import ollama
+from src.app.core import sessions
+from src.app.core.sessions import SessionStore
+from src.app.main import app
+
+NODE = "http://ollama-sess:11434"
+
+
+@pytest.fixture
+def one_node():
+    original = ollama.pool
+    ollama.configure_backends([NODE])
+    yield
+    ollama.pool = original
+
+
+@pytest.mark.asyncio
+async def test_store_lru_per_tenant_and_context_overflow():
+    store = SessionStore(ttl=60, max_per_tenant=2, max_context_tokens=4)
+    await store.save("t1", "a", "m", [1], turns=1)
+    await store.save("t1", "b", "m", [2], turns=1)
+    await store.save("t2", "x", "m", [3], turns=1)
+    # 访问 a 使其变为最近使用，b 将被淘汰
+    assert (await store.get("t1", "a")).context == [1]
+    await store.save("t1", "c", "m", [4], turns=1)
+    assert await store.get("t1", "b") is None
+    assert store.count("t1") == 2 and store.count("t2") == 1
+
+    state = await store.save("t1", "a", "m", [1, 2, 3, 4, 5], turns=2)
+    assert state.context == []
+
+
+@pytest.mark.asyncio
+async def test_store_ttl_expiry():
+    store = SessionStore(ttl=10, max_per_tenant=5, max_context_tokens=0)
+    state = await store.save("t", "s", "m", [1, 2], turns=1)
+    state.updated_at -= 11
+    assert await store.get("t", "s") is None
+    assert store.count("t") == 0
+
+
+@pytest.mark.asyncio
+async def test_store_sweeps_expired_sessions_of_other_tenants():
+    store = SessionStore(ttl=10, max_per_tenant=5, max_context_tokens=0)
+    state = await store.save("idle", "s", "m", [1], turns=1)
+    state.updated_at -= 11
+    store._last_sweep -= 11
+    assert await store.get("busy", "x") is None
+    assert store.count("idle") == 0 and "idle" not in store._sessions
+
+
+@pytest.mark.asyncio
+async def test_session_lock_serializes_and_is_released():
+    store = SessionStore(ttl=60, max_per_tenant=5, max_context_tokens=0)
+    order = []
+
+    async def turn(tag):
+        async with store.lock("t", "s"):
+            order.append(f"{tag}+")
+            await asyncio.sleep(0.01)
+            order.append(f"{tag}-")
+
+    await asyncio.gather(turn("a"), turn("b"))
+    assert order == ["a+", "a-", "b+", "b-"]
+    # 无人持有或等待时锁表为空，未知会话 ID 不会累积锁
+    assert store._locks == {}
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_session_turns_reuse_returned_context(one_node):
+    sent = []
+
+    def _generate(request):
+        body = json.loads(request.content)
+        sent.append(body)
+        return Response(200, json={"response": f"turn{len(sent)}", "done": True, "context": [len(sent)] * 3, "eval_count": 2, "eval_duration": 1_000_000})
+
+    respx.post(f"{NODE}/api/generate").mock(side_effect=_generate)
+    await sessions.store.delete("_anon_", "s-ctx")
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r1 = await client.post("/chat/sessions/s-ctx/messages", json={"prompt": "hi", "model": "m"})
+        r2 = await client.post("/chat/sessions/s-ctx/messages", json={"prompt": "and then?", "model": "m"})
+        info = await client.get("/chat/sessions/s-ctx")
+        deleted = await client.delete("/chat/sessions/s-ctx")
+        missing = await client.get("/chat/sessions/s-ctx")
+
+    assert r1.json()["context_reused"] is False
+    assert "context" not in sent[0]
+    assert sent[1]["context"] == [1, 1, 1]
+    assert r2.json()["turns"] == 2 and r2.json()["context_reused"] is True
+    assert info.json()["context_tokens"] == 3
+    assert deleted.json()["deleted"] is True
+    assert missing.status_code == 404
@@ -0,0 +1,75 @@
+import pytest
+from qdrant_client.http import models as qmodels
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+from src.app.clients import qdrant as qcli
+
+
+class _FakeClient:
+    def __init__(self, info=None):
+        self.info = info
+        self.calls = 0
+
+    async def get_collection(self, collection_name):
+        self.calls += 1
+        if self.info is None:
+            raise UnexpectedResponse(404, "Not Found", b"{}", None)
+        return self.info
+
+
+def _info(size: int):
+    return qmodels.CollectionInfo(
+        status=qmodels.CollectionStatus.GREEN,
+        optimizer_status=qmodels.OptimizersStatusOneOf.OK,
+        segments_count=1,
+        config=qmodels.CollectionConfig(
+            params=qmodels.CollectionParams(vectors=qmodels.VectorParams(size=size, distance=qmodels.Distance.COSINE)),
+            hnsw_config=qmodels.HnswConfig(m=16, ef_construct=100, full_scan_threshold=10000),
+            optimizer_config=qmodels.OptimizersConfig(
+                deleted_threshold=0.2,
+                vacuum_min_vector_number=1000,
+                default_segment_number=0,
+                flush_interval_sec=5,
+            ),
+            wal_config=qmodels.WalConfig(wal_capacity_mb=32, wal_segments_ahead=0),
+        ),
+        payload_schema={"tenant": qmodels.PayloadIndexInfo(data_type=qmodels.PayloadSchemaType.KEYWORD, points=0)},
+    )
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    client = _FakeClient(_info(8))
+    monkeypatch.setattr(qcli, "get_async_client", lambda: client)
+    qcli.catalog.invalidate()
+    yield client
+    qcli.catalog.invalidate()
+
+
+@pytest.mark.asyncio
+async def test_metadata_is_cached(fake):
+    meta = await qcli.describe_collection("docs")
+    assert meta.exists and meta.vector_size == 8
+    assert meta.distance == "Cosine"
+    assert meta.payload_indexes == {"tenant": "keyword"}
+    assert await qcli.collection_exists("docs")
+    assert fake.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_missing_collection_is_negatively_cached(fake):
+    fake.info = None
+    assert not await qcli.collection_exists("nope")
+    assert not await qcli.collection_exists("nope")
+    assert fake.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidate_refetches_and_bumps_version(fake):
+    await qcli.describe_collection("docs")
+    v0 = qcli.catalog.version("docs")
+    fake.info = _info(16)
+    qcli.catalog.invalidate("docs")
+    assert (await qcli.describe_collection("docs")).vector_size == 16
+    assert fake.calls == 2
+    assert qcli.catalog.version("docs") == v0 + 1
@@ -0,0 +1,57 @@
+from qdrant_client.http import models as qmodels
+
+from src.app.core import context_packer as cp
+
+
+def _pt(pid, score, text, vector=None):
+    return qmodels.ScoredPoint(id=pid, version=0, score=score, payload={"text": text}, vector=vector)
+
+
+def test_token_estimate_and_truncation():
+    assert cp.estimate_tokens("重置密码") == 4
+    assert cp.estimate_tokens("reset password") == 4
+    cut = cp.truncate_to_tokens("一二三四五六七八九十", 4)
+    assert cut == "一二三四"
+    assert cp.estimate_tokens(cut) <= 4
+
+
+def test_near_duplicates_are_suppressed():
+    base = "登录页面点击忘记密码，按提示输入注册邮箱即可收到重置链接。"
+    scored = [
+        _pt(1, 0.95, base),
+        _pt(2, 0.94, base + "。"),
+        _pt(3, 0.80, "账号被锁定时请联系管理员解锁，通常五分钟内处理。"),
+    ]
+    contexts, sources = cp.pack_contexts(scored, max_docs=3, max_tokens=500, per_doc_max_tokens=200)
+    assert [s["id"] for s in sources] == [1, 3]
+    assert contexts[0] == base
+
+
+def test_mmr_prefers_diverse_second_passage():
+    scored = [
+        _pt(1, 0.90, "A 方案说明：步骤一", vector=[1.0, 0.0]),
+        _pt(2, 0.89, "A 方案补充：步骤二", vector=[0.99, 0.01]),
+        _pt(3, 0.85, "B 方案说明：另一条路径", vector=[0.0, 1.0]),
+    ]
+    _, sources = cp.pack_contexts(scored, max_docs=2, max_tokens=500, per_doc_max_tokens=200, mmr_lambda=0.5)
+    assert [s["id"] for s in sources] == [1, 3]
+
+
+def test_total_token_budget_is_respected():
+    long_text = "字" * 300
+    scored = [_pt(i, 1.0 - i * 0.01, long_text + str(i)) for i in range(3)]
+    contexts, _ = cp.pack_contexts(scored, max_docs=3, max_tokens=240, per_doc_max_tokens=160)
+    assert sum(cp.estimate_tokens(c) for c in contexts) <= 240
+
+
+def test_euclid_scores_pack_closest_passage_first():
+    # Euclid 分数是距离：0.2 最近，3.5 最远
+    scored = [
+        _pt(1, 0.2, "最近：登录页点击忘记密码即可重置。"),
+        _pt(2, 1.1, "较近：账号锁定请联系管理员。"),
+        _pt(3, 3.5, "最远：发票在订单详情页申请。"),
+    ]
+    _, sources = cp.pack_contexts(scored, max_docs=1, max_tokens=500, per_doc_max_tokens=200, distance="Euclid")
+    assert [s["id"] for s in sources] == [1]
+    _, sources = cp.pack_contexts(list(reversed(scored)), max_docs=3, max_tokens=500, per_doc_max_tokens=200, distance="Manhattan")
+    assert [s["id"] for s in sources] == [1, 2, 3]
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from src.app.core.deadline import Deadline, DeadlineExceeded
+
+
+def _request(headers):
+    scope = {"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+    return Request(scope)
+
+
+def test_budget_from_header_overrides_setting():
+    dl = Deadline.from_request(_request({"X-Request-Deadline-Ms": "250"}), endpoint="ask")
+    assert dl.budget == pytest.approx(0.25)
+    assert dl.clip(300.0) <= 0.25
+    assert Deadline.from_request(_request({"X-Request-Deadline-Ms": "0"}), endpoint="ask").remaining() is None
+
+
+@pytest.mark.asyncio
+async def test_stage_is_cut_off_when_budget_runs_out():
+    dl = Deadline(0.05, endpoint="test")
+    with pytest.raises(DeadlineExceeded) as ei:
+        await dl.run(asyncio.sleep(1.0), "generate", timeout=300.0)
+    assert ei.value.stage == "generate"
+    assert dl.meta()["exceeded_stage"] == "generate"
+    # 预算耗尽后不再启动新的阶段
+    with pytest.raises(DeadlineExceeded):
+        await dl.run(asyncio.sleep(0), "embed")
+    assert dl.meta()["exceeded_stage"] == "generate"
+
+
+@pytest.mark.asyncio
+async def test_backoff_is_skipped_when_budget_cannot_cover_it():
+    dl = Deadline(0.05, endpoint="test")
+    assert await dl.backoff(8.0, "embed") is False
+    assert dl.exceeded_stage == "embed"
+
+
+@pytest.mark.asyncio
+async def test_stage_timeout_within_budget_is_plain_timeout():
+    dl = Deadline(5.0, endpoint="test")
+    with pytest.raises(asyncio.TimeoutError):
+        await dl.run(asyncio.sleep(1.0), "retrieve", timeout=0.01)
+    assert dl.exceeded_stage is None
@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+import pytest
+import respx
+from httpx import Response
+
+from src.app.config import settings
+from src.app.core.embed_batcher import EmbedBatcher
+
+BASE = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}"
+
+
+def _handler(calls):
+    def _h(request):
+        body = json.loads(request.content)
+        calls.append(body["input"])
+        return Response(200, json={"embeddings": [[float(t.split("-")[1])] for t in body["input"]]})
+
+    return _h
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_callers_share_one_batch():
+    calls = []
+    respx.post(f"{BASE}/api/embed").mock(side_effect=_handler(calls))
+    batcher = EmbedBatcher(max_wait_ms=20, max_items=32)
+
+    results = await asyncio.gather(*[batcher.embed([f"q-{i}"], "m") for i in range(5)])
+    assert results == [[[float(i)]] for i in range(5)]
+    assert len(calls) == 1 and len(calls[0]) == 5
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_full_batch_flushes_without_waiting():
+    calls = []
+    respx.post(f"{BASE}/api/embed").mock(side_effect=_handler(calls))
+    batcher = EmbedBatcher(max_wait_ms=10_000, max_items=2)
+
+    r = await asyncio.wait_for(asyncio.gather(batcher.embed(["q-1"], "m"), batcher.embed(["q-2"], "m")), timeout=1.0)
+    assert r == [[[1.0]], [[2.0]]]
+    assert calls == [["q-1", "q-2"]]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_upstream_error_reaches_every_caller():
+    respx.post(f"{BASE}/api/embed").mock(return_value=Response(500, text="boom"))
+    batcher = EmbedBatcher(max_wait_ms=5, max_items=32)
+
+    results = await asyncio.gather(*[batcher.embed([f"q-{i}"], "m") for i in range(3)], return_exceptions=True)
+    assert all(isinstance(r, Exception) for r in results)
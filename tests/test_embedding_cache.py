@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import pytest
+import respx
+from httpx import Response
+
+from src.app.config import settings
+from src.app.core import embedding_cache as ec
+
+BASE = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}"
+
+
+@pytest.fixture
+def cache():
+    return ec.EmbeddingCache(max_entries=2)
+
+
+def _handler(calls):
+    async def _h(request):
+        body = json.loads(request.content)
+        calls.append(body["input"])
+        await asyncio.sleep(0.02)
+        return Response(200, json={"embeddings": [[float(len(t)), 0.5] for t in body["input"]]})
+
+    return _h
+
+
+def test_vectors_roundtrip_as_float32():
+    raw = ec.encode_vector([0.25, -1.5, 3.0])
+    assert len(raw) == 12
+    assert ec.decode_vector(raw) == [0.25, -1.5, 3.0]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_repeated_and_normalized_text_is_served_from_cache(cache):
+    calls = []
+    respx.post(f"{BASE}/api/embed").mock(side_effect=_handler(calls))
+
+    v1 = await cache.embed(["how to reset password"], model="m")
+    v2 = await cache.embed(["  how to   reset password "], model="m")
+    assert v1 == v2 == [[21.0, 0.5]]
+    assert len(calls) == 1
+    # 不同模型不共享缓存
+    await cache.embed(["how to reset password"], model="other")
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_identical_queries_embed_once(cache):
+    calls = []
+    respx.post(f"{BASE}/api/embed").mock(side_effect=_handler(calls))
+
+    results = await asyncio.gather(*[cache.embed(["q", "q"], model="m") for _ in range(3)])
+    assert all(r == [[1.0, 0.5], [1.0, 0.5]] for r in results)
+    assert calls == [["q"]]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_lru_eviction_and_model_invalidation(cache):
+    calls = []
+    respx.post(f"{BASE}/api/embed").mock(side_effect=_handler(calls))
+
+    await cache.embed(["a", "b", "c"], model="m")
+    assert len(cache) == 2
+    assert await cache.invalidate("m") == 2
+    assert len(cache) == 0
+    await cache.embed(["c"], model="m")
+    assert len(calls) == 2
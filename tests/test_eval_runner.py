@@ -0,0 +1,136 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from src.app.core import admin_store
+from src.app.core.eval_runner import EvalRunner, check_answer, percentiles
+from src.app.main import app
+from src.app.routers import admin
+
+
+def _item(query, expected=None, check_type=None):
+    return SimpleNamespace(query=query, expected_answer=expected, check_type=check_type)
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = admin_store.SQLiteAdminStore(str(tmp_path / "admin.db"))
+    admin_store.set_store(store)
+    yield store
+    admin_store.set_store(None)
+    asyncio.run(store.close())
+
+
+def _recorder(updates):
+    async def on_progress(status, metrics):
+        updates.append((status, metrics))
+    return on_progress
+
+
+def test_check_answer_and_percentiles():
+    assert check_answer("请在设置页重置密码", "重置密码", None) is True
+    assert check_answer("abc", "ABC", "exact") is False
+    assert check_answer("order #123", r"#\d+", "regex") is True
+    assert check_answer("anything", None, None) is None
+    assert percentiles([float(i) for i in range(1, 101)]) == {"p50": 50.0, "p95": 95.0, "p99": 99.0}
+
+
+@pytest.mark.asyncio
+async def test_run_reports_accuracy_latency_and_respects_concurrency():
+    runner = EvalRunner(workers=8, per_run_concurrency=2, progress_interval=0.0)
+    in_flight = {"now": 0, "max": 0}
+    updates = []
+
+    async def execute(item):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.01)
+        in_flight["now"] -= 1
+        if item.query == "boom":
+            raise RuntimeError("upstream down")
+        return f"answer to {item.query}", {"embed": 1.0, "retrieve": 2.0, "generate": 5.0}
+
+    items = [_item("a", "answer to a"), _item("b", "nope"), _item("c"), _item("boom", "x")]
+    runner.start("r1", items, execute, _recorder(updates))
+    await runner.wait("r1")
+
+    status, metrics = updates[-1]
+    assert status == "completed"
+    assert in_flight["max"] == 2
+    assert (metrics["completed"], metrics["passed"], metrics["failed"], metrics["errors"]) == (4, 1, 2, 1)
+    assert metrics["accuracy"] == pytest.approx(1 / 3)
+    assert metrics["latency_ms"]["generate"]["p50"] == 5.0
+    assert metrics["latency_ms"]["total"]["p99"] is not None
+    assert metrics["throughput_items_per_s"] > 0
+    assert metrics["failures"][-1]["error"] == "RuntimeError: upstream down"
+    assert not runner.is_running("r1")
+
+
+@pytest.mark.asyncio
+async def test_cancel_records_partial_progress():
+    runner = EvalRunner(workers=1, per_run_concurrency=1, progress_interval=0.0)
+    updates = []
+
+    async def execute(item):
+        await asyncio.sleep(0.02 if item.query == "fast" else 5)
+        return "ok", {}
+
+    runner.start("r2", [_item("fast"), _item("slow"), _item("slow")], execute, _recorder(updates))
+    await asyncio.sleep(0.1)
+    assert runner.cancel("r2")
+    await runner.wait("r2")
+    status, metrics = updates[-1]
+    assert status == "cancelled" and metrics["completed"] == 1
+    assert not runner.cancel("r2")
+
+
+@pytest.mark.asyncio
+async def test_eval_run_api_runs_in_background(monkeypatch, sqlite_store):
+    def fake_executor(cfg):
+        async def execute(item):
+            return "在设置页点击忘记密码", {"embed": 1.0}
+        return execute
+
+    monkeypatch.setattr(admin, "_ask_executor", fake_executor)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        ev = (await client.post("/api/v1/admin/evals", json={"name": "faq"})).json()
+        await client.post(f"/api/v1/admin/evals/{ev['id']}/import", json={"items": [
+            {"query": "忘记密码", "expected_answer": "忘记密码"},
+            {"query": "发票", "expected_answer": "开票"},
+        ]})
+        run = (await client.post(f"/api/v1/admin/evals/{ev['id']}/runs", json={"concurrency": 2})).json()
+        assert run["status"] == "queued"
+        await admin.runner.wait(run["id"])
+        done = (await client.get(f"/api/v1/admin/eval-runs/{run['id']}")).json()
+        await client.delete(f"/api/v1/admin/evals/{ev['id']}")
+
+    assert done["status"] == "completed"
+    assert done["metrics"]["accuracy"] == 0.5
+    assert done["metrics"]["latency_ms"]["embed"]["p50"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_delete_eval_cancels_its_running_runs(monkeypatch, sqlite_store):
+    started = asyncio.Event()
+
+    def slow_executor(cfg):
+        async def execute(item):
+            started.set()
+            await asyncio.sleep(30)
+            return "", {}
+        return execute
+
+    monkeypatch.setattr(admin, "_ask_executor", slow_executor)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        ev = (await client.post("/api/v1/admin/evals", json={"name": "slow"})).json()
+        await client.post(f"/api/v1/admin/evals/{ev['id']}/import", json={"items": [{"query": "q"}]})
+        run = (await client.post(f"/api/v1/admin/evals/{ev['id']}/runs", json={})).json()
+        await asyncio.wait_for(started.wait(), 5)
+        assert (await client.delete(f"/api/v1/admin/evals/{ev['id']}")).status_code == 200
+        assert not admin.runner.is_running(run["id"])
+        # 取消后的进度写入发生在删除之前，运行记录不会被写回
+        assert (await client.get(f"/api/v1/admin/eval-runs/{run['id']}")).status_code == 404
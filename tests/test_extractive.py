@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from prometheus_client import REGISTRY
+
+from src.app.clients import ollama
+from src.app.clients import qdrant as qcli
+from src.app.core import extractive, rag_pipeline
+from src.app.main import app
+
+POLICY = qcli.ExtractivePolicy(min_score=0.9, answer_field="answer")
+
+
+def _point(score, payload):
+    return SimpleNamespace(id="p1", score=score, payload=payload)
+
+
+def test_decide_requires_score_and_answer_field():
+    hit = _point(0.95, {"text": "如何重置密码？", "answer": " 在设置页点击“忘记密码”。 "})
+    decision, answer = extractive.decide([hit], POLICY)
+    assert decision == "answered" and answer.answer == "在设置页点击“忘记密码”。"
+    assert extractive.decide([_point(0.5, hit.payload)], POLICY) == ("below_threshold", None)
+    assert extractive.decide([_point(0.99, {"text": "x"})], POLICY) == ("no_field", None)
+    assert extractive.decide([], POLICY) == ("no_match", None)
+
+
+def test_decide_refuses_distance_metrics():
+    hit = _point(0.95, {"answer": "a"})
+    assert extractive.decide([hit], POLICY, "Cosine")[0] == "answered"
+    assert extractive.decide([hit], POLICY, "Dot")[0] == "answered"
+    # Euclid/Manhattan 分数越小越相似：低距离不能被当作低分拒绝，高距离也不能被当作高分放行
+    assert extractive.decide([_point(5.0, {"answer": "a"})], POLICY, "Euclid") == ("unsupported_distance", None)
+    assert extractive.decide([_point(0.01, {"answer": "a"})], POLICY, "Manhattan") == ("unsupported_distance", None)
+
+
+def test_catalog_overrides_from_settings_json():
+    overrides = qcli._extractive_overrides('{"faq": 0.8, "kb": {"min_score": 0.7, "answer_field": "a"}, "bad": "x"}')
+    assert overrides["faq"].min_score == 0.8 and overrides["faq"].answer_field == "answer"
+    assert overrides["kb"].answer_field == "a"
+    assert "bad" not in overrides
+    assert qcli._extractive_overrides("not json") == {}
+
+
+@pytest.fixture
+def faq_collection(monkeypatch):
+    async def describe(name):
+        return qcli.CollectionMeta(name=name, exists=True, vector_size=2)
+
+    async def embeddings(texts, model=None):
+        return [[1.0, 0.0]]
+
+    async def search_vectors(coll, *, query, top_k, filters, with_vectors=False):
+        return [_point(0.93, {"text": "如何重置密码？", "answer": "在设置页点击“忘记密码”。"})]
+
+    calls = []
+
+    async def generate(prompt, model=None, **kw):
+        calls.append(prompt)
+        return {"response": "LLM 回答", "done": True}
+
+    monkeypatch.setattr(qcli, "describe_collection", describe)
+    monkeypatch.setattr(rag_pipeline.embedding_cache, "embeddings", embeddings)
+    monkeypatch.setattr(qcli, "search_vectors", search_vectors)
+    monkeypatch.setattr(ollama, "generate", generate)
+    yield calls
+    qcli.catalog.set_extractive_policy("faq_x", None)
+
+
+@pytest.mark.asyncio
+async def test_chat_rag_extractive_skips_llm_until_threshold_raised(faq_collection):
+    before = REGISTRY.get_sample_value(
+        "rag_extractive_decisions_total", {"endpoint": "chat_rag", "collection": "faq_x", "decision": "answered"}
+    ) or 0.0
+    body = {"query": "忘记密码怎么办", "collection": "faq_x", "answer_mode": "extractive"}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        fast = await client.post("/chat/rag", json=body)
+        put = await client.put("/collections/faq_x/extractive", json={"min_score": 0.95})
+        slow = await client.post("/chat/rag", json=body)
+        plain = await client.post("/chat/rag", json={"query": "忘记密码怎么办", "collection": "faq_x"})
+
+    assert fast.json()["response"] == "在设置页点击“忘记密码”。"
+    assert fast.json()["meta"]["answer_mode"] == "extractive"
+    assert put.json() == {"name": "faq_x", "min_score": 0.95, "answer_field": "answer"}
+    assert slow.json()["response"] == "LLM 回答"
+    assert plain.json()["response"] == "LLM 回答"
+    assert len(faq_collection) == 2
+    assert REGISTRY.get_sample_value(
+        "rag_extractive_decisions_total", {"endpoint": "chat_rag", "collection": "faq_x", "decision": "below_threshold"}
+    ) == 1.0
+    assert REGISTRY.get_sample_value(
+        "rag_extractive_decisions_total", {"endpoint": "chat_rag", "collection": "faq_x", "decision": "answered"}
+    ) == before + 1
+
+
+@pytest.mark.asyncio
+async def test_chat_rag_extractive_falls_back_for_euclid_collection(faq_collection, monkeypatch):
+    async def describe(name):
+        return qcli.CollectionMeta(name=name, exists=True, vector_size=2, distance="Euclid")
+
+    monkeypatch.setattr(qcli, "describe_collection", describe)
+    body = {"query": "忘记密码怎么办", "collection": "faq_x", "answer_mode": "extractive"}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        resp = await client.post("/chat/rag", json=body)
+
+    assert resp.json()["response"] == "LLM 回答"
+    assert len(faq_collection) == 1
+    assert REGISTRY.get_sample_value(
+        "rag_extractive_decisions_total", {"endpoint": "chat_rag", "collection": "faq_x", "decision": "unsupported_distance"}
+    ) == 1.0
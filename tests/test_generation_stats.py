@@ -0,0 +1,65 @@
+import json
+
+import pytest
+import respx
+from httpx import Response
+from prometheus_client import REGISTRY
+
+from src.app.clients import ollama
+from src.app.core import generation_stats
+
+NODE = "http://ollama-stats:11434"
+
+FINAL = {
+    "response": "",
+    "done": True,
+    "prompt_eval_count": 42,
+    "prompt_eval_duration": 120_000_000,
+    "eval_count": 20,
+    "eval_duration": 500_000_000,
+    "load_duration": 30_000_000,
+    "total_duration": 700_000_000,
+}
+
+
+@pytest.fixture
+def one_node():
+    original = ollama.pool
+    ollama.configure_backends([NODE])
+    yield
+    ollama.pool = original
+
+
+def test_parse_final_frame():
+    stats = generation_stats.parse(FINAL)
+    assert stats["prompt_tokens"] == 42
+    assert stats["completion_tokens"] == 20
+    assert stats["eval_ms"] == 500.0
+    assert stats["tokens_per_second"] == 40.0
+    # 服务端 TTFT 估计 = load + prompt_eval
+    assert stats["ttft_ms"] == 150.0
+    assert generation_stats.parse({"response": "x"}) == {}
+
+
+def test_observe_feeds_histograms():
+    labels = {"model": "m-obs", "endpoint": "ask"}
+    generation_stats.observe(generation_stats.parse(FINAL), model="m-obs", endpoint="ask")
+    assert REGISTRY.get_sample_value("llm_completion_tokens_sum", labels) == 20.0
+    assert REGISTRY.get_sample_value("llm_prompt_tokens_sum", labels) == 42.0
+    assert REGISTRY.get_sample_value("llm_decode_tokens_per_second_count", labels) == 1.0
+    assert REGISTRY.get_sample_value("llm_time_to_first_token_seconds_sum", labels) == pytest.approx(0.15)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_generate_stream_fills_stats_from_final_frame(one_node):
+    body = "\n".join(json.dumps(o) for o in [{"response": "he", "done": False}, {"response": "llo", "done": False}, FINAL])
+    respx.post(f"{NODE}/api/generate").mock(return_value=Response(200, text=body))
+
+    stats = {}
+    chunks = [c async for c in ollama.generate_stream("q", model="m", stats=stats)]
+    assert chunks == ["he", "llo"]
+    assert stats["completion_tokens"] == 20
+    assert stats["tokens_per_second"] == 40.0
+    # 流式 TTFT 为客户端实测值，而非服务端估计
+    assert stats["ttft_ms"] != 150.0
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from src.app.core.hedging import HedgePolicy, _wasted_tokens, hedged_first_chunk
+
+
+def _gen(delay, chunks, closed=None):
+    async def g():
+        try:
+            await asyncio.sleep(delay)
+            for c in chunks:
+                yield c
+        finally:
+            if closed is not None:
+                closed.set()
+    return g()
+
+
+def _count(endpoint, result):
+    return REGISTRY.get_sample_value("llm_hedge_total", {"endpoint": endpoint, "result": result}) or 0.0
+
+
+def test_delay_uses_ttft_quantile_after_min_samples():
+    pol = HedgePolicy(min_samples=5, default_delay_ms=1000, min_delay_ms=10, quantile=0.8, first_token_timeout_ms=5000)
+    assert pol.delay() == 1.0
+    for s in (0.1, 0.2, 0.3, 0.4, 0.5):
+        pol.observe_ttft(s)
+    assert pol.delay() == pytest.approx(0.4)
+
+
+def test_hedge_ratio_cap():
+    pol = HedgePolicy(max_ratio=0.5)
+    assert pol.allow_hedge()
+    pol.record(True)
+    assert not pol.allow_hedge()
+    pol.record(False)
+    pol.record(False)
+    assert pol.allow_hedge()
+    assert not HedgePolicy(enabled=False).allow_hedge()
+
+
+@pytest.mark.asyncio
+async def test_fast_primary_never_starts_hedge():
+    pol = HedgePolicy(default_delay_ms=200, min_delay_ms=0)
+    started = []
+
+    def make_hedge():
+        started.append(1)
+        return _gen(0, ["h"])
+
+    before = _count("t_fast", "not_hedged")
+    winner, gen, first = await hedged_first_chunk(_gen(0, ["p1", "p2"]), make_hedge, endpoint="t_fast", hedge_policy=pol)
+    assert (winner, first) == ("primary", "p1")
+    assert [c async for c in gen] == ["p2"]
+    assert not started
+    assert _count("t_fast", "not_hedged") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_loser_closed():
+    pol = HedgePolicy(default_delay_ms=30, min_delay_ms=0, first_token_timeout_ms=2000)
+    primary_closed = asyncio.Event()
+    winner, gen, first = await hedged_first_chunk(
+        _gen(1.0, ["p"], primary_closed), lambda: _gen(0, ["h"]), endpoint="t_slow", hedge_policy=pol,
+    )
+    assert (winner, first) == ("hedge", "h")
+    assert primary_closed.is_set()
+    assert _count("t_slow", "hedge_won") == 1.0
+    # 败者尚未产出首包，不计入 losers_with_output
+    assert (REGISTRY.get_sample_value("llm_hedge_losers_with_output_total", {"endpoint": "t_slow"}) or 0.0) == 0.0
+    await gen.aclose()
+
+
+@pytest.mark.asyncio
+async def test_capped_hedge_waits_for_primary_until_timeout():
+    pol = HedgePolicy(default_delay_ms=10, min_delay_ms=0, max_ratio=0.0, first_token_timeout_ms=100)
+    closed = asyncio.Event()
+    winner, gen, first = await hedged_first_chunk(_gen(1.0, ["p"], closed), lambda: _gen(0, ["h"]), endpoint="t_cap", hedge_policy=pol)
+    assert winner is None and gen is None
+    assert closed.is_set()
+    assert _count("t_cap", "no_first_token") == 1.0
+
+
+def _wasted(endpoint):
+    return REGISTRY.get_sample_value("llm_hedge_wasted_tokens_total", {"endpoint": endpoint}) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_loser_counts_prompt_tokens_as_wasted():
+    pol = HedgePolicy(default_delay_ms=30, min_delay_ms=0, first_token_timeout_ms=2000)
+    winner, gen, _ = await hedged_first_chunk(
+        _gen(1.0, ["p"]), lambda: _gen(0, ["h"]), endpoint="t_waste", hedge_policy=pol,
+        prompt_tokens={"primary": 50, "hedge": 5},
+    )
+    assert winner == "hedge"
+    # 主请求尚未出首包：只浪费了提示词（按估算）
+    assert _wasted("t_waste") == 50.0
+    await gen.aclose()
+
+    winner, gen, _ = await hedged_first_chunk(
+        _gen(1.0, ["p"]), lambda: _gen(0, ["h"]), endpoint="t_waste_final",
+        hedge_policy=HedgePolicy(default_delay_ms=30, min_delay_ms=0, first_token_timeout_ms=2000),
+        prompt_tokens={"primary": 50}, stats={"primary": {"prompt_tokens": 42}},
+    )
+    # 终帧的 prompt_eval_count 优先于估算
+    assert _wasted("t_waste_final") == 42.0
+    await gen.aclose()
+
+
+@pytest.mark.asyncio
+async def test_wasted_tokens_include_streamed_chunks():
+    loop = asyncio.get_running_loop()
+    streamed = loop.create_future()
+    streamed.set_result("chunk")
+    assert _wasted_tokens(streamed, {}, 30) == 31
+    assert _wasted_tokens(streamed, {"prompt_tokens": 20, "completion_tokens": 3}, 30) == 23
+    failed = loop.create_future()
+    failed.set_exception(RuntimeError("backend down"))
+    assert _wasted_tokens(failed, {}, 30) == 0
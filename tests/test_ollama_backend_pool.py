@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+import respx
+from httpx import Response
+
+from src.app.clients import ollama
+
+NODE_A = "http://ollama-a:11434"
+NODE_B = "http://ollama-b:11434"
+
+
+@pytest.fixture
+def two_nodes():
+    original = ollama.pool
+    pool = ollama.configure_backends([NODE_A, "ollama-b:11434"])
+    yield pool
+    ollama.pool = original
+    ollama.registry.invalidate()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_routes_to_least_outstanding_backend(two_nodes):
+    release = asyncio.Event()
+
+    async def _slow(request):
+        await release.wait()
+        return Response(200, json={"response": "a"})
+
+    route_a = respx.post(f"{NODE_A}/api/generate").mock(side_effect=_slow)
+    route_b = respx.post(f"{NODE_B}/api/generate").mock(return_value=Response(200, json={"response": "b"}))
+
+    # 让首个请求固定落在 A 并保持挂起
+    two_nodes._rr = -1
+    slow = asyncio.create_task(ollama.generate("q", model="m"))
+    await asyncio.sleep(0.01)
+    assert two_nodes.backends[0].inflight == 1
+
+    # A 有未完成请求时，后续请求都应路由到 B
+    for _ in range(3):
+        r = await ollama.generate("q", model="m")
+        assert r["response"] == "b"
+    assert route_b.call_count == 3
+
+    release.set()
+    await slow
+    assert route_a.call_count == 1
+    assert all(b.inflight == 0 for b in two_nodes.backends)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_model_aware_routing_prefers_loaded_node(two_nodes):
+    ollama.registry.mark_available("m", NODE_B, loaded=True)
+    route_a = respx.post(f"{NODE_A}/api/generate").mock(return_value=Response(200, json={"response": "a"}))
+    route_b = respx.post(f"{NODE_B}/api/generate").mock(return_value=Response(200, json={"response": "b"}))
+
+    for _ in range(4):
+        await ollama.generate("q", model="m")
+    assert route_b.call_count == 4
+    assert route_a.call_count == 0
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_failing_node_is_ejected(two_nodes):
+    route_a = respx.post(f"{NODE_A}/api/generate").mock(return_value=Response(500, text="boom"))
+    respx.post(f"{NODE_B}/api/generate").mock(return_value=Response(200, json={"response": "b"}))
+
+    node_a = two_nodes.backends[0]
+    for _ in range(two_nodes.fail_threshold):
+        two_nodes._rr = -1  # 强制选中 A
+        with pytest.raises(Exception):
+            await ollama.generate("q", model="m")
+    assert not node_a.is_healthy()
+
+    calls_before = route_a.call_count
+    for _ in range(4):
+        r = await ollama.generate("q", model="m")
+        assert r["response"] == "b"
+    assert route_a.call_count == calls_before
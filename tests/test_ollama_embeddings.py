@@ -0,0 +1,72 @@
+import json
+
+import pytest
+import respx
+from httpx import Response
+
+from src.app.clients import ollama
+from src.app.config import settings
+
+BASE = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}"
+
+
+@pytest.fixture(autouse=True)
+def _reset_embed_support():
+    ollama._EMBED_API_SUPPORT.clear()
+    yield
+    ollama._EMBED_API_SUPPORT.clear()
+
+
+def _vec(text: str):
+    # 以文本内容构造可区分的“向量”，便于校验顺序
+    return [float(len(text)), float(int(text.split("-")[1]))]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_embed_batches_preserve_order():
+    calls = []
+
+    def _handler(request):
+        body = json.loads(request.content)
+        calls.append(body["input"])
+        return Response(200, json={"embeddings": [_vec(t) for t in body["input"]]})
+
+    respx.post(f"{BASE}/api/embed").mock(side_effect=_handler)
+
+    texts = [f"t-{i}" for i in range(10)]
+    vecs = await ollama.embeddings(texts, model="m", batch_size=3, concurrency=2)
+
+    assert vecs == [_vec(t) for t in texts]
+    # 10 条按 3 条一批切分为 4 个子批次
+    assert sorted(len(c) for c in calls) == [1, 3, 3, 3]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_embed_falls_back_to_per_text_endpoint():
+    batch_route = respx.post(f"{BASE}/api/embed").mock(return_value=Response(404, text="404 page not found"))
+
+    def _handler(request):
+        body = json.loads(request.content)
+        return Response(200, json={"embedding": _vec(body["prompt"])})
+
+    single_route = respx.post(f"{BASE}/api/embeddings").mock(side_effect=_handler)
+
+    texts = [f"t-{i}" for i in range(4)]
+    vecs = await ollama.embeddings(texts, model="m", batch_size=2, concurrency=1)
+    assert vecs == [_vec(t) for t in texts]
+    assert single_route.call_count == 4
+    # 探测到不支持后不再请求 /api/embed
+    assert batch_route.call_count == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_embed_model_not_found_is_not_treated_as_missing_endpoint():
+    respx.post(f"{BASE}/api/embed").mock(
+        return_value=Response(404, json={"error": 'model "m" not found, try pulling it first'})
+    )
+    with pytest.raises(Exception):
+        await ollama.embeddings(["t-1"], model="m")
+    assert BASE not in ollama._EMBED_API_SUPPORT
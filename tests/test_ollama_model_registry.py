@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+import respx
+from httpx import Response
+
+from src.app.clients import ollama
+from src.app.config import settings
+
+BASE = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}"
+
+
+@pytest.fixture(autouse=True)
+def _reset_registry():
+    ollama.registry.invalidate()
+    yield
+    ollama.registry.invalidate()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_listed_model_is_cached_without_pull():
+    tags = respx.get(f"{BASE}/api/tags").mock(return_value=Response(200, json={"models": [{"name": "phi3:mini"}]}))
+    respx.get(f"{BASE}/api/ps").mock(return_value=Response(200, json={"models": []}))
+    pull = respx.post(f"{BASE}/api/pull").mock(return_value=Response(200, json={"status": "success"}))
+
+    assert await ollama.ensure_model("phi3:mini") is True
+    assert await ollama.ensure_model("phi3:mini") is True
+    assert tags.call_count == 1
+    assert pull.call_count == 0
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_waiters_share_one_pull():
+    respx.get(f"{BASE}/api/tags").mock(return_value=Response(200, json={"models": []}))
+    respx.get(f"{BASE}/api/ps").mock(return_value=Response(200, json={"models": []}))
+
+    async def _slow_pull(request):
+        await asyncio.sleep(0.05)
+        return Response(200, json={"status": "success"})
+
+    pull = respx.post(f"{BASE}/api/pull").mock(side_effect=_slow_pull)
+
+    results = await asyncio.gather(*[ollama.ensure_model("nomic-embed-text") for _ in range(5)])
+    assert results == [True] * 5
+    assert pull.call_count == 1
+    # 未带 tag 的模型名按 :latest 归一
+    assert ollama.registry.is_cached("nomic-embed-text:latest")
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_model_not_found_invalidates_entry():
+    ollama.registry.mark_available("phi3:mini")
+    respx.post(f"{BASE}/api/generate").mock(
+        return_value=Response(404, json={"error": 'model "phi3:mini" not found, try pulling it first'})
+    )
+    with pytest.raises(Exception):
+        await ollama.generate("hi", model="phi3:mini")
+    assert not ollama.registry.is_cached("phi3:mini")
@@ -0,0 +1,22 @@
+import inspect
+
+import pytest
+
+from src.app.clients import qdrant as qcli
+
+
+@pytest.mark.asyncio
+async def test_async_client_is_process_singleton():
+    c1 = qcli.get_async_client()
+    c2 = qcli.get_async_client()
+    assert c1 is c2
+    await qcli.close()
+    # 关闭后重新获取会创建新的实例
+    c3 = qcli.get_async_client()
+    assert c3 is not c1
+    await qcli.close()
+
+
+def test_helpers_are_coroutines():
+    for name in ("collection_exists", "search_vectors", "get_collection_info", "ensure_collection", "upsert_vectors"):
+        assert inspect.iscoroutinefunction(getattr(qcli, name)), name
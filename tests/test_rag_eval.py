@@ -0,0 +1,85 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from src.app.clients import ollama
+from src.app.clients import qdrant as qcli
+from src.app.core import rag_eval
+from src.app.main import app
+
+QUERIES = [f"q{i}" for i in range(10)]
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    calls = {"embed": [], "search": []}
+
+    async def describe(name):
+        return qcli.CollectionMeta(name=name, exists=True, vector_size=1)
+
+    async def ensure_model(model):
+        return None
+
+    async def embeddings(texts, model=None):
+        calls["embed"].append(list(texts))
+        return [[float(t[1:])] for t in texts]
+
+    async def search_batch(coll, queries, top_k=5, filters=None, **kw):
+        calls["search"].append(len(queries))
+        # 每个查询 q{i} 命中 [i, i+100]（偶数查询无命中）
+        return [
+            [SimpleNamespace(id=int(v[0]), score=0.9, payload={}), SimpleNamespace(id=int(v[0]) + 100, score=0.5, payload={})]
+            if int(v[0]) % 2 else []
+            for v in queries
+        ]
+
+    monkeypatch.setattr(qcli, "describe_collection", describe)
+    monkeypatch.setattr(ollama, "ensure_model", ensure_model)
+    monkeypatch.setattr(rag_eval.embedding_cache, "embeddings", embeddings)
+    monkeypatch.setattr(qcli, "search_batch", search_batch)
+    return calls
+
+
+def test_score_row_recall_and_reciprocal_rank():
+    scored = [SimpleNamespace(id="a", score=0.9), SimpleNamespace(id=2, score=0.4)]
+    row = rag_eval.score_row(0, "q", scored, expected=["2", "c"])
+    assert row["recall_at_k"] == 0.5 and row["reciprocal_rank"] == 0.5
+    assert rag_eval.score_row(0, "q", scored)["recall_at_k"] is None
+
+
+@pytest.mark.asyncio
+async def test_rag_eval_batches_and_reports_recall(fake_backend):
+    expected = [[i] if i % 2 else None for i in range(10)]
+    expected[1] = [101]
+    body = {"queries": QUERIES, "collection": "kb", "batch_size": 4, "expected_ids": expected}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post("/chat/rag_eval", json=body)
+
+    assert sorted(fake_backend["search"]) == [2, 4, 4]
+    assert len(fake_backend["embed"]) == 3
+    data = r.json()
+    assert [d["query"] for d in data["details"]] == QUERIES
+    s = data["summary"]
+    assert s["total"] == 10 and s["hit_ratio"] == 0.5
+    assert s["labelled"] == 5 and s["recall_at_k"] == 1.0
+    # q1 的期望 ID 排在第二位：MRR = (0.5 + 1 * 4) / 5
+    assert s["mrr"] == pytest.approx(0.9)
+
+
+@pytest.mark.asyncio
+async def test_rag_eval_streams_ndjson_and_csv(fake_backend):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        nd = await client.post("/chat/rag_eval", json={"queries": QUERIES, "collection": "kb", "batch_size": 3, "export": "ndjson"})
+        csv_resp = await client.post("/chat/rag_eval", json={"queries": QUERIES, "collection": "kb", "export": "csv"})
+
+    lines = [json.loads(x) for x in nd.text.strip().splitlines()]
+    assert [x["type"] for x in lines] == ["row"] * 10 + ["summary"]
+    assert sorted(x["index"] for x in lines[:-1]) == list(range(10))
+    assert lines[-1]["hit_ratio"] == 0.5
+    rows = csv_resp.text.strip().splitlines()
+    assert rows[0].startswith("query,has_match,top1_score")
+    assert rows[-2].startswith("collection,total,hit_ratio")
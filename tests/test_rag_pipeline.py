@@ -0,0 +1,139 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from src.app.clients import qdrant as qcli
+from src.app.core import rag_pipeline
+from src.app.core.rag_pipeline import DimensionMismatch, EmbeddingError, RagPipeline
+from src.app.main import app
+
+
+def _pack(scored, distance=None):
+    return [s.payload["text"] for s in scored], [{"id": s.id, "score": s.score} for s in scored]
+
+
+def _prompt(query, contexts):
+    return f"{query}|{'/'.join(contexts)}"
+
+
+def _point(pid, text):
+    return SimpleNamespace(id=pid, score=0.9, payload={"text": text})
+
+
+@pytest.fixture
+def collection_meta(monkeypatch):
+    metas = {}
+
+    async def describe(name):
+        await asyncio.sleep(0.05)
+        return metas.get(name) or qcli.CollectionMeta(name=name, exists=False)
+
+    monkeypatch.setattr(qcli, "describe_collection", describe)
+    return metas
+
+
+@pytest.mark.asyncio
+async def test_run_times_every_stage_and_overlaps_embed_with_collection_check(collection_meta):
+    collection_meta["kb"] = qcli.CollectionMeta(name="kb", exists=True, vector_size=3)
+    seen = {}
+
+    async def embed(texts, model=None):
+        seen["model"] = model
+        await asyncio.sleep(0.05)
+        return [[0.1, 0.2, 0.3]]
+
+    async def search(coll, *, query, top_k, filters, with_vectors):
+        return [_point("a", "alpha"), _point("b", "beta")][:top_k]
+
+    pipe = RagPipeline(collection="kb", top_k=2, pack=_pack, build_prompt=_prompt, embed=embed, search=search)
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    rc = await pipe.run("q")
+    elapsed = loop.time() - t0
+
+    assert rc.exists and rc.prompt == "q|alpha/beta"
+    assert [s["id"] for s in rc.sources] == ["a", "b"]
+    assert seen["model"] == rag_pipeline.embed_model_name()
+    # embed 与集合检查并发：总耗时接近单个阶段而不是两者之和
+    assert elapsed < 0.09
+    timings = pipe.timings.as_dict()
+    assert set(timings) == {"collection", "embed", "retrieve", "pack", "prompt"}
+    assert pipe.timings.header().count(";dur=") == 5
+
+
+@pytest.mark.asyncio
+async def test_pack_receives_collection_distance(collection_meta):
+    collection_meta["kb"] = qcli.CollectionMeta(name="kb", exists=True, vector_size=1, distance="Euclid")
+    seen = {}
+
+    def pack(scored, distance=None):
+        seen["distance"] = distance
+        return _pack(scored)
+
+    async def embed(texts, model=None):
+        return [[0.1]]
+
+    async def search(coll, *, query, top_k, filters, with_vectors):
+        return [_point("a", "alpha")]
+
+    await RagPipeline(collection="kb", top_k=1, pack=pack, build_prompt=_prompt, embed=embed, search=search).run("q")
+    assert seen["distance"] == "Euclid"
+
+
+@pytest.mark.asyncio
+async def test_missing_collection_skips_retrieval(collection_meta):
+    async def embed(texts, model=None):
+        return [[0.1]]
+
+    async def search(*a, **kw):
+        raise AssertionError("should not search a missing collection")
+
+    pipe = RagPipeline(collection="nope", top_k=3, pack=_pack, build_prompt=_prompt, embed=embed, search=search)
+    rc = await pipe.run("q")
+    assert rc.exists is False and rc.sources == [] and rc.prompt == ""
+    assert "retrieve" not in pipe.timings.as_dict()
+
+
+@pytest.mark.asyncio
+async def test_dimension_mismatch_and_embedding_errors(collection_meta):
+    collection_meta["kb"] = qcli.CollectionMeta(name="kb", exists=True, vector_size=768)
+
+    async def short_embed(texts, model=None):
+        return [[0.1, 0.2]]
+
+    pipe = RagPipeline(collection="kb", top_k=3, pack=_pack, build_prompt=_prompt, embed=short_embed)
+    with pytest.raises(DimensionMismatch) as ei:
+        await pipe.run("q")
+    assert (ei.value.expected, ei.value.got) == (768, 2)
+
+    async def empty_embed(texts, model=None):
+        return [[]]
+
+    pipe = RagPipeline(collection="kb", top_k=3, pack=_pack, build_prompt=_prompt, embed=empty_embed)
+    with pytest.raises(EmbeddingError):
+        await pipe.run("q")
+
+
+@pytest.mark.asyncio
+async def test_rag_preview_reports_server_timing(collection_meta, monkeypatch):
+    collection_meta["kb"] = qcli.CollectionMeta(name="kb", exists=True, vector_size=2)
+
+    async def embeddings(texts, model=None):
+        return [[0.5, 0.5]]
+
+    async def search_vectors(coll, *, query, top_k, filters, with_vectors=False):
+        return [_point("p1", "doc one")]
+
+    monkeypatch.setattr(rag_pipeline.embedding_cache, "embeddings", embeddings)
+    monkeypatch.setattr(qcli, "search_vectors", search_vectors)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post("/chat/rag_preview", json={"query": "q", "collection": "kb"})
+
+    assert r.status_code == 200
+    body = r.json()
+    assert [s["id"] for s in body["sources"]] == ["p1"]
+    assert {"embed", "collection", "retrieve", "pack"} <= set(body["meta"]["timings"])
+    assert "retrieve;dur=" in r.headers["server-timing"]
@@ -0,0 +1,44 @@
+import pytest
+
+from src.app.clients import qdrant as qcli
+from src.app.core import semantic_cache as sc
+
+KEY = ("faq", "emb", "gen", sc.params_hash(top_k=3, options=None, filters=None))
+ANSWER = {"response": "在设置页点击“忘记密码”。", "sources": [{"id": 1}]}
+
+
+@pytest.fixture
+def cache():
+    return sc.SemanticCache(max_distance=0.05, ttl=60.0, max_entries=4)
+
+
+def test_similar_query_hits_and_distant_query_misses(cache):
+    cache.store(KEY, [1.0, 0.0, 0.0], ANSWER, cost=1.5)
+    hit = cache.lookup(KEY, [0.99, 0.05, 0.0])
+    assert hit is not None
+    assert hit[0] == ANSWER and hit[1] > 0.95
+    assert cache.lookup(KEY, [0.0, 1.0, 0.0]) is None
+    # 参数不同（如 top_k）不共享缓存
+    other = KEY[:3] + (sc.params_hash(top_k=5, options=None, filters=None),)
+    assert cache.lookup(other, [1.0, 0.0, 0.0]) is None
+
+
+def test_entries_expire(cache):
+    cache.ttl = -1.0
+    cache.store(KEY, [1.0, 0.0], ANSWER)
+    assert cache.lookup(KEY, [1.0, 0.0]) is None
+    assert len(cache) == 0
+
+
+def test_collection_change_invalidates_bucket(cache):
+    cache.store(KEY, [1.0, 0.0], ANSWER)
+    assert cache.lookup(KEY, [1.0, 0.0]) is not None
+    qcli.catalog.bump_version("faq")
+    assert cache.lookup(KEY, [1.0, 0.0]) is None
+    assert len(cache) == 0
+
+
+def test_bounded_entries(cache):
+    for i in range(6):
+        cache.store(KEY, [1.0, float(i)], ANSWER)
+    assert len(cache) == 4
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from src.app.core.streaming import SSEStream, sse_line_frames
+
+
+async def _collect(stream):
+    return [frame async for frame in stream]
+
+
+@pytest.mark.asyncio
+async def test_small_chunks_are_coalesced_after_first_frame():
+    async def upstream():
+        for tok in ["He", "l", "lo", " ", "wor", "ld"]:
+            yield tok
+
+    frames = await _collect(SSEStream(upstream(), flush_ms=5, started_frame=b"data: [started]\n\n", done_frame=b"data: [done]\n\n"))
+    assert frames[0] == b"data: [started]\n\n"
+    assert frames[-1] == b"data: [done]\n\n"
+    data = frames[1:-1]
+    # 已到达的小分片合并为少量帧
+    assert len(data) < 6
+    assert b"".join(f[len(b"data: "):-2] for f in data) == b"Hello world"
+
+
+@pytest.mark.asyncio
+async def test_max_chunks_counts_upstream_chunks_and_closes_source():
+    closed = asyncio.Event()
+
+    async def upstream():
+        try:
+            for i in range(100):
+                yield f"t{i}"
+        finally:
+            closed.set()
+
+    frames = await _collect(SSEStream(upstream(), max_chunks=3, flush_ms=0))
+    assert b"".join(f[len(b"data: "):-2] for f in frames) == b"t0t1t2"
+    assert closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_bounded_queue_applies_backpressure_to_upstream():
+    produced = 0
+
+    async def upstream():
+        nonlocal produced
+        for i in range(50):
+            produced += 1
+            yield "x"
+
+    stream = SSEStream(upstream(), queue_size=4, flush_ms=0, flush_bytes=1).__aiter__()
+    first = await stream.__anext__()
+    assert first == b"data: x\n\n"
+    await asyncio.sleep(0.05)
+    # 消费端不读时，上游最多领先队列容量（+1 个正在 put 的分片）
+    assert produced <= 1 + 4 + 1
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_idle_stream_gets_heartbeats_and_errors_become_frames():
+    async def upstream():
+        await asyncio.sleep(0.25)
+        yield "late"
+        raise RuntimeError("boom")
+
+    frames = await _collect(SSEStream(upstream(), heartbeat_ms=80, done_frame=b"data: [done]\n\n"))
+    assert b"data: [heartbeat]\n\n" in frames
+    assert b"data: late\n\n" in frames
+    assert frames[-2] == b"data: [error]: RuntimeError: boom\n\n"
+    assert frames[-1] == b"data: [done]\n\n"
+
+
+@pytest.mark.asyncio
+async def test_line_frames_and_raise_errors():
+    assert sse_line_frames("a\nb") == b"data: a\n\ndata: b\n\n"
+
+    async def upstream():
+        yield "ok"
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        await _collect(SSEStream(upstream(), frame=sse_line_frames, raise_errors=True))
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from prometheus_client import REGISTRY
+from src.app.core.streaming import stream_until_disconnect, watch_generation
+
+
+class _FakeRequest:
+    """Minimal stand-in for starlette Request: receive() yields http.disconnect once released."""
+
+    def __init__(self):
+        self.gone = asyncio.Event()
+
+    async def receive(self):
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+
+def _count(model, outcome):
+    labels = {"model": model, "stream": "true", "outcome": outcome}
+    return REGISTRY.get_sample_value("llm_generate_duration_seconds_count", labels) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_disconnect_closes_upstream_and_records_aborted():
+    closed = asyncio.Event()
+
+    async def upstream():
+        try:
+            i = 0
+            while True:
+                i += 1
+                yield f"tok{i}"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    req = _FakeRequest()
+    received = []
+    before = _count("m-abort", "aborted")
+
+    async def consume():
+        async with watch_generation(req, model="m-abort") as watcher:
+            async for chunk in stream_until_disconnect(upstream(), watcher):
+                received.append(chunk)
+                if len(received) == 3:
+                    req.gone.set()
+
+    await asyncio.wait_for(consume(), timeout=1.0)
+    assert closed.is_set()
+    assert 3 <= len(received) < 10
+    assert _count("m-abort", "aborted") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_completed_stream_records_ok():
+    async def upstream():
+        for t in ("a", "b"):
+            yield t
+
+    before = _count("m-ok", "ok")
+    out = []
+    async with watch_generation(_FakeRequest(), model="m-ok") as watcher:
+        async for chunk in stream_until_disconnect(upstream(), watcher):
+            out.append(chunk)
+    assert out == ["a", "b"]
+    assert _count("m-ok", "ok") == before + 1
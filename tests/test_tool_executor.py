@@ -1,6 +1,7 @@
 import asyncio
 import uuid
 
+import httpx
 import pytest
 import respx
 from fastapi import HTTPException
@@ -121,3 +122,73 @@ async def test_http_post_invalid_url_400():
     with pytest.raises(HTTPException) as ei:
         await executor.execute(tenant, tool_type, tool_name, params, options)
     assert ei.value.status_code == 400
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_singleflight_shares_result_and_error():
+    from src.app.core.tool_executor import _SINGLEFLIGHT
+
+    async def slow_ok(request):
+        await asyncio.sleep(0.05)
+        return Response(200, text="shared")
+
+    ok_route = respx.get("https://sf.example.com/ok").mock(side_effect=slow_ok)
+    tenant = f"t-{uuid.uuid4()}"
+    options = {"timeout_ms": 1000, "rate_limit_per_sec": 100}
+    results = await asyncio.gather(*(
+        executor.execute(tenant, "http_get", "sf", {"url": "https://sf.example.com/ok"}, options) for _ in range(20)
+    ))
+    assert ok_route.call_count == 1
+    assert {r["body"] for r in results} == {"shared"}
+
+    async def slow_fail(request):
+        await asyncio.sleep(0.05)
+        raise httpx.ConnectError("boom")
+
+    fail_route = respx.get("https://sf.example.com/fail").mock(side_effect=slow_fail)
+    errors = await asyncio.gather(*(
+        executor.execute(tenant, "http_get", "sf", {"url": "https://sf.example.com/fail"}, options) for _ in range(5)
+    ), return_exceptions=True)
+    assert fail_route.call_count == 1
+    assert all(isinstance(e, HTTPException) and e.status_code == 502 for e in errors)
+    assert not any(k[1].startswith(tenant) for k in _SINGLEFLIGHT)
+
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_posts_are_not_collapsed():
+    async def slow_post(request):
+        await asyncio.sleep(0.05)
+        return Response(200, text=request.headers["content-type"])
+
+    route = respx.post("https://sf.example.com/post").mock(side_effect=slow_post)
+    tenant = f"t-{uuid.uuid4()}"
+    params = {"url": "https://sf.example.com/post", "body": "a=1"}
+    base = {"timeout_ms": 1000, "rate_limit_per_sec": 100}
+    results = await asyncio.gather(
+        executor.execute(tenant, "http_post", "sf", params, {**base, "content_type": "application/x-www-form-urlencoded"}),
+        executor.execute(tenant, "http_post", "sf", params, {**base, "content_type": "text/plain"}),
+    )
+    assert route.call_count == 2
+    assert [r["body"] for r in results] == ["application/x-www-form-urlencoded", "text/plain"]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_singleflight_key_includes_options():
+    async def slow_get(request):
+        await asyncio.sleep(0.05)
+        return Response(200, text="x" * 50)
+
+    route = respx.get("https://sf.example.com/opts").mock(side_effect=slow_get)
+    tenant = f"t-{uuid.uuid4()}"
+    params = {"url": "https://sf.example.com/opts"}
+    base = {"timeout_ms": 1000, "rate_limit_per_sec": 100}
+    results = await asyncio.gather(
+        executor.execute(tenant, "http_get", "sf", params, {**base, "resp_max_chars": 10}),
+        executor.execute(tenant, "http_get", "sf", params, {**base, "resp_max_chars": 20}),
+    )
+    assert route.call_count == 2
+    assert [len(r["body"]) for r in results] == [10, 20]
@@ -0,0 +1,112 @@
+import asyncio
+import uuid
+
+import pytest
+import respx
+from httpx import Response
+from prometheus_client import REGISTRY
+
+from src.app.core import tool_executor
+from src.app.core.tool_executor import HttpClientPool, _DnsCachingBackend
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_http_tools_reuse_pooled_client_per_host_and_timeout_class(monkeypatch):
+    pool = HttpClientPool(max_connections=4, max_clients=2)
+    monkeypatch.setattr(tool_executor, "http_pool", pool)
+    respx.get("https://a.example.com/x").mock(return_value=Response(200, text="A"))
+    respx.post("https://a.example.com/y").mock(return_value=Response(200, json={"ok": True}))
+    respx.get("https://b.example.com/").mock(return_value=Response(200, text="B"))
+    tenant = f"t-{uuid.uuid4()}"
+
+    await tool_executor.executor.execute(tenant, "http_get", "simple", {"url": "https://a.example.com/x"}, {"timeout_ms": 1000})
+    await tool_executor.executor.execute(tenant, "http_post", "simple", {"url": "https://a.example.com/y", "body": {}}, {"timeout_ms": 1500})
+    assert list(pool._clients) == [("https", "a.example.com", "fast")]
+    first = pool._clients[("https", "a.example.com", "fast")].client
+
+    await tool_executor.executor.execute(tenant, "http_get", "simple", {"url": "https://a.example.com/x"}, {"timeout_ms": 8000})
+    await tool_executor.executor.execute(tenant, "http_get", "simple", {"url": "https://b.example.com/"}, {"timeout_ms": 1000})
+    # 超出 max_clients 时淘汰最久未用的客户端
+    assert list(pool._clients) == [("https", "a.example.com", "slow"), ("https", "b.example.com", "fast")]
+    await pool.close()
+    assert first.is_closed and pool._clients == {}
+
+
+@pytest.mark.asyncio
+async def test_dns_cache_resolves_once_within_ttl(monkeypatch):
+    backend = _DnsCachingBackend(ttl=60.0)
+    lookups = []
+
+    async def lookup(host, port):
+        lookups.append(host)
+        return "10.0.0.7"
+
+    monkeypatch.setattr(backend, "_lookup", lookup)
+    assert await backend.resolve("api.example.com", 443) == "10.0.0.7"
+    assert await backend.resolve("api.example.com", 443) == "10.0.0.7"
+    assert await backend.resolve("127.0.0.1", 80) == "127.0.0.1"
+    assert lookups == ["api.example.com"]
+
+
+@pytest.mark.asyncio
+async def test_pooled_clients_honour_proxy_env(monkeypatch):
+    monkeypatch.setenv("HTTP_PROXY", "http://proxy.local:3128")
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.local:3128")
+    pool = HttpClientPool(dns_cache_ttl=30.0)
+    async with pool.client("https://a.example.com/", 1.0) as client:
+        assert len(client._mounts) == 2
+        # DNS 缓存仅作用于直连（NO_PROXY 命中时）的传输
+        assert client._transport._pool._network_backend is pool._backend
+    await pool.close()
+
+
+def test_loop_change_closes_stale_clients():
+    pool = HttpClientPool()
+
+    async def grab():
+        async with pool.client("https://a.example.com/", 1.0) as client:
+            return client
+
+    first = asyncio.run(grab())
+
+    async def second_loop():
+        await grab()
+        await asyncio.sleep(0)
+        await pool.close()
+
+    asyncio.run(second_loop())
+    assert first.is_closed
+
+
+@pytest.mark.asyncio
+async def test_evicted_client_drops_its_metric_series():
+    pool = HttpClientPool(max_clients=1)
+
+    def series(host):
+        return REGISTRY.get_sample_value("tools_http_pool_in_flight", {"host": host})
+
+    async with pool.client("https://evict-a.example.com/", 1.0):
+        pass
+    assert series("https://evict-a.example.com") == 0.0
+    async with pool.client("https://evict-b.example.com/", 1.0):
+        pass
+    await asyncio.gather(*pool._closing)
+    assert series("https://evict-a.example.com") is None
+    assert REGISTRY.get_sample_value("tools_http_pool_clients_created_total", {"host": "https://evict-a.example.com"}) is None
+    assert series("https://evict-b.example.com") == 0.0
+    await pool.close()
+    assert series("https://evict-b.example.com") is None
+
+
+@pytest.mark.asyncio
+async def test_dns_cache_is_bounded(monkeypatch):
+    backend = _DnsCachingBackend(ttl=60.0, max_entries=2)
+
+    async def lookup(host, port):
+        return "10.0.0.1"
+
+    monkeypatch.setattr(backend, "_lookup", lookup)
+    for host in ("a.test", "b.test", "c.test"):
+        await backend.resolve(host, 443)
+    assert list(backend._cache) == [("b.test", 443), ("c.test", 443)]
@@ -0,0 +1,244 @@
+import asyncio
+import math
+import time
+import uuid
+
+import pytest
+import respx
+from fastapi import HTTPException
+from httpx import Response
+
+from src.app.core import tool_state
+from src.app.core.tool_executor import executor
+from src.app.core.tool_state import MemoryStateBackend, RateRule, RedisStateBackend, StateTable
+
+
+class FakeRedis:
+    """In-process stand-in for redis.asyncio: get/set plus Python ports of the Lua scripts."""
+
+    def __init__(self):
+        self.kv = {}
+        self.zsets = {}
+        self.hashes = {}
+        self.fail = False
+
+    def register_script(self, source):
+        impl = {
+            tool_state.TOKEN_BUCKET_LUA: self._token_bucket,
+            tool_state.SLIDING_WINDOW_LUA: self._sliding_window,
+            tool_state.FIXED_WINDOW_LUA: self._fixed_window,
+            tool_state.BREAKER_ALLOW_LUA: self._breaker_allow,
+            tool_state.BREAKER_RECORD_LUA: self._breaker_record,
+        }[source]
+
+        async def run(keys, args):
+            if self.fail:
+                raise ConnectionError("redis down")
+            return impl(keys[0], args)
+
+        return run
+
+    def _token_bucket(self, key, args):
+        rate, burst = float(args[0]) / 1000, int(args[1])
+        now = int(time.time() * 1000)
+        h = self.hashes.setdefault(key, {"tokens": burst, "ts": now})
+        tokens = min(burst, h["tokens"] + max(0, now - h["ts"]) * rate)
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = math.ceil((1 - tokens) / rate)
+        h["tokens"], h["ts"] = tokens, now
+        return wait
+
+    def _fixed_window(self, key, args):
+        now = time.time()
+        n, expires = self.kv.get(key, (0, 0.0))
+        if expires <= now:
+            n, expires = 0, now + int(args[1]) / 1000
+        self.kv[key] = (n + 1, expires)
+        return max(1, int((expires - now) * 1000)) if n + 1 > int(args[0]) else 0
+
+    def _sliding_window(self, key, args):
+        limit, window = int(args[0]), int(args[1])
+        now = int(time.time() * 1000)
+        log = [t for t in self.zsets.get(key, []) if t > now - window]
+        self.zsets[key] = log
+        if len(log) >= limit:
+            return max(1, log[0] + window - now)
+        log.append(now)
+        return 0
+
+    def _breaker_allow(self, key, args):
+        now = int(time.time() * 1000)
+        h = self.hashes.get(key, {})
+        if not h.get("open_until"):
+            return 1
+        if now < h["open_until"] or now < h.get("probe_until", 0):
+            return 0
+        h["probe_until"] = now + int(args[0])
+        return 2
+
+    def _breaker_record(self, key, args):
+        now = int(time.time() * 1000)
+        h = self.hashes.setdefault(key, {})
+        open_until = h.get("open_until", 0)
+        if args[0] == "1":
+            if now >= open_until:
+                self.hashes.pop(key, None)
+            return 0
+        h["fails"] = h.get("fails", 0) + 1
+        if open_until > 0 or h["fails"] >= int(args[1]):
+            h["open_until"], h["probe_until"] = now + int(args[2]), 0
+        return h["fails"]
+
+    async def get(self, key):
+        if self.fail:
+            raise ConnectionError("redis down")
+        value, expires = self.kv.get(key, (None, 0.0))
+        return value if expires > time.time() else None
+
+    async def set(self, key, value, px=None):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.kv[key] = (value.encode("utf-8"), time.time() + px / 1000.0)
+
+    async def aclose(self):
+        pass
+
+
+def _memory():
+    return MemoryStateBackend(max_entries=100, cache_max_entries=100, breaker_idle_ttl=60.0)
+
+
+def _workers(kind):
+    if kind == "memory":
+        shared = _memory()
+        return shared, shared
+    fake = FakeRedis()
+    return tuple(RedisStateBackend(prefix="t:", fallback=_memory(), idle_ttl=60.0, client=fake) for _ in range(2))
+
+
+def test_state_table_bounds_entries_and_expires():
+    table = StateTable("test", max_entries=2, ttl=60.0)
+    table.set("a", 1)
+    table.set("b", 2)
+    assert table.get("a") == 1  # a 变为最近使用
+    table.set("c", 3)
+    assert table.get("b") is None and len(table) == 2
+
+    table.set("gone", 4, ttl=0.0)
+    assert table.get("gone") is None
+    table.set("d", 5, ttl=0.0)
+    assert table.sweep() == 1
+    assert table.get("c") == 3 and len(table) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+async def test_breaker_half_open_allows_a_single_probe(kind):
+    w1, w2 = _workers(kind)
+    await w1.breaker_record("cb:k", False, threshold=1, cooldown_s=0.05)
+    assert not await w2.breaker_allow("cb:k", cooldown_s=0.05)
+    await asyncio.sleep(0.06)
+    assert await w2.breaker_allow("cb:k", cooldown_s=0.05)
+    # 探测进行中，其他调用仍被拒绝
+    assert not await w1.breaker_allow("cb:k", cooldown_s=0.05)
+    await w2.breaker_record("cb:k", True, threshold=1, cooldown_s=0.05)
+    assert await w1.breaker_allow("cb:k", cooldown_s=0.05)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+async def test_rate_algorithms(kind):
+    backend, _ = _workers(kind)
+    bucket = RateRule(algorithm="token_bucket", rate=20, burst=3)
+    assert [await backend.rate_acquire("tb", bucket) for _ in range(3)] == [0.0] * 3
+    wait = await backend.rate_acquire("tb", bucket)
+    assert 0.0 < wait <= 0.06
+    await asyncio.sleep(wait + 0.01)
+    assert await backend.rate_acquire("tb", bucket) == 0.0
+
+    for algorithm in ("sliding_window", "fixed_window"):
+        rule = RateRule(algorithm=algorithm, rate=10, burst=1, window_s=0.2)
+        assert [await backend.rate_acquire(algorithm, rule) for _ in range(2)] == [0.0, 0.0]
+        wait = await backend.rate_acquire(algorithm, rule)
+        assert 0.0 < wait <= 0.2
+        await asyncio.sleep(wait + 0.01)
+        assert await backend.rate_acquire(algorithm, rule) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_shares_rate_and_cache_across_workers():
+    w1, w2 = _workers("redis")
+    rule = RateRule(algorithm="sliding_window", rate=2, burst=2)
+    assert await w1.rate_acquire("rl:k", rule) == 0.0
+    assert await w2.rate_acquire("rl:k", rule) == 0.0
+    wait = await w1.rate_acquire("rl:k", rule)
+    assert 0.0 < wait <= 1.0
+
+    await w1.cache_put("cache:k", {"body": "共享"}, 60.0)
+    assert await w2.cache_get("cache:k") == {"body": "共享"}
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_executor_uses_policy_backend_and_degrades_when_redis_fails():
+    fake = FakeRedis()
+    tool_state.set_backend("redis", RedisStateBackend(prefix="t:", fallback=_memory(), idle_ttl=60.0, client=fake))
+    respx.get("https://state.example.com/").mock(return_value=Response(200, text="OK"))
+    tenant = f"t-{uuid.uuid4()}"
+    params = {"url": "https://state.example.com/"}
+    options = {"timeout_ms": 1000, "cache_ttl_ms": 60000, "state_backend": "redis"}
+    try:
+        assert (await executor.execute(tenant, "http_get", "simple", params, options))["from_cache"] is False
+        assert (await executor.execute(tenant, "http_get", "simple", params, options))["from_cache"] is True
+        assert any(k.startswith("t:cache:") for k in fake.kv)
+
+        fake.fail = True
+        r = await executor.execute(tenant, "http_get", "other", params, options)
+        assert r["http"]["status_code"] == 200
+
+        with pytest.raises(HTTPException) as ei:
+            await executor.execute(tenant, "http_get", "simple", params, {"state_backend": "etcd"})
+        assert ei.value.status_code == 400
+    finally:
+        tool_state.set_backend("redis", None)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_executor_waits_for_token_or_rejects_with_retry_after():
+    respx.get("https://wait.example.com/").mock(return_value=Response(200, text="OK"))
+    tenant = f"t-{uuid.uuid4()}"
+    params = {"url": "https://wait.example.com/"}
+    options = {"timeout_ms": 1000, "rate_limit_per_sec": 5, "rate_limit_burst": 1, "rate_limit_max_wait_ms": 500}
+
+    await executor.execute(tenant, "http_get", "wait", params, options)
+    t0 = time.perf_counter()
+    r = await executor.execute(tenant, "http_get", "wait", params, options)
+    assert r["http"]["status_code"] == 200
+    assert time.perf_counter() - t0 >= 0.1
+
+    with pytest.raises(HTTPException) as ei:
+        await executor.execute(tenant, "http_get", "wait", params, {**options, "rate_limit_max_wait_ms": 0})
+    assert ei.value.status_code == 429 and ei.value.headers["Retry-After"] == "1"
+
+    with pytest.raises(HTTPException) as ei:
+        await executor.execute(tenant, "http_get", "wait", params, {"rate_limit_algorithm": "leaky"})
+    assert ei.value.status_code == 400
+
+
+def test_shipped_policies_leave_defaults_to_settings(monkeypatch):
+    from src.app.config import settings
+    from src.app.routers.tools import _policy_merge_options
+
+    monkeypatch.setattr(settings, "TOOLS_RATE_LIMIT_ALGORITHM", "sliding_window")
+    monkeypatch.setattr(settings, "TOOLS_RATE_LIMIT_MAX_WAIT_MS", 200)
+    rule, max_wait = executor._rate_rule(_policy_merge_options("default", "http_get", "simple", {}))
+    assert rule.algorithm == "sliding_window" and max_wait == 0.2
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        tool_state.StateBackend()
@@ -0,0 +1,75 @@
+import asyncio
+import uuid
+
+import pytest
+import redis.asyncio as aioredis
+
+from src.app.config import settings
+from src.app.core.tool_state import RateRule, RedisStateBackend
+
+# 直接在真实 Redis 上执行 Lua 脚本；没有可用的 redis-server 时跳过
+
+
+class _NoFallback:
+    """Fail loudly instead of silently degrading to in-process state when a script errors."""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"redis call fell back to in-process state ({name})")
+
+
+async def _backend_or_skip():
+    client = aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, socket_connect_timeout=0.5, socket_timeout=2.0)
+    try:
+        await client.ping()
+    except Exception as e:
+        await client.aclose()
+        pytest.skip(f"redis-server not available: {type(e).__name__}")
+    prefix = f"test:{uuid.uuid4().hex}:"
+    return RedisStateBackend(prefix=prefix, fallback=_NoFallback(), idle_ttl=60.0, client=client), client, prefix
+
+
+async def _cleanup(client, prefix):
+    keys = [k async for k in client.scan_iter(match=prefix + "*")]
+    if keys:
+        await client.delete(*keys)
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_scripts_on_redis():
+    backend, client, prefix = await _backend_or_skip()
+    try:
+        bucket = RateRule(algorithm="token_bucket", rate=20, burst=3)
+        assert [await backend.rate_acquire("tb", bucket) for _ in range(3)] == [0.0] * 3
+        wait = await backend.rate_acquire("tb", bucket)
+        assert 0.0 < wait <= 0.06
+        await asyncio.sleep(wait + 0.01)
+        assert await backend.rate_acquire("tb", bucket) == 0.0
+
+        for algorithm in ("sliding_window", "fixed_window"):
+            rule = RateRule(algorithm=algorithm, rate=10, burst=1, window_s=0.2)
+            assert [await backend.rate_acquire(algorithm, rule) for _ in range(2)] == [0.0, 0.0]
+            wait = await backend.rate_acquire(algorithm, rule)
+            assert 0.0 < wait <= 0.2
+            await asyncio.sleep(wait + 0.01)
+            assert await backend.rate_acquire(algorithm, rule) == 0.0
+    finally:
+        await _cleanup(client, prefix)
+
+
+@pytest.mark.asyncio
+async def test_breaker_scripts_on_redis():
+    backend, client, prefix = await _backend_or_skip()
+    try:
+        await backend.breaker_record("cb", False, threshold=1, cooldown_s=0.1)
+        assert not await backend.breaker_allow("cb", cooldown_s=0.1)
+        await asyncio.sleep(0.12)
+        assert await backend.breaker_allow("cb", cooldown_s=0.1)
+        assert not await backend.breaker_allow("cb", cooldown_s=0.1)
+        await backend.breaker_record("cb", True, threshold=1, cooldown_s=0.1)
+        assert await backend.breaker_allow("cb", cooldown_s=0.1)
+
+        await backend.cache_put("cache", {"body": "共享"}, 60.0)
+        assert await backend.cache_get("cache") == {"body": "共享"}
+    finally:
+        await _cleanup(client, prefix)